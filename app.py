@@ -11,17 +11,27 @@ import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import plotly.graph_objects as go
 import plotly.express as px
 import plotly.io as pio
 from plotly.tools import mpl_to_plotly
 import dash_table
 
+import time
+
+import flask
+
 from loan_analytics.main import *
 from loan_analytics.Helper import *
 from loan_analytics.Loan import Loan
 from loan_analytics.LoanPortfolio import LoanPortfolio
+from loan_analytics.LoanSolver import LoanSolver
+from loan_analytics.Instrumentation import instrumentation
 from loan_analytics.LoanImpacts import LoanImpacts
+from loan_analytics.Schedule import Schedule
+from loan_analytics.ScheduleCache import schedule_cache
+from loan_analytics.TableQuery import TableQuery
 from loan_analytics.Test_Loans import *
 
 import pandas as pd
@@ -39,11 +49,45 @@ import numpy as np
 
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 
+# Parameter validation is timed like the other stages when instrumentation is enabled
+test_loan = instrumentation.timed('validation')(test_loan)
+
+#%% Instrumentation: time whole requests, callback plus JSON serialization, and expose the spans at /metrics
+
+@app.server.before_request
+def start_request_span():
+    if instrumentation.enabled:
+        flask.g.request_start = time.perf_counter()
+
+@app.server.after_request
+def stop_request_span(response):
+    if instrumentation.enabled and 'request_start' in flask.g:
+        instrumentation.record('request.' + flask.request.path, time.perf_counter() - flask.g.request_start)
+        instrumentation.count('response_bytes.' + flask.request.path, response.calculate_content_length() or 0)
+    return response
+
+@app.server.route('/metrics')
+def metrics():
+    gauges = {'schedule_cache_' + name: value for name, value in schedule_cache.stats().items()}
+    return flask.Response(instrumentation.export_text(gauges=gauges), mimetype='text/plain; version=0.0.4')
+
 
 layout = dict(
     title_align_style = 'center'
     )
 
+# Schedule tables are paged, sorted and filtered on the server, so only the visible page is sent to the browser
+table_options = dict(
+    page_current=0,
+    page_size=25,
+    page_action='custom',
+    sort_action='custom',
+    sort_mode='multi',
+    sort_by=[],
+    filter_action='custom',
+    filter_query=''
+    )
+
 app.layout = html.Div([
     dcc.Location(id='url', refresh=False),
     html.Div(id='page-content')
@@ -83,6 +127,16 @@ page_1_layout = html.Div([
     dcc.Link('Go back to home', href='/'),
     html.Br(),
     
+    dcc.RadioItems(
+        id='page-1-solve-for',
+        options=[
+            {'label': ' Schedule for the payment', 'value': 'schedule'},
+            {'label': ' Payment for the term', 'value': 'payment'},
+            {'label': ' Affordable principal for the payment and term', 'value': 'principal'}],
+        value='schedule',
+        labelStyle={'display': 'block'}
+        ),
+    
     dbc.Row(
         children = 
             [
@@ -137,6 +191,20 @@ page_1_layout = html.Div([
                             value=0
                         )
                     ]
+                ),
+            dbc.Col(
+                children = 
+                    [
+                        html.Div('Term (Months)'),
+                        dcc.Input(
+                            id='page-1-term',
+                            placeholder='Term (Months)',
+                            type='number',
+                            min=1,
+                            step=1,
+                            value=12
+                        )
+                    ]
                 )
             ]
             ),
@@ -144,6 +212,9 @@ page_1_layout = html.Div([
     
     html.Div(id='page-1-parameter-check', children = ""),
     
+    # validated loan parameters of the last Submit, read back by the pie chart callback
+    dcc.Store(id='page-1-loan-store'),
+    
     dbc.Row(
         children = 
         [
@@ -173,28 +244,36 @@ page_1_layout = html.Div([
     html.Br(),
     html.H3('Payback Schedule Details'),
     
-    dash_table.DataTable(id='loan-table')
+    dash_table.DataTable(id='loan-table', **table_options)
 ])
 
 @app.callback([dash.dependencies.Output('page-1-parameter-check', 'children'),
                dash.dependencies.Output('bar_plot_loan_cashflow', 'figure'),
                dash.dependencies.Output('bar_plot_loan_balance_and_interest', 'figure'),
                dash.dependencies.Output('page-1-pie-month', 'options'),
-               dash.dependencies.Output('pie_loan', 'figure'),
+               dash.dependencies.Output('page-1-loan-store', 'data'),
                dash.dependencies.Output('loan-table', 'columns'),
-               dash.dependencies.Output('loan-table', 'data')],
+               dash.dependencies.Output('page-1-loan_principal', 'value'),
+               dash.dependencies.Output('page-1-payment', 'value')],
               
-              [Input(component_id='submit-loan-1',component_property='n_clicks'),
-               Input(component_id='submit-loan-2',component_property='n_clicks')],
+              [Input(component_id='submit-loan-1',component_property='n_clicks')],
               
               [dash.dependencies.State('page-1-loan_principal', 'value'),
                dash.dependencies.State('page-1-interest', 'value'),
                dash.dependencies.State('page-1-payment', 'value'),
                dash.dependencies.State('page-1-extra-payment', 'value'),
-               dash.dependencies.State('page-1-pie-month', 'value')])
-def loan_func(n_clicks_1,n_clicks_2, principal, rate, payment, extra_payment, i):
+               dash.dependencies.State('page-1-solve-for', 'value'),
+               dash.dependencies.State('page-1-term', 'value')])
+@instrumentation.timed('callback')
+def loan_func(n_clicks_1, principal, rate, payment, extra_payment, solve_for='schedule', term=None):
+    # Solve for the payment or the principal first when asked, and write the solution back to its input
+    solved = solve_loan(solve_for, principal, rate, payment, extra_payment, term)
+    if solved[0] == 1:
+        principal, payment = solved[2], solved[3]
+    entered_principal, entered_payment = principal, payment
+    
     # See if the parameters are valid
-    test_result = test_loan(principal, rate, payment, extra_payment)
+    test_result = test_loan(principal, rate, payment, extra_payment) if solved[0] == 1 else solved
     
     if test_result[0] != 1:
         # Use parameters below to make plot if parameters are not valid
@@ -208,13 +287,88 @@ def loan_func(n_clicks_1,n_clicks_2, principal, rate, payment, extra_payment, i)
     current_loan.compute_schedule()
     current_loan_schedule = current_loan.return_loan_schedule()
     
-    bar_plot_loan_cashflow = Helper.bar_plot_loan_cashflow(current_loan_schedule)
+    bar_plot_loan_cashflow = Helper.bar_plot_loan_cashflow(current_loan_schedule, engine='graph_objects', resolution='auto')
     
-    bar_plot_loan_balance_and_interest = Helper.bar_plot_loan_balance_and_interest(current_loan_schedule)
+    bar_plot_loan_balance_and_interest = Helper.bar_plot_loan_balance_and_interest(current_loan_schedule, engine='graph_objects', resolution='auto')
     
-    pie_loan = Helper.pie_loan(current_loan_schedule, i)
+    loan_store = [principal, rate, payment, extra_payment]
+    message = str(test_result[1])
+    if test_result[0] == 1:
+        message = f'{solved[1]}Paid off in {len(current_loan.schedule)} months. {message}'
     
-    return str(test_result[1]), bar_plot_loan_cashflow, bar_plot_loan_balance_and_interest,[{'label': month, 'value': month} for month in range(1,current_loan_schedule.shape[0] + 1)], pie_loan, [{"name": i, "id": i} for i in current_loan_schedule.columns], current_loan_schedule.to_dict('records')
+    return message, bar_plot_loan_cashflow, bar_plot_loan_balance_and_interest,[{'label': month, 'value': month} for month in range(1,current_loan_schedule.shape[0] + 1)], loan_store, [{"name": i, "id": i} for i in current_loan_schedule.columns], entered_principal, entered_payment
+
+def solve_loan(solve_for, principal, rate, payment, extra_payment, term):
+    """ Solve the page 1 inputs for the payment that pays the principal off in the term, or for the largest principal
+        the payment pays off in the term.
+        :return: tuple (1, description of the solution, principal, payment) or (ValueError, error) like test_loan
+    """
+    if solve_for in (None, 'schedule'):
+        return 1, '', principal, payment
+    try:
+        if None in (rate, extra_payment, term) or (principal if solve_for == 'payment' else payment) is None:
+            raise ValueError('Warning: Please enter every parameter of the loan')
+        if solve_for == 'payment':
+            payment = float(LoanSolver.payment_for_term(principal, rate, int(term), extra_payment))
+            return 1, f'Payment for {int(term)} months: {payment:.2f}. ', principal, payment
+        principal = float(LoanSolver.max_principal(rate, payment, int(term), extra_payment))
+        return 1, f'Affordable principal for {int(term)} months: {principal:.2f}. ', principal, payment
+    except ValueError as ex:
+        return ValueError, ex
+
+@app.callback(dash.dependencies.Output('pie_loan', 'figure'),
+              
+              [Input(component_id='submit-loan-2',component_property='n_clicks'),
+               Input(component_id='page-1-loan-store',component_property='data')],
+              
+              [dash.dependencies.State('page-1-pie-month', 'value')])
+@instrumentation.timed('callback')
+def loan_pie_func(n_clicks_2, loan_store, i):
+    # Only re-render the pie chart: the schedule of the submitted loan comes back from the schedule cache
+    if loan_store is None:
+        raise PreventUpdate
+    
+    current_loan = Loan(*loan_store)
+    current_loan.compute_schedule()
+    i = pie_month(i, len(current_loan.schedule))
+    
+    pie_loan = Helper.pie_loan(month_frame([current_loan], i), i, engine='graph_objects')
+    
+    return pie_loan
+
+@app.callback([dash.dependencies.Output('loan-table', 'data'),
+               dash.dependencies.Output('loan-table', 'page_count')],
+              
+              [Input(component_id='loan-table',component_property='page_current'),
+               Input(component_id='loan-table',component_property='page_size'),
+               Input(component_id='loan-table',component_property='sort_by'),
+               Input(component_id='loan-table',component_property='filter_query'),
+               Input(component_id='page-1-loan-store',component_property='data')])
+@instrumentation.timed('callback')
+def loan_table_func(page_current, page_size, sort_by, filter_query, loan_store):
+    # Serialize the visible page of the submitted loan schedule, which comes back from the schedule cache
+    if loan_store is None:
+        raise PreventUpdate
+    
+    current_loan = Loan(*loan_store)
+    current_loan.compute_schedule()
+    
+    return TableQuery(page_current, page_size, sort_by, filter_query).apply(current_loan.return_loan_schedule())
+
+def pie_month(i, months):
+    """ Clamp the month picked for a pie chart to the schedule, which may have shrunk since the last Submit.
+    """
+    return min(max(int(i or 1), 1), max(months, 1))
+
+def month_frame(current_loans, i, loan_ids=None):
+    """ Build the one month rows the pie charts need straight from the loan schedules, rounded like the tables.
+    """
+    rows = [current_loan.schedule[i] for current_loan in current_loans if i in current_loan.schedule]
+    month_schedule = pd.DataFrame(rows, columns=Schedule.columns, index=[row[0] for row in rows]).round(2)
+    if loan_ids is not None:
+        month_schedule['Loan_ID'] = [loan_id for loan_id, current_loan in zip(loan_ids, current_loans)
+                                     if i in current_loan.schedule]
+    return month_schedule
 
 #%%
 
@@ -422,6 +576,9 @@ page_2_layout = html.Div([
     
     dbc.Button(id = 'submit-portfolio-1',n_clicks = 0, children = "Submit", outline=True, color="primary", className="mr-1"),
     
+    # validated parameters of the loans of the last Submit, read back by the pie chart callback
+    dcc.Store(id='page-2-portfolio-store'),
+    
     dbc.Row(
         children = 
         [
@@ -451,7 +608,7 @@ page_2_layout = html.Div([
     html.Br(),
     html.H3('Payback Schedule Details'),
     
-    dash_table.DataTable(id='portfolio-table')
+    dash_table.DataTable(id='portfolio-table', **table_options)
     
 ])
 
@@ -468,13 +625,11 @@ page_2_layout = html.Div([
                
                dash.dependencies.Output('bar_plot_portfolio_cashflow', 'figure'),
                dash.dependencies.Output('bar_plot_portfolio_balance_and_interest', 'figure'),
-               dash.dependencies.Output('pie_portfolio', 'figure'),
+               dash.dependencies.Output('page-2-portfolio-store', 'data'),
                
-               dash.dependencies.Output('portfolio-table', 'columns'),
-               dash.dependencies.Output('portfolio-table', 'data')],
+               dash.dependencies.Output('portfolio-table', 'columns')],
               
               [dash.dependencies.Input('submit-portfolio-1', 'n_clicks'),
-               dash.dependencies.Input('submit-portfolio-2', 'n_clicks'),
                dash.dependencies.Input('loan-count', 'value')],
               
               [dash.dependencies.State('page-2-loan-principal-a', 'value'),
@@ -490,10 +645,9 @@ page_2_layout = html.Div([
                dash.dependencies.State('page-2-loan-principal-c', 'value'),
                dash.dependencies.State('page-2-interest-c', 'value'),
                dash.dependencies.State('page-2-payment-c', 'value'),
-               dash.dependencies.State('page-2-extra-payment-c', 'value'),
-               
-               dash.dependencies.State('page-2-pie-month', 'value')])
-def portfolio_func(n_clicks_1, n_clicks_2, loan_count, principal_a, rate_a, payment_a, extra_payment_a, principal_b, rate_b, payment_b, extra_payment_b,principal_c, rate_c, payment_c, extra_payment_c, i):
+               dash.dependencies.State('page-2-extra-payment-c', 'value')])
+@instrumentation.timed('callback')
+def portfolio_func(n_clicks_1, loan_count, principal_a, rate_a, payment_a, extra_payment_a, principal_b, rate_b, payment_b, extra_payment_b,principal_c, rate_c, payment_c, extra_payment_c):
     #%% Test each loan
     # Test for loan A
     test_result_a = test_loan(principal_a, rate_a, payment_a, extra_payment_a)
@@ -546,7 +700,7 @@ def portfolio_func(n_clicks_1, n_clicks_2, loan_count, principal_a, rate_a, paym
     loan_b_schedule['Loan_ID'] = 'B'
     loan_c_schedule['Loan_ID'] = 'C'
 
-    schedule_by_loan = loan_a_schedule.append(loan_b_schedule).append(loan_c_schedule).reset_index().drop('index', axis=1)
+    schedule_by_loan = pd.concat([loan_a_schedule, loan_b_schedule, loan_c_schedule]).reset_index().drop('index', axis=1)
     
     #%% Calculate portfolio matrix
     loans = LoanPortfolio()
@@ -569,43 +723,87 @@ def portfolio_func(n_clicks_1, n_clicks_2, loan_count, principal_a, rate_a, paym
 #         loan_c_schedule['Loan_ID'] = 'C'
 # =============================================================================
     
-        schedule_by_loan = loan_a_schedule.append(loan_b_schedule).reset_index().drop('index', axis=1)
+        schedule_by_loan = pd.concat([loan_a_schedule, loan_b_schedule]).reset_index().drop('index', axis=1)
         
         if test_result_a[0] == 1 and test_result_b[0] == 1:
-            loans = add_and_compute_schedule(principal_a, rate_a, payment_a, extra_payment_a)
-            loans= add_and_compute_schedule(principal_b, rate_b, payment_b, extra_payment_b)
+            portfolio_store = [[principal_a, rate_a, payment_a, extra_payment_a],
+                               [principal_b, rate_b, payment_b, extra_payment_b]]
             
         else:
-            loans = add_and_compute_schedule(1, 0, 1, 0)
-            loans= add_and_compute_schedule(1, 0, 1, 0)
+            portfolio_store = [[1, 0, 1, 0]] * 2
             
     else:
         if test_result_a[0] == 1 and test_result_b[0] == 1 and test_result_c[0] == 1:
-            loans = add_and_compute_schedule(principal_a, rate_a, payment_a, extra_payment_a)
-            loans= add_and_compute_schedule(principal_b, rate_b, payment_b, extra_payment_b)
-            loans= add_and_compute_schedule(principal_c, rate_c, payment_c, extra_payment_c)
+            portfolio_store = [[principal_a, rate_a, payment_a, extra_payment_a],
+                               [principal_b, rate_b, payment_b, extra_payment_b],
+                               [principal_c, rate_c, payment_c, extra_payment_c]]
             
         else:
-            loans = add_and_compute_schedule(1, 0, 1, 0)
-            loans= add_and_compute_schedule(1, 0, 1, 0)
-            loans= add_and_compute_schedule(1, 0, 1, 0)
-            
+            portfolio_store = [[1, 0, 1, 0]] * 3
+    
+    # the parameters of the aggregated portfolio are also stored, so the pie chart and the table show the same loans
+    loans = add_and_compute_schedules(*(list(parameters) for parameters in zip(*portfolio_store)))
     loans.aggregate()
     
     portfolio_schedule = loans.return_portfolio_schedule()
     portfolio_schedule['Accumulated_Interest'] = round(portfolio_schedule['Accumulated_Interest'],2)
     
     #%% make plots
-    bar_plot_portfolio_cashflow = Helper.bar_plot_portfolio_cashflow(schedule_by_loan)
+    bar_plot_portfolio_cashflow = Helper.bar_plot_portfolio_cashflow(schedule_by_loan, engine='graph_objects', resolution='auto')
     
-    bar_plot_portfolio_balance_and_interest = Helper.bar_plot_portfolio_balance_and_interest(schedule_by_loan, portfolio_schedule)
+    bar_plot_portfolio_balance_and_interest = Helper.bar_plot_portfolio_balance_and_interest(schedule_by_loan, portfolio_schedule, engine='graph_objects', resolution='auto')
     
-    pie_portfolio = Helper.pie_portfolio(schedule_by_loan, i)
     #%%
-    if n_clicks_1 != -1 or n_clicks_2 != -1:
+    if n_clicks_1 != -1:
         loans.reset()
     
-    return str(test_result_a[1]), str(test_result_b[1]), str(test_result_c[1]), disable_factor, disable_factor, disable_factor, disable_factor, [{'label': month, 'value': month} for month in range(1,portfolio_schedule.shape[0] + 1)], bar_plot_portfolio_cashflow, bar_plot_portfolio_balance_and_interest, pie_portfolio, [{"name": i, "id": i} for i in portfolio_schedule.columns], portfolio_schedule.to_dict('records')
+    return str(test_result_a[1]), str(test_result_b[1]), str(test_result_c[1]), disable_factor, disable_factor, disable_factor, disable_factor, [{'label': month, 'value': month} for month in range(1,portfolio_schedule.shape[0] + 1)], bar_plot_portfolio_cashflow, bar_plot_portfolio_balance_and_interest, portfolio_store, [{"name": i, "id": i} for i in portfolio_schedule.columns]
+
+@app.callback(dash.dependencies.Output('pie_portfolio', 'figure'),
+              
+              [dash.dependencies.Input('submit-portfolio-2', 'n_clicks'),
+               dash.dependencies.Input('page-2-portfolio-store', 'data')],
+              
+              [dash.dependencies.State('page-2-pie-month', 'value')])
+@instrumentation.timed('callback')
+def portfolio_pie_func(n_clicks_2, portfolio_store, i):
+    # Only re-render the pie chart: the schedules of the submitted loans come back from the schedule cache
+    if portfolio_store is None:
+        raise PreventUpdate
+    
+    current_loans = [Loan(*loan_store) for loan_store in portfolio_store]
+    for current_loan in current_loans:
+        current_loan.compute_schedule()
+    i = pie_month(i, max(len(current_loan.schedule) for current_loan in current_loans))
+    
+    pie_portfolio = Helper.pie_portfolio(month_frame(current_loans, i, loan_ids=['A', 'B', 'C']), i, engine='graph_objects')
+    
+    return pie_portfolio
+
+@app.callback([dash.dependencies.Output('portfolio-table', 'data'),
+               dash.dependencies.Output('portfolio-table', 'page_count')],
+              
+              [dash.dependencies.Input('portfolio-table', 'page_current'),
+               dash.dependencies.Input('portfolio-table', 'page_size'),
+               dash.dependencies.Input('portfolio-table', 'sort_by'),
+               dash.dependencies.Input('portfolio-table', 'filter_query'),
+               dash.dependencies.Input('page-2-portfolio-store', 'data')])
+@instrumentation.timed('callback')
+def portfolio_table_func(page_current, page_size, sort_by, filter_query, portfolio_store):
+    # Serialize the visible page of the portfolio schedule, summed from the cached schedules of the submitted loans
+    if portfolio_store is None:
+        raise PreventUpdate
+    
+    loans = LoanPortfolio()
+    for loan_store in portfolio_store:
+        current_loan = Loan(*loan_store)
+        current_loan.compute_schedule()
+        loans.add_loan(current_loan)
+    
+    portfolio_schedule = loans.return_portfolio_schedule()
+    portfolio_schedule['Accumulated_Interest'] = round(portfolio_schedule['Accumulated_Interest'],2)
+    
+    return TableQuery(page_current, page_size, sort_by, filter_query).apply(portfolio_schedule)
 
 
 #%%
@@ -719,6 +917,9 @@ page_3_layout = html.Div([
     
     html.Div(id='page-3-parameter-check', children = ""),
     
+    # validated loan parameters and contributions of the last Submit, read back by the table callback
+    dcc.Store(id='page-3-impact-store'),
+    
     dbc.Row(
         children = 
         [
@@ -731,7 +932,7 @@ page_3_layout = html.Div([
     html.Br(),
     html.H3('Contribution Impact Details'),
     
-    dash_table.DataTable(id='impact-table')
+    dash_table.DataTable(id='impact-table', **table_options)
 ])
 
 @app.callback([dash.dependencies.Output('page-3-parameter-check', 'children'),
@@ -739,7 +940,7 @@ page_3_layout = html.Div([
                dash.dependencies.Output('pie_interest', 'figure'),
                dash.dependencies.Output('pie_duration', 'figure'),
                dash.dependencies.Output('impact-table', 'columns'),
-               dash.dependencies.Output('impact-table', 'data')],
+               dash.dependencies.Output('page-3-impact-store', 'data')],
               
               [dash.dependencies.Input('submit-impact', 'n_clicks')],
               
@@ -750,6 +951,7 @@ page_3_layout = html.Div([
                dash.dependencies.State('page-3-contribution-a', 'value'),
                dash.dependencies.State('page-3-contribution-b', 'value'),
                dash.dependencies.State('page-3-contribution-c', 'value')])
+@instrumentation.timed('callback')
 def impact_func(n_clicks, principal, rate, payment, extra_payment, a, b ,c):
     # See if the parameters are valid
     test_result = test_loan(principal, rate, payment, extra_payment)
@@ -762,8 +964,8 @@ def impact_func(n_clicks, principal, rate, payment, extra_payment, a, b ,c):
         extra_payment = 0
     
     # Start calculation
-    impact_df = LoanImpacts(principal, rate, payment, extra_payment, [a,b,c]).compute_impacts()
-    impact_df['Case'] = ['All Help','No Help','A Quit','B Quit','C Quit']
+    impact_store = [principal, rate, payment, extra_payment, [a,b,c]]
+    impact_df = impact_frame(impact_store)
     
     impact_df_interest = impact_df.loc[:,['Case','Interest_Paid']]
     impact_df_duration = impact_df.loc[:,['Case','Duration']]
@@ -780,7 +982,35 @@ def impact_func(n_clicks, principal, rate, payment, extra_payment, a, b ,c):
     cols = cols[-1:] + cols[:-1]
     impact_df_adjusted = impact_df[cols]
     
-    return str(test_result[1]), bar_plot_duration_interest, pie_interest, pie_duration,[{"name": i, "id": i} for i in impact_df_adjusted.columns], impact_df_adjusted.to_dict('records')
+    return str(test_result[1]), bar_plot_duration_interest, pie_interest, pie_duration,[{"name": i, "id": i} for i in impact_df_adjusted.columns], impact_store
+
+@app.callback([dash.dependencies.Output('impact-table', 'data'),
+               dash.dependencies.Output('impact-table', 'page_count')],
+              
+              [dash.dependencies.Input('impact-table', 'page_current'),
+               dash.dependencies.Input('impact-table', 'page_size'),
+               dash.dependencies.Input('impact-table', 'sort_by'),
+               dash.dependencies.Input('impact-table', 'filter_query'),
+               dash.dependencies.Input('page-3-impact-store', 'data')])
+@instrumentation.timed('callback')
+def impact_table_func(page_current, page_size, sort_by, filter_query, impact_store):
+    # Serialize the visible page of the impacts, which come back from the schedule cache
+    if impact_store is None:
+        raise PreventUpdate
+    
+    impact_df = impact_frame(impact_store)
+    cols = impact_df.columns.tolist()
+    cols = cols[-1:] + cols[:-1]
+    
+    return TableQuery(page_current, page_size, sort_by, filter_query).apply(impact_df[cols])
+
+def impact_frame(impact_store):
+    """ Compute the impacts of the contributions, labelled with their case.
+    """
+    principal, rate, payment, extra_payment, contributions = impact_store
+    impact_df = LoanImpacts(principal, rate, payment, extra_payment, contributions).compute_impacts()
+    impact_df['Case'] = ['All Help','No Help','A Quit','B Quit','C Quit']
+    return impact_df
 
 #%%
 # Update the index
@@ -0,0 +1,72 @@
+"""
+Benchmark of the Helper chart builders.
+
+Compares the plotly express path, which melts the schedule into long form before building each figure, with the
+graph objects path of Figures, which builds the same traces straight from the schedule columns, for schedules of
+12, 360 and 1200 months.
+
+Run from the repository root:
+    python -m benchmarks.bench_figures
+"""
+import timeit
+
+import pandas as pd
+
+from loan_analytics.Helper import Helper
+from loan_analytics.Loan import Loan
+from loan_analytics.LoanPortfolio import LoanPortfolio
+
+
+def loan_for_term(months, principal=250000.0, rate=6.0):
+    """ Return a computed loan whose payment pays it off in the given number of months.
+    """
+    r = rate / 12.0 / 100.0
+    payment = round(principal * r / (1.0 - (1.0 + r) ** -months), 2) + 0.01
+    loan = Loan(principal=principal, rate=rate, payment=payment)
+    loan.compute_schedule()
+    return loan
+
+
+def schedules(months):
+    """ Return the loan schedule, the schedule by loan and the portfolio schedule of a portfolio of three loans of
+        the given term, in the layout app.py passes to Helper.
+    """
+    loans = LoanPortfolio()
+    schedule_by_loan = []
+    for loan_id, principal in zip('ABC', (250000.0, 150000.0, 50000.0)):
+        loan = loan_for_term(months, principal=principal)
+        loan_schedule = loan.return_loan_schedule()
+        loan_schedule['Loan_ID'] = loan_id
+        schedule_by_loan.append(loan_schedule)
+        loans.add_loan(loan)
+    portfolio_schedule = loans.return_portfolio_schedule()
+    return schedule_by_loan[0], pd.concat(schedule_by_loan, ignore_index=True), portfolio_schedule
+
+
+def best_of(function, repeat=5, number=5):
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+def run(terms=(12, 360, 1200)):
+    results = []
+    for months in terms:
+        loan_schedule, schedule_by_loan, portfolio_schedule = schedules(months)
+        figures = {'bar_plot_loan_cashflow': (loan_schedule,),
+                   'bar_plot_loan_balance_and_interest': (loan_schedule,),
+                   'pie_loan': (loan_schedule, 1),
+                   'bar_plot_portfolio_cashflow': (schedule_by_loan,),
+                   'bar_plot_portfolio_balance_and_interest': (schedule_by_loan, portfolio_schedule),
+                   'pie_portfolio': (schedule_by_loan, 1)}
+        for name, args in figures.items():
+            figure = getattr(Helper, name)
+            express = best_of(lambda: figure(*args, engine='express'))
+            graph_objects = best_of(lambda: figure(*args, engine='graph_objects'))
+            results.append({'months': months, 'figure': name, 'express': express, 'graph_objects': graph_objects})
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"months":>8}  {"figure":<42}{"express (ms)":>14}{"graph_objects (ms)":>20}{"speedup":>10}')
+    for result in run():
+        print(f'{result["months"]:>8}  {result["figure"]:<42}{result["express"] * 1e3:>14.2f}'
+              f'{result["graph_objects"] * 1e3:>20.2f}{result["express"] / result["graph_objects"]:>9.1f}x')
@@ -0,0 +1,51 @@
+"""
+Benchmark of the import time of the computational core.
+
+Imports each module in a fresh interpreter and reports the best wall time over a few runs, together with any of the
+plotting and table libraries the import pulled in. The core must import none of them: they are only loaded by Helper
+when a chart or table is first drawn.
+
+Run from the repository root:
+    python -m benchmarks.bench_import
+"""
+import subprocess
+import sys
+
+modules = ['loan_analytics.Loan', 'loan_analytics.LoanBatch', 'loan_analytics.LoanPortfolio',
+           'loan_analytics.LoanImpacts', 'loan_analytics.main', 'loan_analytics.Helper']
+heavy_modules = ['pandas', 'plotly', 'prettytable', 'matplotlib']
+
+probe = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ' '.join(name for name in {heavy_modules!r} if name in sys.modules))
+'''
+
+
+def import_module(module):
+    """ Import a module in a fresh interpreter.
+        :param module: dotted module name
+        :return: tuple (import time in seconds, list of heavy modules loaded by the import)
+    """
+    output = subprocess.run([sys.executable, '-c', probe.format(module=module, heavy_modules=heavy_modules)],
+                            check=True, capture_output=True, text=True).stdout.split()
+    return float(output[0]), output[1:]
+
+
+def run(repeat=5):
+    results = []
+    for module in modules:
+        timings = [import_module(module) for _ in range(repeat)]
+        results.append({'module': module, 'seconds': min(seconds for seconds, _ in timings),
+                        'heavy_modules': timings[0][1]})
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"module":<32}{"import (ms)":>12}  heavy modules')
+    results = run()
+    for result in results:
+        print(f'{result["module"]:<32}{result["seconds"] * 1e3:>12.1f}  {" ".join(result["heavy_modules"]) or "-"}')
+    sys.exit(1 if any(result['heavy_modules'] for result in results) else 0)
@@ -0,0 +1,64 @@
+"""
+Benchmark of the dataframe construction in Loan.return_loan_schedule.
+
+Compares the former path (from_dict on the month-keyed rows, then a scalar iloc assignment per row for the
+accumulated interest) with the columnar construction, for the rounded copy and for the zero-copy view.
+
+Run from the repository root:
+    python -m benchmarks.bench_schedule_frame
+"""
+import timeit
+
+import pandas as pd
+
+from loan_analytics.Loan import Loan
+from loan_analytics.Schedule import Schedule
+
+
+def return_loan_schedule_loop(loan):
+    """ The former implementation of Loan.return_loan_schedule, kept as the reference point.
+    """
+    loan_schedule = pd.DataFrame.from_dict(dict(loan.schedule.items()),
+                                           orient='index',
+                                           columns=Schedule.columns).round(2)
+
+    Accumulated_Interest = 0
+    loan_schedule['Accumulated_Interest'] = 0.0
+
+    for i in range(loan_schedule.shape[0]):
+        Accumulated_Interest += loan_schedule['Applied_Interest'].values[i]
+        loan_schedule.iloc[i, 7] = round(Accumulated_Interest, 2)
+
+    return loan_schedule
+
+
+def loan_for_term(months, principal=250000.0, rate=6.0):
+    """ Return a computed loan whose payment pays it off in the given number of months.
+    """
+    r = rate / 12.0 / 100.0
+    payment = round(principal * r / (1.0 - (1.0 + r) ** -months), 2) + 0.01
+    loan = Loan(principal=principal, rate=rate, payment=payment)
+    loan.compute_schedule()
+    return loan
+
+
+def best_of(function, repeat=5, number=10):
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+def run(terms=(360, 480)):
+    results = []
+    for months in terms:
+        loan = loan_for_term(months)
+        loop = best_of(lambda: return_loan_schedule_loop(loan), number=1)
+        rounded = best_of(lambda: loan.return_loan_schedule())
+        view = best_of(lambda: loan.return_loan_schedule(rounded=False))
+        results.append({'months': loan.time_to_loan_termination, 'loop': loop, 'rounded': rounded, 'view': view})
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"months":>8}{"loop (ms)":>12}{"rounded (ms)":>15}{"view (ms)":>12}{"speedup":>10}')
+    for result in run():
+        print(f'{result["months"]:>8}{result["loop"] * 1e3:>12.2f}{result["rounded"] * 1e3:>15.3f}'
+              f'{result["view"] * 1e3:>12.3f}{result["loop"] / result["rounded"]:>9.0f}x')
@@ -0,0 +1,307 @@
+"""
+Benchmark suite of the core engines, the Helper figure builders and the app.py callbacks.
+
+Every workload is timed over a grid of parameters (loan term, portfolio size, contributor count, backend or figure
+engine). Results are printed as a table, written as JSON, and can be saved as a baseline or compared against one.
+A comparison exits with status 1 when a workload got slower than the baseline by more than the threshold.
+
+Run from the repository root:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --filter portfolio --json results.json
+    python -m benchmarks.suite --save-baseline baseline.json
+    python -m benchmarks.suite --compare baseline.json --threshold 0.25
+"""
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import sys
+import timeit
+
+import numpy as np
+
+from benchmarks.bench_schedule_frame import loan_for_term
+from loan_analytics.Loan import Loan
+from loan_analytics.LoanBatch import LoanBatch
+from loan_analytics.LoanImpacts import LoanImpacts
+from loan_analytics.LoanPortfolio import LoanPortfolio
+from loan_analytics.ScheduleCache import schedule_cache
+
+workloads = []
+
+
+def workload(name, **grid):
+    """ Register a workload setup over the cartesian product of its parameter grid.
+        :param name: name of the workload
+        :param grid: lists of values of each parameter
+        :return: decorator registering a setup function, which takes one value of each parameter and returns the
+                 callable to time
+    """
+    def register(setup):
+        for values in itertools.product(*grid.values()):
+            workloads.append((name, dict(zip(grid.keys(), values)), setup))
+        return setup
+    return register
+
+
+def payment_for_term(principal, rate, months):
+    r = rate / 12.0 / 100.0
+    return round(principal * r / (1.0 - (1.0 + r) ** -months), 2) + 0.01
+
+
+def random_batch(loans, months, seed=0):
+    """ Return a batch of loans with random principals and rates, whose payments pay them off in about the given
+        number of months.
+    """
+    generator = np.random.default_rng(seed)
+    principal = np.round(generator.uniform(5000.0, 500000.0, loans), 2)
+    rate = np.round(generator.uniform(1.0, 10.0, loans), 2)
+    r = rate / 12.0 / 100.0
+    payment = np.round(principal * r / (1.0 - (1.0 + r) ** -months), 2) + 0.01
+    return LoanBatch(principal=principal, rate=rate, payment=payment)
+
+
+def schedules_by_loan(months, loan_ids='ABC'):
+    """ Return the loan schedule, the schedule by loan and the portfolio schedule in the layout app.py passes to
+        Helper.
+    """
+    import pandas as pd
+    portfolio = LoanPortfolio()
+    frames = []
+    for loan_id, principal in zip(loan_ids, (250000.0, 150000.0, 50000.0)):
+        loan = loan_for_term(months, principal=principal)
+        frame = loan.return_loan_schedule()
+        frame['Loan_ID'] = loan_id
+        frames.append(frame)
+        portfolio.add_loan(loan)
+    portfolio_schedule = portfolio.return_portfolio_schedule()
+    return frames[0], pd.concat(frames, ignore_index=True), portfolio_schedule
+
+
+#%% Core engines
+
+@workload('loan.compute_schedule', months=[60, 360, 1200], backend=['numpy', 'python', 'cents', 'cached'])
+def loan_compute_schedule(months, backend):
+    loan = loan_for_term(months)
+    if backend == 'cached':
+        return lambda: loan.compute_schedule()
+    return lambda: loan.compute_schedule(backend=backend, use_cache=False)
+
+
+@workload('loan.return_loan_schedule', months=[60, 360, 1200], rounded=[True, False])
+def loan_return_loan_schedule(months, rounded):
+    loan = loan_for_term(months)
+    return lambda: loan.return_loan_schedule(rounded=rounded)
+
+
+@workload('batch.compute_schedule', loans=[1000, 10000], months=[360], backend=['numpy', 'cents'])
+def batch_compute_schedule(loans, months, backend):
+    batch = random_batch(loans, months)
+    return lambda: batch.compute_schedule(backend=backend)
+
+
+@workload('solver.apr', loans=[1000, 100000], months=[360])
+def solver_apr(loans, months):
+    from loan_analytics.LoanSolver import LoanSolver
+    batch = random_batch(loans, months)
+    fees = np.round(batch.principal * 0.02, 2)
+    return lambda: LoanSolver.apr(batch.principal, batch.rate, batch.payment, fees=fees)
+
+
+@workload('portfolio.aggregate', loans=[10, 1000, 10000], months=[360])
+def portfolio_aggregate(loans, months):
+    batch = random_batch(loans, months)
+    batch.compute_schedule()
+    portfolio = LoanPortfolio()
+    for index in range(loans):
+        portfolio.add_loan(batch.loan(index))
+    return portfolio.aggregate
+
+
+@workload('portfolio.compute_schedule', loans=[1000, 10000], months=[360], workers=[None, 1, 2, 4])
+def portfolio_compute_schedule(loans, months, workers):
+    batch = random_batch(loans, months)
+    portfolio = LoanPortfolio()
+    for index in range(loans):
+        portfolio.add_loan(Loan(principal=float(batch.principal[index]), rate=float(batch.rate[index]),
+                                payment=float(batch.payment[index])))
+    return lambda: portfolio.compute_schedule(workers=workers)
+
+
+@workload('impacts.compute_impacts', contributors=[3, 30, 300], months=[360])
+def impacts_compute_impacts(contributors, months):
+    payment = payment_for_term(250000.0, 6.0, months)
+    impacts = LoanImpacts(principal=250000.0, rate=6.0, payment=payment, extra_payment=0.0,
+                          contributions=list(np.linspace(1.0, 100.0, contributors)))
+    return lambda: impacts.compute_impacts(use_cache=False)
+
+
+#%% Figure builders
+
+@workload('helper.loan_figures', months=[12, 360, 1200], engine=['express', 'graph_objects'],
+          figure=['bar_plot_loan_cashflow', 'bar_plot_loan_balance_and_interest', 'pie_loan'])
+def helper_loan_figures(months, engine, figure):
+    from loan_analytics.Helper import Helper
+    loan_schedule, _, _ = schedules_by_loan(months)
+    args = (loan_schedule, 1) if figure == 'pie_loan' else (loan_schedule,)
+    return lambda: getattr(Helper, figure)(*args, engine=engine)
+
+
+@workload('helper.portfolio_figures', months=[12, 360, 1200], engine=['express', 'graph_objects'],
+          figure=['bar_plot_portfolio_cashflow', 'bar_plot_portfolio_balance_and_interest', 'pie_portfolio'])
+def helper_portfolio_figures(months, engine, figure):
+    from loan_analytics.Helper import Helper
+    _, schedule_by_loan, portfolio_schedule = schedules_by_loan(months)
+    args = {'bar_plot_portfolio_cashflow': (schedule_by_loan,),
+            'bar_plot_portfolio_balance_and_interest': (schedule_by_loan, portfolio_schedule),
+            'pie_portfolio': (schedule_by_loan, 1)}[figure]
+    return lambda: getattr(Helper, figure)(*args, engine=engine)
+
+
+@workload('helper.impact_figures', figure=['bar_plot_duration_interest', 'pie_interest', 'pie_duration'])
+def helper_impact_figures(figure):
+    from loan_analytics.Helper import Helper
+    impact_df = LoanImpacts(principal=68000.0, rate=4.0, payment=899.0, extra_payment=0.0,
+                            contributions=[10.0, 100.0, 1000.0]).compute_impacts()
+    impact_df['Case'] = ['All Help', 'No Help', 'A Quit', 'B Quit', 'C Quit']
+    return lambda: getattr(Helper, figure)(impact_df)
+
+
+#%% Dash callbacks, timed cold: the schedule cache is cleared before every call
+
+def import_app():
+    import contextlib
+    import io
+    import warnings
+    with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter('ignore')
+        import app
+    return app
+
+
+def cold(callback, *args):
+    import contextlib
+    import io
+
+    def call():
+        schedule_cache.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            callback(*args)
+    return call
+
+
+@workload('app.loan_func', months=[60, 360, 1200])
+def app_loan_func(months):
+    app = import_app()
+    return cold(app.loan_func, 1, 250000.0, 6.0, payment_for_term(250000.0, 6.0, months), 0.0)
+
+
+@workload('app.portfolio_func', months=[60, 360, 1200])
+def app_portfolio_func(months):
+    app = import_app()
+    loans = [(principal, 6.0, payment_for_term(principal, 6.0, months), 0.0)
+             for principal in (250000.0, 150000.0, 50000.0)]
+    return cold(app.portfolio_func, 1, 3, *itertools.chain(*loans))
+
+
+@workload('app.impact_func', months=[60, 360, 1200])
+def app_impact_func(months):
+    app = import_app()
+    return cold(app.impact_func, 1, 250000.0, 6.0, payment_for_term(250000.0, 6.0, months), 0.0, 10.0, 100.0, 1000.0)
+
+
+#%% Runner
+
+def key(result):
+    return result['name'] + '[' + ','.join(f'{name}={value}' for name, value in result['params'].items()) + ']'
+
+
+def time_workload(function, repeat=5, min_time=0.2):
+    """ Time a callable, calling it enough times per repeat to last at least min_time seconds.
+        :return: dictionary of the best and median time per call in seconds, and the calls per repeat
+    """
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    timings = [timing / number for timing in timer.repeat(repeat=repeat, number=number)]
+    return {'best': min(timings), 'median': statistics.median(timings), 'number': number, 'repeat': repeat}
+
+
+def run(pattern='', repeat=5, min_time=0.2):
+    results = []
+    for name, params, setup in workloads:
+        result = {'name': name, 'params': params}
+        if pattern not in key(result):
+            continue
+        try:
+            result.update(time_workload(setup(**params), repeat=repeat, min_time=min_time))
+        except ImportError as ex:
+            result['skipped'] = str(ex)
+        results.append(result)
+        print(format_result(result), file=sys.stderr)
+    return results
+
+
+def environment():
+    import pandas as pd
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'system': platform.system()}
+
+
+def format_result(result):
+    if 'skipped' in result:
+        return f'{key(result):<105}{"skipped: " + result["skipped"]:>24}'
+    return f'{key(result):<105}{result["best"] * 1e3:>12.3f}{result["median"] * 1e3:>12.3f}'
+
+
+def compare(results, baseline, threshold=0.2):
+    """ Compare results against a baseline.
+        :param results: list of results of run
+        :param baseline: list of results of a previous run
+        :param threshold: relative change of the best time above which a workload is reported slower or faster
+        :return: list of (key, baseline seconds, current seconds, ratio, status) rows
+    """
+    baseline = {key(result): result for result in baseline if 'best' in result}
+    rows = []
+    for result in results:
+        if 'best' not in result or key(result) not in baseline:
+            continue
+        ratio = result['best'] / baseline[key(result)]['best']
+        status = 'slower' if ratio > 1.0 + threshold else 'faster' if ratio < 1.0 / (1.0 + threshold) else 'same'
+        rows.append((key(result), baseline[key(result)]['best'], result['best'], ratio, status))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--filter', default='', help='only run workloads whose key contains this text')
+    parser.add_argument('--repeat', type=int, default=5, help='timed repeats per workload')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per repeat')
+    parser.add_argument('--json', help='write the results to this JSON file')
+    parser.add_argument('--save-baseline', help='write the results as a baseline to this JSON file')
+    parser.add_argument('--compare', help='compare the results against the baseline in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    print(f'{"workload":<105}{"best (ms)":>12}{"median (ms)":>12}', file=sys.stderr)
+    report = {'environment': environment(), 'results': run(args.filter, args.repeat, args.min_time)}
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as json_file:
+                json.dump(report, json_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as json_file:
+            rows = compare(report['results'], json.load(json_file)['results'], args.threshold)
+        print(f'\n{"workload":<105}{"baseline (ms)":>15}{"current (ms)":>14}{"ratio":>8}  status')
+        for name, before, after, ratio, status in rows:
+            print(f'{name:<105}{before * 1e3:>15.3f}{after * 1e3:>14.3f}{ratio:>8.2f}  {status}')
+        return 1 if any(status == 'slower' for *_, status in rows) else 0
+    if not args.json and not args.save_baseline:
+        json.dump(report, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import numpy as np
+
+
+class Amortization:
+    """ Array based amortization engine.
+    Computes whole amortization schedules as NumPy columns from the closed-form annuity balance recurrence
+    instead of stepping through the schedule one month at a time.
+    """
+    # months per bucket of each time bucket resolution of schedule rollups
+    resolutions = {'monthly': 1, 'quarterly': 3, 'yearly': 12}
+
+    @staticmethod
+    def bucket_months(resolution, months, max_buckets=240):
+        """ Return the number of months per bucket of a time bucket resolution.
+            :param resolution: 'monthly', 'quarterly', 'yearly', or 'auto' for the finest of them that gives at most
+                               max_buckets buckets
+            :param months: number of months of the longest schedule rolled up
+            :param max_buckets: most buckets the 'auto' resolution gives
+            :return: number of months per bucket
+        """
+        if resolution == 'auto':
+            return next((size for size in Amortization.resolutions.values() if -(-months // size) <= max_buckets),
+                        Amortization.resolutions['yearly'])
+        if resolution not in Amortization.resolutions:
+            raise ValueError(f'Warning: Unknown resolution {resolution}')
+        return Amortization.resolutions[resolution]
+
+    @staticmethod
+    def monthly_rate(rate):
+        """ Convert an annualized interest rate given as a percentage into a monthly rate.
+            :param rate: annualized interest rate as a percentage
+            :return: monthly interest rate as a fraction
+        """
+        return np.asarray(rate, dtype=np.float64) / 12.0 / 100.0
+
+    @staticmethod
+    def balance(principal, rate, payment, months):
+        """ Remaining principal after a number of monthly payments, from the closed-form annuity recurrence
+            B_k = B_0 (1 + r)^k - P ((1 + r)^k - 1) / r, which reduces to B_0 - P k when r is 0.
+            :param principal: principal amount at month 0
+            :param rate: annualized interest rate as a percentage
+            :param payment: total monthly payment, including extra payment
+            :param months: number of payments made
+            :return: remaining principal after the given number of payments
+        """
+        r = Amortization.monthly_rate(rate)
+        k = np.asarray(months, dtype=np.float64)
+        growth_minus_one = np.expm1(k * np.log1p(r))
+        annuity_factor = np.where(r > 0.0, growth_minus_one / np.where(r > 0.0, r, 1.0), k)
+        return principal * (1.0 + growth_minus_one) - payment * annuity_factor
+
+    @staticmethod
+    def term(principal, rate, payment, extra_payment=0.0):
+        """ Number of payments until the loan is paid off, from the log formula n = log(P / (P - B_0 r)) / log(1 + r).
+            The estimate is corrected by one month either way so that it matches the month in which the balance
+            actually reaches zero.
+            :param principal: principal amount left on the loan
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment
+            :param extra_payment: additional payment applied to the principal
+            :return: number of payments, as an integer array
+        """
+        principal = np.asarray(principal, dtype=np.float64)
+        total_payment = np.asarray(payment, dtype=np.float64) + np.asarray(extra_payment, dtype=np.float64)
+        r = Amortization.monthly_rate(rate)
+
+        if np.any((principal > 0.0) & (total_payment <= principal * r)):
+            raise ValueError('Warning: Payment must be greater than the monthly interest for the loan to amortize')
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_term = np.log(total_payment / (total_payment - principal * r)) / np.log1p(r)
+            linear_term = principal / total_payment
+        n = np.ceil(np.where(r > 0.0, log_term, linear_term))
+        n = np.where(principal > 0.0, np.maximum(n, 1.0), 0.0)
+
+        n = np.where((n > 1.0) & (Amortization.balance(principal, rate, total_payment, n - 1.0) <= 0.0), n - 1.0, n)
+        n = np.where((n > 0.0) & (Amortization.balance(principal, rate, total_payment, n) > 0.0), n + 1.0, n)
+        return n.astype(np.int64)
+
+    @staticmethod
+    def summary(principal, rate, payment, extra_payment=0.0):
+        """ Compute the time to loan termination, total interest paid and total principal paid without building the
+            schedule. Every payment but the last is the full payment, and the last one is the balance left after
+            n - 1 payments plus its interest, so the totals follow from the term in O(1) per loan.
+            :param principal: principal amount left on the loan, or an array of them
+            :param rate: annualized interest rate as a percentage, or an array of them
+            :param payment: minimum expected payment, or an array of them
+            :param extra_payment: additional payment applied to the principal, or an array of them
+            :return: tuple (time to loan termination, total interest paid, total principal paid)
+        """
+        principal = np.asarray(principal, dtype=np.float64)
+        total_payment = np.asarray(payment, dtype=np.float64) + np.asarray(extra_payment, dtype=np.float64)
+        n = Amortization.term(principal, rate, payment, extra_payment)
+
+        last_begin_principal = Amortization.balance(principal, rate, total_payment, np.maximum(n - 1, 0))
+        last_payment = last_begin_principal * (1.0 + Amortization.monthly_rate(rate))
+        total_paid = np.where(n > 0, (n - 1) * total_payment + last_payment, 0.0)
+        total_principal_paid = np.where(n > 0, principal, 0.0)
+        total_interest_paid = total_paid - total_principal_paid
+        return n, total_interest_paid, total_principal_paid
+
+    @staticmethod
+    def schedule_matrix(principal, rate, payment, extra_payment=0.0):
+        """ Compute the schedules of many loans at once as padded (loans x months) matrices.
+            Row i of each matrix holds the schedule of loan i in its first n_i columns and zeros after its
+            termination, where n_i is the per-loan termination index. The matrices are stacked in one block in the
+            field order of Schedule: begin principal, payment, extra payment, applied principal, applied interest
+            and end principal.
+            :param principal: array of principal amounts left on the loans
+            :param rate: array of annualized interest rates as percentages
+            :param payment: array of minimum expected payments
+            :param extra_payment: array of additional payments applied to the principal
+            :return: tuple (termination index, (fields x loans x months) block)
+        """
+        principal, rate, payment, extra_payment = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(value, dtype=np.float64)) for value in (principal, rate, payment, extra_payment)))
+        n = Amortization.term(principal, rate, payment, extra_payment)
+        months = int(n.max()) if n.size > 0 else 0
+        total_payment = (payment + extra_payment)[:, None]
+
+        k = np.arange(months, dtype=np.float64)[None, :]
+        active = k < n[:, None]
+        block = np.zeros((6, principal.shape[0], months))
+        begin_principal, payments, extra_payments, applied_principal, applied_interest, end_principal = block
+
+        np.copyto(begin_principal, Amortization.balance(principal[:, None], rate[:, None], total_payment, k),
+                  where=active)
+        np.multiply(begin_principal, Amortization.monthly_rate(rate)[:, None], out=applied_interest)
+        np.subtract(total_payment, applied_interest, out=applied_principal, where=active)
+        np.copyto(payments, payment[:, None], where=active)
+        np.copyto(extra_payments, extra_payment[:, None], where=active)
+        end_principal[:, :-1] = begin_principal[:, 1:]
+
+        # the last payment of each loan only covers what is left of the principal plus its interest
+        loans = np.nonzero(n > 0)[0]
+        last = n[loans] - 1
+        applied_principal[loans, last] = begin_principal[loans, last]
+        payments[loans, last] = begin_principal[loans, last] + applied_interest[loans, last]
+        end_principal[loans, last] = 0.0
+
+        return n, block
+
+    @staticmethod
+    def schedule(principal, rate, payment, extra_payment=0.0):
+        """ Compute the schedule of a single loan as NumPy columns.
+            Rows follow the layout of Loan.schedule: the final row pays off the remaining balance exactly, so its
+            payment is the remaining balance plus that month's interest.
+            :param principal: principal amount left on the loan
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment
+            :param extra_payment: additional payment applied to the principal
+            :return: (fields x months) block in the field order of Schedule
+        """
+        n, block = Amortization.schedule_matrix(principal, rate, payment, extra_payment)
+        return block[:, 0, :n[0]]
+
+    @staticmethod
+    def iter_schedule(principal, rate, payment, extra_payment=0.0, chunk_months=120):
+        """ Generate the schedule of a single loan lazily, a few months at a time, so that only one chunk is ever
+            held in memory. The rows are the same as those of Amortization.schedule.
+            :param principal: principal amount left on the loan
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment
+            :param extra_payment: additional payment applied to the principal
+            :param chunk_months: number of months computed per chunk
+            :return: generator of consecutive (fields x months) blocks in the field order of Schedule
+        """
+        n = int(Amortization.term(principal, rate, payment, extra_payment))
+        r = float(Amortization.monthly_rate(rate))
+        total_payment = payment + extra_payment
+
+        for start in range(0, n, chunk_months):
+            stop = min(start + chunk_months, n)
+            balances = Amortization.balance(principal, rate, total_payment, np.arange(start, stop + 1))
+            block = np.empty((6, stop - start))
+            block[0] = balances[:-1]
+            block[1] = payment
+            block[2] = extra_payment
+            block[4] = block[0] * r
+            block[3] = total_payment - block[4]
+            block[5] = balances[1:]
+            if stop == n:
+                # the last payment only covers what is left of the principal plus its interest
+                block[3, -1] = block[0, -1]
+                block[1, -1] = block[0, -1] + block[4, -1]
+                block[5, -1] = 0.0
+            yield block
@@ -0,0 +1,151 @@
+import numpy as np
+
+from loan_analytics.Amortization import Amortization
+
+
+class CentsAmortization:
+    """ Integer cents amortization engine.
+    Computes schedules the way a servicer bills them: balances and payments are int64 cents and each month's interest
+    is rounded to the cent with a configurable rule before it is applied, so the schedule and its totals add up to the
+    cent. Rounding makes every month depend on the previous one, so the schedules are stepped month by month, but
+    each step is one vectorized pass over the loans still running.
+    """
+    rounding_modes = ('half_up', 'half_even', 'half_down', 'up', 'down')
+    # rates are carried as integer millionths of a percent, so the monthly interest is balance * rate / rate_scale
+    rate_scale = 12 * 100 * 1000000
+
+    @staticmethod
+    def to_cents(amount):
+        """ Convert dollar amounts to integer cents, rounding to the nearest cent.
+            :param amount: amount in dollars, or an array of them
+            :return: int64 array of cents
+        """
+        return np.round(np.asarray(amount, dtype=np.float64) * 100.0).astype(np.int64)
+
+    @staticmethod
+    def round_divide(numerator, denominator, rounding='half_up'):
+        """ Divide non-negative integers, rounding the quotient to an integer with the given rule.
+            :param numerator: non-negative integer numerator, or an int64 array of them
+            :param denominator: positive integer denominator
+            :param rounding: 'half_up', 'half_even', 'half_down', 'up' or 'down'
+            :return: rounded quotient, or an int64 array of them
+        """
+        quotient, remainder = divmod(numerator, denominator)
+        if rounding == 'down':
+            return quotient
+        if rounding == 'up':
+            return quotient + (remainder > 0)
+        twice = 2 * remainder
+        if rounding == 'half_up':
+            return quotient + (twice >= denominator)
+        if rounding == 'half_down':
+            return quotient + (twice > denominator)
+        if rounding == 'half_even':
+            return quotient + ((twice > denominator) | ((twice == denominator) & (quotient % 2 == 1)))
+        raise ValueError(f'Warning: Unknown rounding mode {rounding}')
+
+    @staticmethod
+    def parameters(principal, rate, payment, extra_payment=0.0, rounding='half_up'):
+        """ Convert and validate loan parameters for the cents engine.
+            :param principal: array of principal amounts left on the loans, in dollars
+            :param rate: array of annualized interest rates as percentages, used to a millionth of a percent
+            :param payment: array of minimum expected payments, in dollars
+            :param extra_payment: array of additional payments applied to the principal, in dollars
+            :param rounding: rounding rule of the monthly interest, one of CentsAmortization.rounding_modes
+            :return: tuple of int64 arrays (principal cents, rate in millionths of a percent, payment cents,
+                     extra payment cents)
+        """
+        if rounding not in CentsAmortization.rounding_modes:
+            raise ValueError(f'Warning: Unknown rounding mode {rounding}')
+        principal, rate, payment, extra_payment = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(value, dtype=np.float64)) for value in (principal, rate, payment, extra_payment)))
+        principal = CentsAmortization.to_cents(principal)
+        rate = np.round(rate * 1000000.0).astype(np.int64)
+        payment = CentsAmortization.to_cents(payment)
+        extra_payment = CentsAmortization.to_cents(extra_payment)
+
+        if np.any(principal.astype(np.float64) * rate.astype(np.float64) >= np.iinfo(np.int64).max):
+            raise ValueError('Warning: Principal and rate are too large for integer cents')
+        interest = CentsAmortization.round_divide(principal * rate, CentsAmortization.rate_scale, rounding)
+        if np.any((principal > 0) & (payment + extra_payment <= interest)):
+            raise ValueError('Warning: Payment must be greater than the monthly interest for the loan to amortize')
+        return principal, rate, payment, extra_payment
+
+    @staticmethod
+    def schedule_matrix(principal, rate, payment, extra_payment=0.0, rounding='half_up'):
+        """ Compute the schedules of many loans at once in integer cents, as padded (loans x months) matrices.
+            Each month the interest on the begin principal is rounded to the cent and the rest of the payment and
+            extra payment is applied to the principal; the last payment is the remaining principal plus its interest.
+            :param principal: array of principal amounts left on the loans, in dollars
+            :param rate: array of annualized interest rates as percentages, used to a millionth of a percent
+            :param payment: array of minimum expected payments, in dollars
+            :param extra_payment: array of additional payments applied to the principal, in dollars
+            :param rounding: rounding rule of the monthly interest, one of CentsAmortization.rounding_modes
+            :return: tuple (termination index, int64 (fields x loans x months) block of cents) in the layout of
+                     Amortization.schedule_matrix
+        """
+        balance, rate, payment, extra_payment = CentsAmortization.parameters(principal, rate, payment, extra_payment,
+                                                                            rounding)
+        total_payment = payment + extra_payment
+
+        # the float term is a close estimate of the number of months; the buffer grows if rounding runs past it.
+        # Months are written as contiguous rows of a (fields x months x loans) buffer, and the state of the loans
+        # still running is kept compacted, so each step only touches those loans.
+        estimate = Amortization.term(balance / 100.0, rate / 1000000.0, total_payment / 100.0)
+        months = int(estimate.max()) + 1 if estimate.size > 0 else 0
+        rows = np.zeros((6, months, balance.shape[0]), dtype=np.int64)
+        n = np.zeros(balance.shape[0], dtype=np.int64)
+
+        loans = np.flatnonzero(balance > 0)
+        begin, rate, payment, extra_payment, total_payment = \
+            balance[loans], rate[loans], payment[loans], extra_payment[loans], total_payment[loans]
+        month = 0
+        while loans.size > 0:
+            if month == rows.shape[1]:
+                rows = np.concatenate([rows, np.zeros_like(rows)], axis=1)
+            interest = CentsAmortization.round_divide(begin * rate, CentsAmortization.rate_scale, rounding)
+            applied_principal = np.minimum(total_payment - interest, begin)
+            last = applied_principal == begin
+            end = begin - applied_principal
+            row = rows[:, month]
+            row[0, loans] = begin
+            row[1, loans] = np.where(last, begin + interest, payment)
+            row[2, loans] = extra_payment
+            row[3, loans] = applied_principal
+            row[4, loans] = interest
+            row[5, loans] = end
+            month += 1
+            if last.any():
+                n[loans[last]] = month
+                running = ~last
+                loans, end, rate, payment, extra_payment, total_payment = \
+                    loans[running], end[running], rate[running], payment[running], extra_payment[running], \
+                    total_payment[running]
+            begin = end
+
+        months = int(n.max()) if n.size > 0 else 0
+        return n, np.ascontiguousarray(rows[:, :months].transpose(0, 2, 1))
+
+    @staticmethod
+    def schedule(principal, rate, payment, extra_payment=0.0, rounding='half_up'):
+        """ Compute the schedule of a single loan in integer cents.
+            :param principal: principal amount left on the loan, in dollars
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment, in dollars
+            :param extra_payment: additional payment applied to the principal, in dollars
+            :param rounding: rounding rule of the monthly interest, one of CentsAmortization.rounding_modes
+            :return: int64 (fields x months) block of cents in the field order of Schedule
+        """
+        # a single loan is stepped with Python integers, which is cheaper than one NumPy call per field and month
+        balance, rate, payment, extra_payment = (int(value[0]) for value in CentsAmortization.parameters(
+            principal, rate, payment, extra_payment, rounding))
+        total_payment = payment + extra_payment
+        rows = []
+        while balance > 0:
+            interest = CentsAmortization.round_divide(balance * rate, CentsAmortization.rate_scale, rounding)
+            applied_principal = min(total_payment - interest, balance)
+            last = applied_principal == balance
+            rows.append((balance, balance + interest if last else payment, extra_payment, applied_principal,
+                         interest, balance - applied_principal))
+            balance -= applied_principal
+        return np.array(rows, dtype=np.int64).reshape(-1, 6).T.copy()
@@ -0,0 +1,213 @@
+import numpy as np
+
+from loan_analytics.Amortization import Amortization
+
+
+class Figures:
+    """ Figure builders for the schedule charts of Helper.
+    Builds the same figures as the plotly express path of Helper, but creates the graph objects traces straight from
+    the schedule columns, without melting the schedule into long form, filtering it once per trace or going through
+    plotly express.
+    """
+    flow_colors = {'Applied_Principal (Loan A)': 'royalblue',
+                   'Applied_Principal (Loan B)': 'darkorange',
+                   'Applied_Principal (Loan C)': 'darkorchid',
+                   'Applied_Interest (Loan A)': 'red',
+                   'Applied_Interest (Loan B)': 'darkgreen',
+                   'Applied_Interest (Loan C)': 'deepskyblue'}
+    loan_colors = {'A': 'royalblue', 'B': 'darkorange', 'C': 'darkorchid'}
+    # most buckets per loan the 'auto' chart resolution draws
+    auto_buckets = 240
+    # line series with more points than this are drawn with WebGL instead of SVG
+    webgl_points = 1000
+    # summed over a bucket; the end of bucket value is kept for the running columns and the first one for the others
+    flow_columns = ['Payment', 'Extra_Payment', 'Applied_Principal', 'Applied_Interest']
+    closing_columns = ['End_Principal ', 'Accumulated_Interest']
+
+    @staticmethod
+    def bucket_months(resolution, months):
+        """ Return the number of months per bucket of a chart resolution.
+            :param resolution: 'monthly', 'quarterly', 'yearly', or 'auto' for the finest of them that draws at most
+                               Figures.auto_buckets buckets per loan
+            :param months: number of months of the longest schedule drawn
+            :return: number of months per bucket
+        """
+        return Amortization.bucket_months(resolution, months, max_buckets=Figures.auto_buckets)
+
+    @staticmethod
+    def rollup(schedule, resolution='monthly'):
+        """ Roll a schedule up to a coarser resolution, per loan when it has a Loan_ID column.
+            The rows are sorted by bucket once and every column is reduced with one vectorized pass: flows are summed
+            with np.add.reduceat, running totals and end balances keep their last month, and the other columns their
+            first month. Buckets are labelled with their first month.
+            :param schedule: schedule dataframe with a Month column, in the layout of Loan.return_loan_schedule
+            :param resolution: 'monthly', 'quarterly', 'yearly' or 'auto', see Figures.bucket_months
+            :return: schedule dataframe with one row per bucket (and loan), the schedule itself when monthly
+        """
+        import pandas as pd
+        month = schedule['Month'].to_numpy()
+        size = Figures.bucket_months(resolution, int(month.max()) if month.size > 0 else 0)
+        if size == 1:
+            return schedule
+
+        bucket = (month - 1) // size
+        group = bucket
+        if 'Loan_ID' in schedule.columns:
+            codes, _ = pd.factorize(schedule['Loan_ID'])
+            group = codes * (int(bucket.max()) + 1) + bucket
+        order = np.argsort(group, kind='stable')
+        sorted_group = group[order]
+        starts = np.flatnonzero(np.r_[True, sorted_group[1:] != sorted_group[:-1]])
+        ends = np.r_[starts[1:], sorted_group.size] - 1
+
+        columns = {}
+        for column in schedule.columns:
+            values = schedule[column].to_numpy()[order]
+            if column == 'Month':
+                columns[column] = bucket[order][starts] * size + 1
+            elif column in Figures.flow_columns:
+                columns[column] = np.round(np.add.reduceat(values, starts), 2)
+            elif column in Figures.closing_columns:
+                columns[column] = values[ends]
+            else:
+                columns[column] = values[starts]
+        return pd.DataFrame(columns)
+
+
+    @staticmethod
+    def _colors(names, color_map):
+        """ Return the color of each trace name, taking unmapped names from the default qualitative sequence in order
+            of appearance, as plotly express does.
+        """
+        from plotly.colors import qualitative
+        sequence = iter(qualitative.Plotly * (len(names) // len(qualitative.Plotly) + 1))
+        return [color_map[name] if name in color_map else next(sequence) for name in names]
+
+    @staticmethod
+    def _by_loan(schedule_by_loan):
+        """ Split the row positions of a schedule by loan, with the loans in order of first appearance.
+            :param schedule_by_loan: schedule dataframe with a Loan_ID column
+            :return: tuple (list of loan ids, list of row position arrays)
+        """
+        import pandas as pd
+        codes, loan_ids = pd.factorize(schedule_by_loan['Loan_ID'])
+        order = np.argsort(codes, kind='stable')
+        return list(loan_ids), np.split(order, np.cumsum(np.bincount(codes, minlength=len(loan_ids)))[:-1])
+
+    @staticmethod
+    def _bar(name, x, y, color, hovertemplate):
+        import plotly.graph_objects as go
+        return go.Bar(hovertemplate=hovertemplate, legendgroup=name, marker=dict(color=color, opacity=0.9,
+                                                                               pattern=dict(shape='')),
+                      name=name, orientation='v', showlegend=True, textposition='auto', x=x, xaxis='x', y=y,
+                      yaxis='y')
+
+    @staticmethod
+    def _line(name, x, y, color, hovertemplate, showlegend=True):
+        import plotly.graph_objects as go
+        line = dict(hovertemplate=hovertemplate, legendgroup=name, line=dict(color=color, dash='solid'),
+                    marker=dict(symbol='circle'), mode='lines', name=name, showlegend=showlegend, x=x, xaxis='x', y=y,
+                    yaxis='y2')
+        if len(x) > Figures.webgl_points:
+            return go.Scattergl(**line)
+        return go.Scatter(orientation='v', **line)
+
+    @staticmethod
+    def _bar_figure(traces, title, y_title, legend_title, width, height):
+        import plotly.graph_objects as go
+        return go.Figure(data=traces, layout=dict(
+            template='gridon', xaxis=dict(anchor='y', domain=[0.0, 1.0], title=dict(text='Month')),
+            yaxis=dict(anchor='x', domain=[0.0, 1.0], title=dict(text=y_title)),
+            legend=dict(title=dict(text=legend_title), tracegroupgap=0), title=dict(text=title), barmode='relative',
+            height=height, width=width))
+
+    @staticmethod
+    def _secondary_figure(traces, title, y_title, y2_title, width, height, barmode=None):
+        import plotly.graph_objects as go
+        layout = dict(xaxis=dict(anchor='y', domain=[0.0, 0.94], title=dict(text='Month')),
+                      yaxis=dict(anchor='x', domain=[0.0, 1.0], title=dict(text=y_title), color='royalblue'),
+                      yaxis2=dict(anchor='x', overlaying='y', side='right', type='linear', color='red',
+                                  title=dict(text=y2_title)),
+                      title=dict(text=title), height=height, width=width)
+        if barmode is not None:
+            layout['barmode'] = barmode
+        return go.Figure(data=traces, layout=layout)
+
+    @staticmethod
+    def _pie(labels, values, hovertemplate, title, width, height):
+        import plotly.graph_objects as go
+        return go.Figure(data=[go.Pie(domain=dict(x=[0.0, 1.0], y=[0.0, 1.0]), hovertemplate=hovertemplate,
+                                      labels=labels, legendgroup='', name='', showlegend=True, values=values)],
+                         layout=dict(legend=dict(tracegroupgap=0), title=dict(text=title), height=height,
+                                     width=width))
+
+    #%% Plots for individual loan
+    @staticmethod
+    def bar_plot_loan_cashflow(schedule_individual, width=800, height=400):
+        month = schedule_individual['Month'].to_numpy()
+        traces = [Figures._bar(name, month, schedule_individual[name].to_numpy(), color,
+                               f'Category={name}<br>Month=%{{x}}<br>Monthly Payment=%{{y}}<extra></extra>')
+                  for name, color in (('Applied_Principal', 'royalblue'), ('Applied_Interest', 'red'))]
+        return Figures._bar_figure(traces, 'Individual Loan Schedule: Cashflow Split', 'Monthly Payment', 'Category',
+                                   width, height)
+
+    @staticmethod
+    def bar_plot_loan_balance_and_interest(schedule_individual, height=400, width=800):
+        month = schedule_individual['Month'].to_numpy()
+        traces = [Figures._bar('Begin_Principal', month, schedule_individual['Begin_Principal'].to_numpy(), 'royalblue',
+                               'type=Begin_Principal<br>Month=%{x}<br>Remaining Principal=%{y}<extra></extra>'),
+                  Figures._line('Accumulated_Interest', month, schedule_individual['Accumulated_Interest'].to_numpy(),
+                                'red',
+                                'type=Accumulated_Interest<br>Month=%{x}<br>Accumulated Interest=%{y}<extra></extra>')]
+        return Figures._secondary_figure(traces, 'Individual Loan Schedule: Remaining Balance and Accumulated Interest',
+                                         'Remaining Principal', 'Accumulated Interest', width, height)
+
+    @staticmethod
+    def pie_loan(schedule_individual, i, height=400, width=400):
+        row = schedule_individual.loc[i]
+        return Figures._pie(['Applied_Principal', 'Applied_Interest'],
+                            row[['Applied_Principal', 'Applied_Interest']].to_numpy(dtype=np.float64),
+                            'type=%{label}<br>value=%{value}<extra></extra>',
+                            'Loan Payment Snapshot: Month #{}'.format(i), width, height)
+
+    #%% Plots for loan portfolio
+    @staticmethod
+    def bar_plot_portfolio_cashflow(schedule_by_loan, width=800, height=400):
+        loan_ids, rows = Figures._by_loan(schedule_by_loan)
+        month = schedule_by_loan['Month'].to_numpy()
+        names, traces = [], []
+        for column in ('Applied_Principal', 'Applied_Interest'):
+            values = schedule_by_loan[column].to_numpy()
+            for loan_id, loan_rows in zip(loan_ids, rows):
+                names.append(f'{column} (Loan {loan_id})')
+                traces.append((month[loan_rows], values[loan_rows]))
+        traces = [Figures._bar(name, x, y, color,
+                               f'Category={name}<br>Month=%{{x}}<br>Monthly Payment=%{{y}}<extra></extra>')
+                  for name, (x, y), color in zip(names, traces, Figures._colors(names, Figures.flow_colors))]
+        return Figures._bar_figure(traces, 'Schedule Breakdown By Loan: Cashflow Split', 'Monthly Payment', 'Category',
+                                   width, height)
+
+    @staticmethod
+    def bar_plot_portfolio_balance_and_interest(schedule_by_loan, portfolio_schedule, height=400, width=800):
+        loan_ids, rows = Figures._by_loan(schedule_by_loan)
+        month = schedule_by_loan['Month'].to_numpy()
+        begin_principal = schedule_by_loan['Begin_Principal'].to_numpy()
+        traces = [Figures._bar(loan_id, month[loan_rows], begin_principal[loan_rows], color,
+                               f'Loan={loan_id}<br>Month=%{{x}}<br>Remaining Principal=%{{y}}<extra></extra>')
+                  for loan_id, loan_rows, color in zip(loan_ids, rows, Figures._colors(loan_ids, Figures.loan_colors))]
+        traces.append(Figures._line('', portfolio_schedule['Month'].to_numpy(),
+                                    portfolio_schedule['Accumulated_Interest'].to_numpy(), '#636efa',
+                                    'Month=%{x}<br>Accumulated_Interest=%{y}<extra></extra>', showlegend=False))
+        return Figures._secondary_figure(traces, 'Loan Portfolio Schedule: Remaining Balance and Accumulated Interest',
+                                         'Remaining Principal', 'Accumulated Interest', width, height,
+                                         barmode='relative')
+
+    @staticmethod
+    def pie_portfolio(schedule_by_loan, i, height=400, width=450):
+        month_rows = schedule_by_loan[schedule_by_loan['Month'].to_numpy() == i]
+        loan_ids = month_rows['Loan_ID'].tolist()
+        labels = [f'{column} (Loan {loan_id})' for column in ('Applied_Principal', 'Applied_Interest')
+                  for loan_id in loan_ids]
+        values = np.concatenate([month_rows['Applied_Principal'].to_numpy(), month_rows['Applied_Interest'].to_numpy()])
+        return Figures._pie(labels, values, 'type_by_loan=%{label}<br>value=%{value}<extra></extra>',
+                            'Loan Portfolio Payment Snapshot: Month #{}'.format(i), width, height)
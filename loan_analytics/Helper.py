@@ -1,11 +1,8 @@
-from prettytable import PrettyTable
-import matplotlib.pyplot as plt
-import plotly.io as pio
-import plotly.express as px
-from plotly.subplots import make_subplots
-import numpy as np
-import pandas as pd
-import decimal
+import csv
+
+from loan_analytics.Figures import Figures
+from loan_analytics.Instrumentation import instrumentation
+from loan_analytics.Schedule import Schedule
 
 
 class Helper:
@@ -21,9 +18,35 @@ class Helper:
         value = float(value)
         return '%.{}f'.format(digits) % value
 
+    @staticmethod
+    def _use_graph_objects(engine):
+        """ Tell whether a chart is built by Figures from graph objects or by plotly express.
+        :param engine: 'express' or 'graph_objects'
+        :return: True for the graph objects path
+        """
+        if engine not in ('express', 'graph_objects'):
+            raise ValueError(f'Warning: Unknown figure engine {engine}')
+        return engine == 'graph_objects'
+
     #%% Plots for individual loan
     @staticmethod
-    def bar_plot_loan_cashflow(schedule_individual, width=800, height=400):
+    @instrumentation.timed('figure')
+    def bar_plot_loan_cashflow(schedule_individual, width=800, height=400, engine='express', resolution='monthly'):
+        """ Plot the principal and interest paid each month of a loan as stacked bars.
+        :param schedule_individual: schedule dataframe of the loan, from Loan.return_loan_schedule
+        :param width: width of the figure in pixels
+        :param height: height of the figure in pixels
+        :param engine: 'express' for plotly express on the melted schedule, 'graph_objects' to build the same figure
+                       straight from the schedule columns, which is much faster on long schedules
+        :param resolution: 'monthly', 'quarterly', 'yearly' or 'auto', to which the schedules are rolled up by
+                           Figures.rollup before they are drawn
+        :return: plotly figure
+        """
+        schedule_individual = Figures.rollup(schedule_individual, resolution)
+        if Helper._use_graph_objects(engine):
+            return Figures.bar_plot_loan_cashflow(schedule_individual, width=width, height=height)
+        import pandas as pd
+        import plotly.express as px
         
         schedule_individual_flow = schedule_individual.loc[:,['Month','Applied_Principal','Applied_Interest']]
         schedule_individual_cashflow_unpivot = pd.melt(schedule_individual_flow, id_vars=['Month'], var_name='type', value_name='value')
@@ -65,7 +88,25 @@ class Helper:
         return barchart
 
     @staticmethod
-    def bar_plot_loan_balance_and_interest(schedule_individual, height=400, width=800):
+    @instrumentation.timed('figure')
+    def bar_plot_loan_balance_and_interest(schedule_individual, height=400, width=800, engine='express', resolution='monthly'):
+        """ Plot the remaining balance of a loan as bars and its accumulated interest as a line on a second axis.
+        :param schedule_individual: schedule dataframe of the loan, from Loan.return_loan_schedule
+        :param height: height of the figure in pixels
+        :param width: width of the figure in pixels
+        :param engine: 'express' for plotly express on the melted schedule, 'graph_objects' to build the same figure
+                       straight from the schedule columns, which is much faster on long schedules
+        :param resolution: 'monthly', 'quarterly', 'yearly' or 'auto', to which the schedules are rolled up by
+                           Figures.rollup before they are drawn
+        :return: plotly figure
+        """
+        schedule_individual = Figures.rollup(schedule_individual, resolution)
+        if Helper._use_graph_objects(engine):
+            return Figures.bar_plot_loan_balance_and_interest(schedule_individual, height=height, width=width)
+        import pandas as pd
+        import plotly.express as px
+        from plotly.subplots import make_subplots
+
         schedule_individual_balance = schedule_individual.loc[:,['Month','Begin_Principal','Accumulated_Interest']]
         schedule_individual_balance_unpivot = pd.melt(schedule_individual_balance, id_vars=['Month'], var_name='type', value_name='value')
         
@@ -138,7 +179,22 @@ class Helper:
         return subfig
 
     @staticmethod
-    def pie_loan(schedule_individual, i, height=400, width=400):
+    @instrumentation.timed('figure')
+    def pie_loan(schedule_individual, i, height=400, width=400, engine='express'):
+        """ Plot the split of one month's payment of a loan between principal and interest.
+        :param schedule_individual: schedule dataframe of the loan, from Loan.return_loan_schedule
+        :param i: month of the snapshot
+        :param height: height of the figure in pixels
+        :param width: width of the figure in pixels
+        :param engine: 'express' for plotly express on the melted schedule, 'graph_objects' to build the same figure
+                       straight from the schedule columns, which is much faster on long schedules
+        :return: plotly figure
+        """
+        if Helper._use_graph_objects(engine):
+            return Figures.pie_loan(schedule_individual, i, height=height, width=width)
+        import pandas as pd
+        import plotly.express as px
+
         schedule_individual_pie = schedule_individual.loc[:,['Month','Applied_Principal','Applied_Interest']].loc[i].to_frame().T
         schedule_individual_pie_unpivot = pd.melt(schedule_individual_pie, id_vars=['Month'], var_name='type', value_name='value')
         
@@ -156,7 +212,24 @@ class Helper:
     # schedule_by_loan = pd.concat([loan a, loan b], axis=1)
     
     @staticmethod
-    def bar_plot_portfolio_cashflow(schedule_by_loan, width = 800, height = 400):
+    @instrumentation.timed('figure')
+    def bar_plot_portfolio_cashflow(schedule_by_loan, width = 800, height = 400, engine='express', resolution='monthly'):
+        """ Plot the principal and interest paid each month by each loan of a portfolio as stacked bars.
+        :param schedule_by_loan: schedule dataframes of the loans concatenated, with a Loan_ID column
+        :param width: width of the figure in pixels
+        :param height: height of the figure in pixels
+        :param engine: 'express' for plotly express on the melted schedule, 'graph_objects' to build the same figure
+                       straight from the schedule columns, which is much faster on long schedules
+        :param resolution: 'monthly', 'quarterly', 'yearly' or 'auto', to which the schedules are rolled up by
+                           Figures.rollup before they are drawn
+        :return: plotly figure
+        """
+        schedule_by_loan = Figures.rollup(schedule_by_loan, resolution)
+        if Helper._use_graph_objects(engine):
+            return Figures.bar_plot_portfolio_cashflow(schedule_by_loan, width=width, height=height)
+        import pandas as pd
+        import plotly.express as px
+
         schedule_by_loan_flow = schedule_by_loan.loc[:,['Month','Applied_Principal','Applied_Interest','Loan_ID']]
         schedule_by_loan_flow_unpivot = pd.melt(schedule_by_loan_flow, id_vars=['Month','Loan_ID'], var_name='type', value_name='value')
         schedule_by_loan_flow_unpivot['type_by_loan'] = schedule_by_loan_flow_unpivot['type'] + ' (Loan '+ schedule_by_loan_flow_unpivot['Loan_ID']+')'
@@ -201,7 +274,27 @@ class Helper:
     
  
     @staticmethod
-    def bar_plot_portfolio_balance_and_interest(schedule_by_loan, portfolio_schedule, height=400, width=800):
+    @instrumentation.timed('figure')
+    def bar_plot_portfolio_balance_and_interest(schedule_by_loan, portfolio_schedule, height=400, width=800, engine='express', resolution='monthly'):
+        """ Plot the remaining balance of each loan of a portfolio as stacked bars and the accumulated interest of the
+        portfolio as a line on a second axis.
+        :param schedule_by_loan: schedule dataframes of the loans concatenated, with a Loan_ID column
+        :param portfolio_schedule: schedule dataframe of the portfolio, from LoanPortfolio.return_portfolio_schedule
+        :param height: height of the figure in pixels
+        :param width: width of the figure in pixels
+        :param engine: 'express' for plotly express on the melted schedule, 'graph_objects' to build the same figure
+                       straight from the schedule columns, which is much faster on long schedules
+        :param resolution: 'monthly', 'quarterly', 'yearly' or 'auto', to which the schedules are rolled up by
+                           Figures.rollup before they are drawn
+        :return: plotly figure
+        """
+        schedule_by_loan = Figures.rollup(schedule_by_loan, resolution)
+        portfolio_schedule = Figures.rollup(portfolio_schedule, resolution)
+        if Helper._use_graph_objects(engine):
+            return Figures.bar_plot_portfolio_balance_and_interest(schedule_by_loan, portfolio_schedule, height=height, width=width)
+        import pandas as pd
+        import plotly.express as px
+        from plotly.subplots import make_subplots
 
         # Create figure with secondary y-axis
         subfig = make_subplots(specs=[[{"secondary_y": True}]])
@@ -281,7 +374,22 @@ class Helper:
         
         
     @staticmethod
-    def pie_portfolio(schedule_by_loan, i, height=400, width=450):
+    @instrumentation.timed('figure')
+    def pie_portfolio(schedule_by_loan, i, height=400, width=450, engine='express'):
+        """ Plot the split of one month's payments of a portfolio between the principal and interest of each loan.
+        :param schedule_by_loan: schedule dataframes of the loans concatenated, with a Loan_ID column
+        :param i: month of the snapshot
+        :param height: height of the figure in pixels
+        :param width: width of the figure in pixels
+        :param engine: 'express' for plotly express on the melted schedule, 'graph_objects' to build the same figure
+                       straight from the schedule columns, which is much faster on long schedules
+        :return: plotly figure
+        """
+        if Helper._use_graph_objects(engine):
+            return Figures.pie_portfolio(schedule_by_loan, i, height=height, width=width)
+        import pandas as pd
+        import plotly.express as px
+
         schedule_by_loan_flow = schedule_by_loan.loc[:,['Month','Applied_Principal','Applied_Interest','Loan_ID']]
         schedule_by_loan_flow_unpivot = pd.melt(schedule_by_loan_flow, id_vars=['Month','Loan_ID'], var_name='type', value_name='value')
         schedule_by_loan_flow_unpivot['type_by_loan'] = schedule_by_loan_flow_unpivot['type'] + ' (Loan '+ schedule_by_loan_flow_unpivot['Loan_ID']+')'
@@ -306,7 +414,11 @@ class Helper:
     #%% Contribution Analysis
     
     @staticmethod
+    @instrumentation.timed('figure')
     def bar_plot_duration_interest(impact_df, height = 400, width = 600):
+        import plotly.express as px
+        from plotly.subplots import make_subplots
+
         subfig = make_subplots(specs=[[{"secondary_y": True}]])
 
         # Adjust impact_df
@@ -383,7 +495,10 @@ class Helper:
     
     
     @staticmethod
+    @instrumentation.timed('figure')
     def pie_interest(impact_df, height=400, width=450):
+        import plotly.express as px
+
         # impact_df['Case'] = ['All Help','No Help','A Quit','B Quit','C Quit']
         impact_df_mi_interest = impact_df.loc[:,['Case','MIInterest']].iloc[2:,:]
         
@@ -400,7 +515,10 @@ class Helper:
         return fig
 
     @staticmethod
+    @instrumentation.timed('figure')
     def pie_duration(impact_df, height=400, width=450):
+        import plotly.express as px
+
         # impact_df['Case'] = ['All Help','No Help','A Quit','B Quit','C Quit']
         impact_df_mi_duration = impact_df.loc[:,['Case','MIDuration']].iloc[2:,:]
         
@@ -419,21 +537,52 @@ class Helper:
     #%%
 
     @staticmethod
-    def print(loan):
+    def print(loan, stream=False, chunk_months=120):
+        """ Print the schedule of a loan or portfolio as a table.
+        :param loan: single loan or portfolio of loans
+        :param stream: True to generate the rows with iter_schedule and print them chunk_months rows at a time,
+                       which runs in constant memory for a schedule that is not computed yet
+        :param chunk_months: number of rows per printed table when streaming
+        """
+        if stream:
+            rows = loan.iter_schedule(chunk_months=chunk_months)
+        else:
+            schedule = loan.schedule
+            rows = zip(schedule.months().tolist(), *(column.tolist() for column in schedule.fields()))
+
+        x = Helper._schedule_table()
+        for month, *values in rows:
+            x.add_row([month] + [Helper.display(value) for value in values])
+            if stream and len(x.rows) == chunk_months:
+                print(x)
+                x = Helper._schedule_table()
+        if not stream or len(x.rows) > 0:
+            print(x)
+
+    @staticmethod
+    def _schedule_table():
+        from prettytable import PrettyTable
+
         x = PrettyTable()
         x.field_names = ['Payment Number', 'Begin Principal', 'Payment', 'Extra Payment',
                          'Applied Principal', 'Applied Interest', 'End Principal']
         for field_name in x.field_names:
             x.align[field_name] = "r"
-        for pay in loan.schedule.values():
-            x.add_row([pay[0],
-                       Helper.display(pay[1]),
-                       Helper.display(pay[2]),
-                       Helper.display(pay[3]),
-                       Helper.display(pay[4]),
-                       Helper.display(pay[5]),
-                       Helper.display(pay[6])])
-        print(x)
+        return x
+
+    @staticmethod
+    def write_csv(loan, path, digits=2):
+        """ Write the schedule of a loan or portfolio to a CSV file, streaming the rows from iter_schedule, so a
+        schedule that is not computed yet is never held in memory and a computed one is written as it is.
+        :param loan: single loan or portfolio of loans
+        :param path: path of the CSV file
+        :param digits: number of digits right of the decimal place
+        """
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow([column.strip() for column in Schedule.columns])
+            for month, *values in loan.iter_schedule():
+                writer.writerow([month] + [Helper.display(value, digits) for value in values])
 
 
         
@@ -0,0 +1,165 @@
+import functools
+import os
+import re
+import threading
+import time
+
+
+class Instrumentation:
+    """ Instrumentation class
+    Opt-in timing spans and call counters for the hot path stages (validation, schedule computation, dataframe
+    conversion, figure building, serialization and the Dash callbacks). Disabled by default, in which case a timed
+    function costs one attribute check and span() returns a shared no-op context. Set the environment variable
+    LOAN_ANALYTICS_INSTRUMENTATION=1 or call enable() to record.
+    """
+    class _Span:
+        """ Context timing one span and recording it on exit.
+        """
+        __slots__ = ('instrumentation', 'name', 'start')
+
+        def __init__(self, instrumentation, name):
+            self.instrumentation = instrumentation
+            self.name = name
+            self.start = 0.0
+
+        def __enter__(self):
+            self.start = time.perf_counter()
+            return self
+
+        def __exit__(self, *exc_info):
+            self.instrumentation.record(self.name, time.perf_counter() - self.start)
+            return False
+
+    class _NoSpan:
+        """ Shared context used while disabled.
+        """
+        __slots__ = ()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+    _no_span = _NoSpan()
+
+    def __init__(self, enabled=False):
+        """ Constructor to setup an empty record of spans and counters.
+            :param enabled: True to start recording right away
+        """
+        self.enabled = enabled
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """ Drop every recorded span and counter.
+        """
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+    def span(self, name):
+        """ Return a context timing the code it wraps as a span.
+            :param name: name of the span, prefixed by its stage, e.g. 'figure.pie_loan'
+            :return: context manager, a shared no-op one while disabled
+        """
+        if not self.enabled:
+            return Instrumentation._no_span
+        return Instrumentation._Span(self, name)
+
+    def timed(self, stage):
+        """ Decorator recording every call of a function as a span named after its stage and qualified name.
+            :param stage: stage of the function, e.g. 'validation', 'schedule', 'dataframe', 'figure', 'callback'
+            :return: decorator
+        """
+        def decorate(function):
+            name = f'{stage}.{function.__qualname__}'
+
+            @functools.wraps(function)
+            def timed_function(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return timed_function
+        return decorate
+
+    def record(self, name, seconds):
+        """ Record one span.
+            :param name: name of the span
+            :param seconds: duration of the span
+        """
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                self._spans[name] = [1, seconds, seconds, seconds]
+            else:
+                span[0] += 1
+                span[1] += seconds
+                span[2] = min(span[2], seconds)
+                span[3] = max(span[3], seconds)
+
+    def count(self, name, value=1):
+        """ Increment a counter, when enabled.
+            :param name: name of the counter
+            :param value: increment
+        """
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def spans(self, stage=None):
+        """ Return the recorded spans.
+            :param stage: only return the spans of this stage, None for all of them
+            :return: dictionary of span name to its calls, total, mean, min and max seconds
+        """
+        with self._lock:
+            return {name: {'calls': calls, 'total': total, 'mean': total / calls, 'min': low, 'max': high}
+                    for name, (calls, total, low, high) in sorted(self._spans.items())
+                    if stage is None or name.split('.', 1)[0] == stage}
+
+    def counters(self):
+        """ Return the counters.
+            :return: dictionary of counter name to value
+        """
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def export_text(self, gauges=None):
+        """ Export the spans and counters in the Prometheus text exposition format.
+            :param gauges: optional dictionary of further values to export, e.g. the schedule cache statistics
+            :return: text with one sample per line
+        """
+        def label(name):
+            return re.sub(r'["\\\n]', '_', name)
+
+        lines = ['# TYPE loan_analytics_span_calls_total counter',
+                 '# TYPE loan_analytics_span_seconds_total counter',
+                 '# TYPE loan_analytics_span_seconds_max gauge']
+        for name, span in self.spans().items():
+            stage, _, function = name.partition('.')
+            labels = f'stage="{label(stage)}",name="{label(function)}"'
+            lines.append(f'loan_analytics_span_calls_total{{{labels}}} {span["calls"]}')
+            lines.append(f'loan_analytics_span_seconds_total{{{labels}}} {span["total"]:.9f}')
+            lines.append(f'loan_analytics_span_seconds_max{{{labels}}} {span["max"]:.9f}')
+        lines.append('# TYPE loan_analytics_counter_total counter')
+        for name, value in self.counters().items():
+            lines.append(f'loan_analytics_counter_total{{name="{label(name)}"}} {value}')
+        for name, value in (gauges or {}).items():
+            metric = 'loan_analytics_' + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+instrumentation = Instrumentation(enabled=os.environ.get('LOAN_ANALYTICS_INSTRUMENTATION', '') not in ('', '0'))
@@ -1,8 +1,18 @@
+from loan_analytics.Amortization import Amortization
+from loan_analytics.CentsAmortization import CentsAmortization
+from loan_analytics.Instrumentation import instrumentation
+from loan_analytics.Schedule import Schedule
+from loan_analytics.ScheduleCache import ScheduleCache, schedule_cache
+
+
 class Loan:
     """ Single Loan class
     With input principal, rate, payment, and extra payment, compute the amortization schedule, as well as
     overall metrics such as time to loan termination, total principal paid, and total interest paid.
     """
+    # fields of a loan bound to a batch row that are read from the batch on first access
+    batch_fields = ('schedule', 'time_to_loan_termination', 'total_principal_paid', 'total_interest_paid')
+
     def __init__(self, principal, rate, payment, extra_payment=0.0):
         """ Constructor to setup a single loan.
             :param principal:  principal amount left on the loan
@@ -14,12 +24,45 @@ class Loan:
         self.rate = rate
         self.payment = payment
         self.extra_payment = extra_payment
-        self.schedule = {}
+        self.schedule = Schedule()
         self.time_to_loan_termination = None
         self.total_principal_paid = 0.0
         self.total_interest_paid = 0.0
         self.return_schedule = 0
+        self._batch = None
+
+    def bind_batch(self, batch, index):
+        """ Fill the schedule and metrics of the loan in from a row of a computed LoanBatch, lazily: the schedule
+            view and metrics are only built from the batch the first time one of them is read.
+            :param batch: LoanBatch whose schedules are computed
+            :param index: position of the loan in the batch
+        """
+        for name in Loan.batch_fields:
+            self.__dict__.pop(name, None)
+        self._batch = (batch, index)
+
+    def _unbind_batch(self):
+        """ Detach the loan from its batch row before it is recomputed, so none of its fields is read from the batch
+            afterwards. Fields not read yet are reset to their initial values.
+        """
+        if self.__dict__.get('_batch') is not None:
+            for name, value in zip(Loan.batch_fields, (Schedule(), None, 0.0, 0.0)):
+                self.__dict__.setdefault(name, value)
+            self._batch = None
+
+    def __getattr__(self, name):
+        # only reached for attributes missing from the instance, i.e. the fields of a loan bound by bind_batch
+        binding = self.__dict__.get('_batch')
+        if binding is None or name not in Loan.batch_fields:
+            raise AttributeError(f"'Loan' object has no attribute '{name}'")
+        batch, index = binding
+        computed = batch.loan(index)
+        for field in Loan.batch_fields:
+            self.__dict__.setdefault(field, getattr(computed, field))
+        self._batch = None
+        return self.__dict__[name]
 
+    @instrumentation.timed('validation')
     def check_loan_parameters(self):
         if self.principal < 0.01:
             raise ValueError('Warning: Principal must be greater than 0.01')
@@ -34,13 +77,83 @@ class Loan:
         if self.payment < payment_critical + 0.01:
             raise ValueError(f'Warning: Payment (excluding extra payment) must be greater than {payment_critical}')
 
-    def compute_schedule(self):
+    @instrumentation.timed('schedule')
+    def compute_schedule(self, backend='numpy', use_cache=True, rounding='half_up'):
         """ Compute the loan schedule.
-            :return: None, the schedule is stored in an instance dictionary
+            :param backend: 'numpy' to compute the schedule as arrays with the Amortization engine,
+                            'python' to step through the schedule one month at a time,
+                            'cents' to compute it in integer cents with the CentsAmortization engine
+            :param use_cache: True to share the numpy or cents schedule through the process-wide schedule cache, in
+                              which case the schedule columns are read-only
+            :param rounding: rounding rule of the monthly interest of the cents backend, one of
+                             CentsAmortization.rounding_modes
+            :return: None, the schedule is stored in an instance columnar schedule
+        """
+        self._unbind_batch()
+        if backend == 'cents' and use_cache:
+            self.schedule = schedule_cache.get(
+                ScheduleCache.key('cents', self.principal, self.rate, self.payment, self.extra_payment, rounding),
+                lambda: self._cents_schedule(rounding))
+        elif backend == 'cents':
+            self.schedule = self._cents_schedule(rounding)
+        elif backend == 'numpy' and use_cache:
+            self.schedule = schedule_cache.get(
+                ScheduleCache.key('schedule', self.principal, self.rate, self.payment, self.extra_payment),
+                self._numpy_schedule)
+        elif backend == 'numpy':
+            self.schedule = self._numpy_schedule()
+        elif backend == 'python':
+            self._compute_schedule_python()
+        else:
+            raise ValueError(f'Warning: Unknown schedule backend {backend}')
+
+        self.time_to_loan_termination = len(self.schedule) if len(self.schedule) > 0 else None
+        self.total_interest_paid = float(self.schedule.applied_interest.sum())
+        self.total_principal_paid = float(self.schedule.applied_principal.sum())
+        if backend == 'cents':
+            # sums of whole cents, rounded back to the exact cent total
+            self.total_interest_paid = round(self.total_interest_paid, 2)
+            self.total_principal_paid = round(self.total_principal_paid, 2)
+
+    @instrumentation.timed('schedule')
+    def compute_summary(self, use_cache=True):
+        """ Compute the time to loan termination, total principal paid and total interest paid in closed form,
+            without building the schedule.
+            :param use_cache: True to look the summary up in the process-wide schedule cache
+            :return: None, the metrics are stored in instance members and the schedule is left untouched
+        """
+        self._unbind_batch()
+
+        def summary():
+            return Amortization.summary(self.principal, self.rate, self.payment, self.extra_payment)
+
+        if use_cache:
+            n, total_interest_paid, total_principal_paid = schedule_cache.get(
+                ScheduleCache.key('summary', self.principal, self.rate, self.payment, self.extra_payment), summary)
+        else:
+            n, total_interest_paid, total_principal_paid = summary()
+        self.time_to_loan_termination = int(n) if n > 0 else None
+        self.total_interest_paid = float(total_interest_paid)
+        self.total_principal_paid = float(total_principal_paid)
+
+    def _numpy_schedule(self):
+        """ Return the schedule computed as columns by the Amortization engine.
+        """
+        return Schedule.from_block(Amortization.schedule(self.principal, self.rate, self.payment, self.extra_payment))
+
+    def _cents_schedule(self, rounding):
+        """ Return the schedule computed in integer cents by the CentsAmortization engine, in dollars.
+        """
+        cents = CentsAmortization.schedule(self.principal, self.rate, self.payment, self.extra_payment, rounding)
+        return Schedule.from_block(cents / 100.0)
+
+    def _compute_schedule_python(self):
+        """ Fill the schedule by stepping through it one month at a time.
         """
         begin_principal = self.principal
         payment = self.payment
         payment_number = 0
+        rows = []
 
         while begin_principal > 0.0:
             payment_number += 1
@@ -51,33 +164,48 @@ class Loan:
                 extra_payment = 0.0
                 applied_principal = payment - applied_interest + extra_payment
             end_principal = begin_principal - applied_principal
-            self.schedule[payment_number] = (payment_number, begin_principal, payment,
-                                             self.extra_payment, applied_principal,
-                                             applied_interest, end_principal)
+            rows.append((payment_number, begin_principal, payment,
+                         self.extra_payment, applied_principal,
+                         applied_interest, end_principal))
             begin_principal = end_principal
 
-        self.time_to_loan_termination = max(self.schedule.keys()) if len(self.schedule.keys()) > 0 else None
-        self.total_interest_paid = 0.0
-        self.total_principal_paid = 0.0
-        for pay in self.schedule.values():
-            self.total_interest_paid += pay[5]
-            self.total_principal_paid += pay[4]
-            
-    def return_loan_schedule(self):
+        self.schedule = Schedule.from_rows(rows)
+
+    def iter_blocks(self, chunk_months=120):
+        """ Generate the schedule a few months at a time. A schedule already computed is streamed as it is, so the
+            rows are those of the backend that computed it, e.g. exact cents; otherwise the schedule is computed
+            lazily with the Amortization engine, without storing it.
+            :param chunk_months: number of months per block
+            :return: generator of consecutive (fields x months) blocks in the field order of Schedule
+        """
+        if len(self.schedule) > 0:
+            for start in range(0, len(self.schedule), chunk_months):
+                yield self.schedule.block[:, start:start + chunk_months]
+        else:
+            yield from Amortization.iter_schedule(self.principal, self.rate, self.payment, self.extra_payment,
+                                                  chunk_months=chunk_months)
+
+    def iter_schedule(self, chunk_months=120):
+        """ Generate the schedule row by row, see iter_blocks. A schedule that is not computed yet is not stored, so
+            scanning a long schedule runs in constant memory and can stop as soon as a condition holds.
+            :param chunk_months: number of months computed at a time
+            :return: generator of (month, begin principal, payment, extra payment, applied principal,
+                     applied interest, end principal) rows, in the layout of Loan.schedule
+        """
+        month = 0
+        for block in self.iter_blocks(chunk_months=chunk_months):
+            months = range(month + 1, month + block.shape[1] + 1)
+            yield from zip(months, *block.tolist())
+            month += block.shape[1]
+
+    @instrumentation.timed('dataframe')
+    def return_loan_schedule(self, rounded=True):
         """ Return the schedule in a dataframe
+            :param rounded: True for a copy rounded to cents, False for a zero-copy view of the schedule columns
         """
-        import pandas as pd
-        loan_schedule =  pd.DataFrame.from_dict(self.schedule,
-                                                orient='index',
-                                                columns=['Month', 'Begin_Principal', 'Payment', 'Extra_Payment',
-                                                         'Applied_Principal','Applied_Interest','End_Principal ']).round(2)
-        
-        Accumulated_Interest = 0
-        loan_schedule['Accumulated_Interest'] = 0
-        
-        for i in range(loan_schedule.shape[0]):
-            Accumulated_Interest += loan_schedule['Applied_Interest'].values[i]
-            loan_schedule.iloc[i,7] = round(Accumulated_Interest,2)
+        loan_schedule = self.schedule.to_dataframe(rounded=rounded)
+        if rounded:
+            loan_schedule['Accumulated_Interest'] = loan_schedule['Accumulated_Interest'].round(2)
             
         return loan_schedule
         
@@ -0,0 +1,129 @@
+import numpy as np
+
+from loan_analytics.Amortization import Amortization
+from loan_analytics.CentsAmortization import CentsAmortization
+from loan_analytics.Instrumentation import instrumentation
+from loan_analytics.Loan import Loan
+from loan_analytics.Schedule import Schedule
+
+
+class LoanBatch:
+    """ Batch of Loans class
+    With arrays of principal, rate, payment, and extra payment, compute the amortization schedules of all loans at
+    once as padded (loans x months) matrices, as well as per loan metrics such as time to loan termination, total
+    principal paid, and total interest paid.
+    """
+    def __init__(self, principal, rate, payment, extra_payment=0.0):
+        """ Constructor to setup a batch of loans.
+            :param principal: array of principal amounts left on the loans
+            :param rate: array of annualized interest rates as percentages
+            :param payment: array of minimum expected payments
+            :param extra_payment: array of additional payments applied to the principal
+        """
+        self.principal, self.rate, self.payment, self.extra_payment = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(value, dtype=np.float64)) for value in (principal, rate, payment, extra_payment)))
+        self.block = None
+        self.begin_principal = None
+        self.payments = None
+        self.extra_payments = None
+        self.applied_principal = None
+        self.applied_interest = None
+        self.end_principal = None
+        self.time_to_loan_termination = None
+        self.total_principal_paid = None
+        self.total_interest_paid = None
+
+    @classmethod
+    def from_loans(cls, loans):
+        """ Setup a batch from the parameters of existing loans.
+            :param loans: list of single loans
+            :return: batch of loans
+        """
+        return cls(principal=[loan.principal for loan in loans],
+                   rate=[loan.rate for loan in loans],
+                   payment=[loan.payment for loan in loans],
+                   extra_payment=[loan.extra_payment for loan in loans])
+
+    def get_loan_count(self):
+        """ Return the number of loans in the batch
+            :return: number of loans in the batch
+        """
+        return self.principal.shape[0]
+
+    @instrumentation.timed('validation')
+    def check_loan_parameters(self, first_index=0):
+        """ Validate the parameters of every loan in the batch at once.
+            Raises the same errors as Loan.check_loan_parameters, for the first offending loan.
+            :param first_index: index reported for the first loan of the batch, e.g. its row in a loan tape
+        """
+        payment_critical = np.round(self.principal * self.rate / 12.0 / 100, 2) + 0.01
+        missing = np.isnan(self.principal) | np.isnan(self.rate) | np.isnan(self.payment) | np.isnan(self.extra_payment)
+        checks = [(missing, 'Principal, rate, payment and extra payment must be numbers'),
+                  (self.principal < 0.01, 'Principal must be greater than 0.01'),
+                  (self.rate < 0.0, 'Interest rate must be greater than or equal to 0.0'),
+                  (self.payment < 0.01, 'Payment must be greater than 0.01'),
+                  (self.extra_payment < 0.0, 'Extra payment must be greater than or equal to 0.0'),
+                  (self.payment < payment_critical + 0.01, 'Payment (excluding extra payment) must be greater than {}')]
+        for invalid, message in checks:
+            if np.any(invalid):
+                index = int(np.argmax(invalid))
+                raise ValueError(f'Warning: Loan {first_index + index}: ' + message.format(payment_critical[index]))
+
+    @instrumentation.timed('schedule')
+    def compute_schedule(self, backend='numpy', rounding='half_up'):
+        """ Compute the schedules of all loans in the batch.
+            :param backend: 'numpy' for the Amortization engine, 'cents' for the integer cents CentsAmortization engine
+            :param rounding: rounding rule of the monthly interest of the cents backend, one of
+                             CentsAmortization.rounding_modes
+            :return: None, the schedules are stored as (loans x months) instance matrices, padded with zeros after
+                     each loan's termination, which are views into one (fields x loans x months) block
+        """
+        if backend == 'numpy':
+            self.time_to_loan_termination, self.block = \
+                Amortization.schedule_matrix(self.principal, self.rate, self.payment, self.extra_payment)
+        elif backend == 'cents':
+            self.time_to_loan_termination, cents = CentsAmortization.schedule_matrix(
+                self.principal, self.rate, self.payment, self.extra_payment, rounding)
+            self.block = cents / 100.0
+        else:
+            raise ValueError(f'Warning: Unknown schedule backend {backend}')
+        (self.begin_principal, self.payments, self.extra_payments,
+         self.applied_principal, self.applied_interest, self.end_principal) = self.block
+
+        if backend == 'cents':
+            # sums of whole cents, taken exactly in integers
+            self.total_principal_paid = cents[3].sum(axis=1) / 100.0
+            self.total_interest_paid = cents[4].sum(axis=1) / 100.0
+        else:
+            self.total_principal_paid = self.applied_principal.sum(axis=1)
+            self.total_interest_paid = self.applied_interest.sum(axis=1)
+
+    @instrumentation.timed('schedule')
+    def compute_summary(self):
+        """ Compute the per loan metrics of the batch in closed form, without building the schedules.
+            :return: None, the metrics are stored in instance arrays and the schedule matrices are left untouched
+        """
+        self.time_to_loan_termination, self.total_interest_paid, self.total_principal_paid = \
+            Amortization.summary(self.principal, self.rate, self.payment, self.extra_payment)
+
+    def loan_schedule(self, index):
+        """ Return the schedule of a single loan of the batch.
+            :param index: position of the loan in the batch
+            :return: columnar schedule, in the layout of Loan.schedule
+        """
+        n = int(self.time_to_loan_termination[index])
+        return Schedule.from_block(self.block[:, index, :n], source=(self.block, index))
+
+    def loan(self, index):
+        """ Return a single loan of the batch, with its schedule and metrics already filled in.
+            :param index: position of the loan in the batch
+            :return: single loan
+        """
+        loan = Loan(principal=float(self.principal[index]), rate=float(self.rate[index]),
+                    payment=float(self.payment[index]), extra_payment=float(self.extra_payment[index]))
+        loan.schedule = self.loan_schedule(index)
+        n = int(self.time_to_loan_termination[index])
+        loan.time_to_loan_termination = n if n > 0 else None
+        loan.total_principal_paid = float(self.total_principal_paid[index])
+        loan.total_interest_paid = float(self.total_interest_paid[index])
+        return loan
@@ -1,5 +1,9 @@
-from loan_analytics.Loan import Loan
-from loan_analytics.LoanPortfolio import LoanPortfolio
+import numpy as np
+
+from loan_analytics.Amortization import Amortization
+from loan_analytics.Instrumentation import instrumentation
+from loan_analytics.LoanBatch import LoanBatch
+from loan_analytics.ScheduleCache import ScheduleCache, schedule_cache
 
 
 class LoanImpacts:
@@ -13,92 +17,136 @@ class LoanImpacts:
         self.extra_payment = extra_payment
         self.contributions = contributions
 
-    def compute_impacts(self):
-        # setup a loan portfolio
-        # loan_portfolio = LoanPortfolio()
-        
+    @instrumentation.timed('schedule')
+    def compute_impacts(self, verbose=False, use_cache=True):
+        """ Compute the impact of each contributor on the interest paid and the duration of the loan.
+            The 2 + N scenarios (all contributions, no contributions, and each contributor quitting) are evaluated
+            together in one closed-form batch.
+            :param verbose: True to also print the impact table
+            :param use_cache: True to look the scenario totals up in the process-wide schedule cache
+            :return: dataframe with one row per scenario, in the order all, none, then each contributor quitting
+        """
         import pandas as pd
-        
-        impact_matrix = []
 
-        # loan with all contributions (mi)_all
-        #
-        loan_all = Loan(principal=self.principal, rate=self.rate,
-                        payment=self.payment, extra_payment=self.extra_payment + sum(self.contributions))
-        loan_all.check_loan_parameters()
-        loan_all.compute_schedule()
+        if use_cache:
+            duration, interest_paid = schedule_cache.get(
+                ScheduleCache.key('impacts', self.principal, self.rate, self.payment, self.extra_payment,
+                                  tuple(float(contribution) for contribution in self.contributions)),
+                self._compute_scenarios)
+        else:
+            duration, interest_paid = self._compute_scenarios()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            micro_impact_interest_paid = (interest_paid - interest_paid[0]) / interest_paid[0]
+            micro_impact_duration = (duration - duration[0]) / duration[0]
+        micro_impact_interest_paid[0] = 0
+        micro_impact_duration[0] = 0
+        # the no contribution case is reported as a reduction in duration
+        micro_impact_duration[1] = -micro_impact_duration[1]
+
+        impact_df = pd.DataFrame({'Interest_Paid': np.round(interest_paid, 2),
+                                  'Duration': duration,
+                                  'MIInterest': np.round(micro_impact_interest_paid, 4),
+                                  'MIDuration': np.round(micro_impact_duration, 4)})
+
+        if verbose:
+            print(f'\nIndex\tInterestPaid\tDuration\tMIInterest\tMIDuration')
+            for index, impact in enumerate(impact_df.itertuples(index=False)):
+                label = 'ALL' if index == 0 else index - 1
+                print(f'{label}\t\t\t', impact.Interest_Paid, f'\t\t', impact.Duration, f'\t\t',
+                      impact.MIInterest, f'\t', impact.MIDuration)
 
-        # loan with no contributions (mi)_0
-        #
-        loan_none = Loan(principal=self.principal, rate=self.rate,
-                         payment=self.payment, extra_payment=self.extra_payment)
-        loan_none.check_loan_parameters()
-        loan_none.compute_schedule()
-
-        micro_impact_interest_paid_all = \
-            (loan_none.total_interest_paid - loan_all.total_interest_paid) / loan_all.total_interest_paid
-        micro_impact_duration_all = -\
-            (loan_none.time_to_loan_termination - loan_all.time_to_loan_termination) / loan_all.time_to_loan_termination
-
-        # micro_impact_interest_paid_all = loan_none.total_interest_paid / loan_all.total_interest_paid
-        # micro_impact_duration_all = loan_none.time_to_loan_termination / loan_all.time_to_loan_termination
-
-        print(f'\nIndex\tInterestPaid\tDuration\tMIInterest\tMIDuration')
-        print(f'ALL \t\t',
-              round(loan_all.total_interest_paid, 2), f'\t\t', loan_all.time_to_loan_termination)
-        print(f'0\t\t\t',
-              round(loan_none.total_interest_paid, 2), f'\t\t', loan_none.time_to_loan_termination, f'\t\t',
-              round(micro_impact_interest_paid_all, 4), f'\t', round(micro_impact_duration_all, 4))
-        
-        impact_all = [round(loan_all.total_interest_paid, 2),
-                      loan_all.time_to_loan_termination,0,0]
-        
-        impact_matrix.append(impact_all)
-        
-        impact_none = [round(loan_none.total_interest_paid, 2),
-                       loan_none.time_to_loan_termination,
-                       round(micro_impact_interest_paid_all, 4),
-                       round(micro_impact_duration_all, 4)]
-
-        impact_matrix.append(impact_none)
-        
-        # iterate over each contribution (mi)_index
-        #
-        for index, contribution in enumerate(self.contributions):
-            loan_index = Loan(principal=self.principal, rate=self.rate, payment=self.payment,
-                              extra_payment=self.extra_payment + sum(self.contributions) - contribution)
-            loan_index.check_loan_parameters()
-            loan_index.compute_schedule()
-
-            micro_impact_interest_paid = \
-                (loan_index.total_interest_paid - loan_all.total_interest_paid) / loan_all.total_interest_paid
-            micro_impact_duration = \
-                (loan_index.time_to_loan_termination - loan_all.time_to_loan_termination) / loan_all.time_to_loan_termination
-
-            # micro_impact_interest_paid = loan.total_interest_paid / loan_all.total_interest_paid
-            # micro_impact_duration = loan.time_to_loan_termination / loan_all.time_to_loan_termination
-
-            print(index+1, f'\t\t\t',
-                  round(loan_index.total_interest_paid, 2), f'\t\t', loan_index.time_to_loan_termination, f'\t\t',
-                  round(micro_impact_interest_paid, 4), f'\t', round(micro_impact_duration, 4))
-
-            impact_without_k = [round(loan_index.total_interest_paid, 2),
-                                loan_index.time_to_loan_termination,
-                                round(micro_impact_interest_paid, 4),
-                                round(micro_impact_duration, 4)]
-            
-            impact_matrix.append(impact_without_k)
-            
-        impact_df = pd.DataFrame(impact_matrix,
-                                 columns=['Interest_Paid', 'Duration', 'MIInterest','MIDuration'])
-            
         return impact_df
 
+    def _compute_scenarios(self):
+        """ Compute the duration and the interest paid of every scenario in one closed-form batch.
+            :return: tuple (duration, interest paid) of arrays in the order all, none, then each contributor quitting
+        """
+        contributions = np.asarray(self.contributions, dtype=np.float64)
+        total_contribution = contributions.sum()
 
-
-
-
-
-
-
-
+        # extra payment of the loan with all contributions (mi)_all, no contributions (mi)_0 and without each
+        # contribution (mi)_index
+        #
+        extra_payments = np.concatenate([[self.extra_payment + total_contribution, self.extra_payment],
+                                         self.extra_payment + total_contribution - contributions])
+        scenarios = LoanBatch(principal=self.principal, rate=self.rate, payment=self.payment,
+                              extra_payment=extra_payments)
+        scenarios.check_loan_parameters()
+        scenarios.compute_summary()
+        return scenarios.time_to_loan_termination, scenarios.total_interest_paid
+
+    @instrumentation.timed('schedule')
+    def compute_shapley(self, n_permutations=1000, tolerance=None, processes=1, seed=None, chunk_permutations=100):
+        """ Estimate the Shapley value of each contributor on the interest saved and the months saved by sampling
+            contributor orderings. Unlike the "X quits" impacts, the values add up to the total effect of all
+            contributions. Each ordering is evaluated with the closed-form totals of its N + 1 cumulative
+            contribution levels, without building schedules.
+            :param n_permutations: maximum number of sampled orderings
+            :param tolerance: standard error of the interest Shapley values at which sampling stops early, None to
+                              always sample n_permutations orderings
+            :param processes: number of worker processes, 1 to sample in this process
+            :param seed: seed for reproducible sampling; the result does not depend on the number of processes
+            :param chunk_permutations: number of orderings sampled per task
+            :return: dataframe with one row per contributor holding the Shapley values and their standard errors
+        """
+        import pandas as pd
+        from concurrent.futures import ProcessPoolExecutor
+
+        contributions = np.asarray(self.contributions, dtype=np.float64)
+        if n_permutations < 1:
+            raise ValueError('Warning: Number of permutations must be at least 1')
+        if contributions.size == 0:
+            raise ValueError('Warning: Shapley values need at least one contributor')
+        LoanBatch(principal=self.principal, rate=self.rate, payment=self.payment,
+                  extra_payment=[self.extra_payment, self.extra_payment + contributions.sum()]).check_loan_parameters()
+
+        n_chunks = -(-n_permutations // chunk_permutations)
+        chunk_sizes = [min(chunk_permutations, n_permutations - chunk * chunk_permutations) for chunk in range(n_chunks)]
+        tasks = [(self.principal, self.rate, self.payment, self.extra_payment, contributions, size, chunk_seed)
+                 for size, chunk_seed in zip(chunk_sizes, np.random.SeedSequence(seed).spawn(n_chunks))]
+
+        executor = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+        results = (executor.map if executor else map)(LoanImpacts._sample_marginals, tasks)
+        sums = np.zeros((2, contributions.shape[0]))
+        squares = np.zeros((2, contributions.shape[0]))
+        count = 0
+        try:
+            # chunks are consumed in order, so early stopping gives the same result for any number of processes
+            for marginals in results:
+                sums += marginals.sum(axis=1)
+                squares += (marginals ** 2).sum(axis=1)
+                count += marginals.shape[1]
+                mean = sums / count
+                error = np.sqrt(np.maximum(squares - count * mean ** 2, 0.0) / max(count - 1, 1) / count)
+                if tolerance is not None and count > 1 and error[0].max() <= tolerance:
+                    break
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+        shapley_df = pd.DataFrame({'Shapley_Interest': mean[0],
+                                   'Shapley_Interest_Error': error[0],
+                                   'Shapley_Duration': mean[1],
+                                   'Shapley_Duration_Error': error[1]})
+        shapley_df.attrs['permutations'] = count
+        return shapley_df
+
+    @staticmethod
+    def _sample_marginals(task):
+        """ Sample contributor orderings and return the marginal savings of each contributor in each ordering.
+            :param task: tuple (principal, rate, payment, extra payment, contributions, number of orderings, seed)
+            :return: (2 x orderings x contributors) array of interest saved and months saved
+        """
+        principal, rate, payment, extra_payment, contributions, n_permutations, seed = task
+        rng = np.random.default_rng(seed)
+        order = rng.permuted(np.tile(np.arange(contributions.shape[0]), (n_permutations, 1)), axis=1)
+
+        cumulative = np.zeros((n_permutations, contributions.shape[0] + 1))
+        np.cumsum(contributions[order], axis=1, out=cumulative[:, 1:])
+        duration, interest_paid, _ = Amortization.summary(principal, rate, payment, extra_payment + cumulative)
+
+        marginals = np.empty((2, n_permutations, contributions.shape[0]))
+        np.put_along_axis(marginals[0], order, interest_paid[:, :-1] - interest_paid[:, 1:], axis=1)
+        np.put_along_axis(marginals[1], order, duration[:, :-1] - duration[:, 1:], axis=1)
+        return marginals
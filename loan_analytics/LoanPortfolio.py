@@ -1,69 +1,363 @@
+import numpy as np
+
+from loan_analytics.Instrumentation import instrumentation
+from loan_analytics.LoanBatch import LoanBatch
+from loan_analytics.ParallelCompute import ParallelCompute
+from loan_analytics.Schedule import Schedule
+from loan_analytics.ScheduleStore import ScheduleStore
+
+
 class LoanPortfolio:
     """ Portfolio of Loans class
     """
+    # numeric columns of a loan tape read by from_csv and from_parquet
+    tape_fields = ['principal', 'rate', 'payment', 'extra_payment']
 
     def __init__(self):
         """ Constructor to setup a portfolio of loans.
         """
         self.loans = []
-        self.schedule = {}
+        self.loan_ids = []
+        self.schedule = Schedule()
+        self._next_loan_id = 0
+        self._schedules = []
+        self._totals = np.zeros((len(Schedule.columns) - 1, 0))
+        self._loan_counts = np.zeros(0, dtype=np.int64)
+        # loans ingested in bulk by from_csv / from_parquet, kept as arrays rather than Loan objects
+        self.book = None
+        self.book_ids = None
+        self._book_totals = np.zeros((len(Schedule.columns) - 1, 0))
+        self._book_counts = np.zeros(0, dtype=np.int64)
+        # on-disk schedules of the book, when they were written to a ScheduleStore at ingestion
+        self.store = None
+
+    @classmethod
+    def from_csv(cls, path, chunk_loans=4096, columns=None, store=None):
+        """ Setup a portfolio from a loan tape in a CSV file, read and computed in bounded-memory chunks.
+            :param path: path of the CSV file, with one loan per row
+            :param chunk_loans: number of loans read, validated and computed at a time
+            :param columns: optional mapping of the names principal, rate, payment, extra_payment and loan_id to the
+                            headers of the file; extra_payment and loan_id may be absent
+            :param store: optional directory of a new or empty ScheduleStore the schedule of every chunk is written to
+            :return: portfolio whose book holds the ingested loans
+        """
+        import pandas as pd
+        columns = LoanPortfolio._tape_columns(columns)
+        header = pd.read_csv(path, nrows=0).columns
+        usecols = LoanPortfolio._present_columns(columns, header)
+        dtypes = {columns[name]: np.float64 for name in LoanPortfolio.tape_fields if columns[name] in usecols}
+        chunks = pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunk_loans)
+        return cls._from_chunks(({name: chunk[columns[name]].to_numpy() for name in columns
+                                  if columns[name] in usecols} for chunk in chunks), chunk_loans, store,
+                                columns['loan_id'])
+
+    @classmethod
+    def from_parquet(cls, path, chunk_loans=4096, columns=None, store=None):
+        """ Setup a portfolio from a loan tape in a Parquet file, read and computed in bounded-memory record batches.
+            :param path: path of the Parquet file, with one loan per row
+            :param chunk_loans: number of loans read, validated and computed at a time
+            :param columns: optional mapping of the names principal, rate, payment, extra_payment and loan_id to the
+                            columns of the file; extra_payment and loan_id may be absent
+            :param store: optional directory of a new or empty ScheduleStore the schedule of every chunk is written to
+            :return: portfolio whose book holds the ingested loans
+        """
+        import pyarrow.parquet as pq
+        columns = LoanPortfolio._tape_columns(columns)
+        parquet_file = pq.ParquetFile(path)
+        usecols = LoanPortfolio._present_columns(columns, parquet_file.schema_arrow.names)
+        batches = parquet_file.iter_batches(batch_size=chunk_loans, columns=usecols)
+        return cls._from_chunks(({name: batch.column(columns[name]).to_numpy(zero_copy_only=False) for name in columns
+                                  if columns[name] in usecols} for batch in batches), chunk_loans, store,
+                                columns['loan_id'])
+
+    @staticmethod
+    def _tape_columns(columns):
+        names = {name: name for name in LoanPortfolio.tape_fields + ['loan_id']}
+        names.update(columns or {})
+        return names
+
+    @staticmethod
+    def _present_columns(columns, header):
+        """ Return the columns of a loan tape to read, raising if a required one is missing.
+        """
+        for name in ['principal', 'rate', 'payment']:
+            if columns[name] not in header:
+                raise ValueError(f'Warning: The loan tape has no {columns[name]} column')
+        return [columns[name] for name in columns if columns[name] in header]
+
+    @staticmethod
+    def _tape_loan_ids(values, column):
+        """ Return the loan ids of a chunk of a loan tape as integers, raising if they are not whole numbers.
+        """
+        values = np.asarray(values)
+        if np.issubdtype(values.dtype, np.integer):
+            return values.astype(np.int64)
+        if np.issubdtype(values.dtype, np.floating) and np.all(np.isfinite(values)) and \
+                np.all(values == np.round(values)):
+            return values.astype(np.int64)
+        raise ValueError(f'Warning: The loan tape {column} column must hold integer loan ids')
+
+    @classmethod
+    def _from_chunks(cls, chunks, chunk_loans, store=None, id_column='loan_id'):
+        """ Validate and compute the chunks of a loan tape as LoanBatches, accumulating the portfolio schedule and
+            the per loan metrics, without creating one object per loan.
+            :param chunks: iterable of dictionaries of column arrays
+            :param chunk_loans: maximum number of loans per schedule computation
+            :param store: optional directory of a ScheduleStore the schedule of every chunk is written to, which must
+                          be new or empty
+            :param id_column: name of the loan id column in the file, reported when its ids are not integers
+            :return: portfolio whose book holds the ingested loans
+        """
+        portfolio = cls()
+        if store is not None:
+            portfolio.store = ScheduleStore(store)
+            if len(portfolio.store) > 0:
+                raise ValueError(f'Warning: The schedule store {portfolio.store.path} already holds loans, '
+                                 f'clear it or pass an empty directory')
+        totals = np.zeros((len(Schedule.columns) - 1, 0))
+        counts = np.zeros(0, dtype=np.int64)
+        parts = {name: [] for name in ['loan_id', 'principal', 'rate', 'payment', 'extra_payment',
+                                       'time_to_loan_termination', 'total_principal_paid', 'total_interest_paid']}
+        first_index = 0
+        for chunk in chunks:
+            size = len(chunk['principal'])
+            if 'loan_id' in chunk:
+                chunk['loan_id'] = LoanPortfolio._tape_loan_ids(chunk['loan_id'], id_column)
+            for start in range(0, size, chunk_loans):
+                stop = min(start + chunk_loans, size)
+                batch = LoanBatch(principal=chunk['principal'][start:stop], rate=chunk['rate'][start:stop],
+                                  payment=chunk['payment'][start:stop],
+                                  extra_payment=chunk['extra_payment'][start:stop] if 'extra_payment' in chunk else 0.0)
+                batch.check_loan_parameters(first_index=first_index + start)
+                batch.compute_schedule()
+
+                months = batch.block.shape[2]
+                if months > totals.shape[1]:
+                    totals = np.pad(totals, ((0, 0), (0, months - totals.shape[1])))
+                    counts = np.pad(counts, (0, months - counts.shape[0]))
+                totals[:, :months] += batch.block.sum(axis=1)
+                counts[:months] += np.cumsum(np.bincount(batch.time_to_loan_termination,
+                                                         minlength=months + 1)[::-1])[::-1][1:]
+
+                parts['loan_id'].append(chunk['loan_id'][start:stop] if 'loan_id' in chunk else
+                                        np.arange(first_index + start, first_index + stop) + portfolio._next_loan_id)
+                if portfolio.store is not None:
+                    portfolio.store.append(parts['loan_id'][-1], batch.time_to_loan_termination, batch.block)
+                for name in ['principal', 'rate', 'payment', 'extra_payment', 'time_to_loan_termination',
+                             'total_principal_paid', 'total_interest_paid']:
+                    parts[name].append(getattr(batch, name))
+            first_index += size
+
+        if first_index > 0:
+            values = {name: np.concatenate(arrays) for name, arrays in parts.items()}
+            portfolio.book = LoanBatch(principal=values['principal'], rate=values['rate'], payment=values['payment'],
+                                       extra_payment=values['extra_payment'])
+            portfolio.book.time_to_loan_termination = values['time_to_loan_termination']
+            portfolio.book.total_principal_paid = values['total_principal_paid']
+            portfolio.book.total_interest_paid = values['total_interest_paid']
+            portfolio.book_ids = values['loan_id']
+            # loans added later are numbered past the book, so their ids never collide with the book ids
+            portfolio._next_loan_id = max(portfolio._next_loan_id, int(portfolio.book_ids.max()) + 1)
+        portfolio._book_totals = totals
+        portfolio._book_counts = counts
+        portfolio.aggregate()
+        return portfolio
 
     def add_loan(self, loan):
-        """ Add a loan to the portfolio
+        """ Add a loan to the portfolio, updating the running portfolio schedule in O(months of that loan).
+            A loan whose schedule is computed after it was added is only picked up by the next aggregate().
             :param loan: single loan
+            :return: id of the loan within the portfolio
         """
+        loan_id = self._next_loan_id
+        self._next_loan_id += 1
         self.loans.append(loan)
+        self.loan_ids.append(loan_id)
+        self._schedules.append(loan.schedule)
+        self._update_totals(loan.schedule, 1)
+        return loan_id
 
     def remove_last_loan(self):
         """ Remove the last loan within the portfolio
         """
-        self.loans.pop(-1)
+        self._remove_loan_at(-1)
+
+    def remove_loan(self, loan_id):
+        """ Remove a loan from the portfolio, updating the running portfolio schedule in O(months of that loan).
+            :param loan_id: id returned by add_loan
+        """
+        if loan_id not in self.loan_ids:
+            raise ValueError(f'Warning: There is no loan with id {loan_id} in the portfolio')
+        self._remove_loan_at(self.loan_ids.index(loan_id))
+
+    def _remove_loan_at(self, index):
+        self.loans.pop(index)
+        self.loan_ids.pop(index)
+        schedule = self._schedules.pop(index)
+        if isinstance(schedule, tuple):
+            batch, row = schedule
+            schedule = batch.loan_schedule(row)
+        self._update_totals(schedule, -1)
+
+    def _update_totals(self, schedule, sign):
+        """ Add (sign 1) or subtract (sign -1) a loan schedule to the running per month totals.
+            :param schedule: schedule of the loan being added or removed
+            :param sign: 1 to add the schedule, -1 to subtract it
+        """
+        months = len(schedule)
+        if months > self._totals.shape[1]:
+            capacity = max(months, 2 * self._totals.shape[1])
+            totals = np.zeros((self._totals.shape[0], capacity))
+            totals[:, :self._totals.shape[1]] = self._totals
+            loan_counts = np.zeros(capacity, dtype=np.int64)
+            loan_counts[:self._loan_counts.shape[0]] = self._loan_counts
+            self._totals, self._loan_counts = totals, loan_counts
+
+        self._totals[:, :months] += sign * schedule.block
+        self._loan_counts[:months] += sign
+        # months without any loan left are reset exactly, so subtraction does not leave rounding residue
+        self._totals[:, :months][:, self._loan_counts[:months] == 0] = 0.0
+
+        active_months = np.flatnonzero(self._loan_counts)
+        months = int(active_months[-1]) + 1 if active_months.size > 0 else 0
+        self._snapshot(months)
+
+    def _snapshot(self, months):
+        """ Store the running totals as the portfolio schedule. The schedule is a read-only copy rather than a view of
+            the totals, so a schedule read before a later add_loan or remove_loan stays as it was.
+            :param months: number of months of the portfolio schedule
+        """
+        block = self._totals[:, :months].copy()
+        block.flags.writeable = False
+        self.schedule = Schedule.from_block(block)
 
     def get_loan_count(self):
         """ Return the number of loans in the portfolio
-            :return: number of loans in the portfolio
+            :return: number of loans in the portfolio, including the ingested book
         """
-        return len(self.loans)
+        return len(self.loans) + (self.book.get_loan_count() if self.book is not None else 0)
     
     def reset(self):
         """
         # set all members to their initial value
         """
-        self.loans = []
-        self.schedule = {}
-        
+        self.__init__()
+
+    @instrumentation.timed('schedule')
+    def compute_schedule(self, workers=None, shard_loans=1024):
+        """ Compute the schedules of all loans in the portfolio together as one batch.
+            :param workers: number of worker processes the loans are sharded across, see ParallelCompute, or None
+                            to compute the batch in this process in one piece; 1 computes the shards in this process
+                            and e.g. os.cpu_count() uses every CPU
+            :param shard_loans: number of loans per shard of the parallel computation
+            :return: None, each loan is bound to its row of the batch, from which its schedule view and metrics are
+                     built the first time they are read, and the portfolio schedule is summed from the batch block
+        """
+        batch = LoanBatch.from_loans(self.loans)
+        if workers is None:
+            batch.compute_schedule()
+            loan_totals = batch.block.sum(axis=1)
+        else:
+            parallel = ParallelCompute(batch.principal, batch.rate, batch.payment, batch.extra_payment)
+            parallel.compute(workers=workers, shard_loans=shard_loans)
+            batch.time_to_loan_termination, batch.block = parallel.time_to_loan_termination, parallel.block
+            batch.total_principal_paid = parallel.total_principal_paid
+            batch.total_interest_paid = parallel.total_interest_paid
+            # the per month totals were already reduced from the shards
+            loan_totals = parallel.totals
+        for index, loan in enumerate(self.loans):
+            loan.bind_batch(batch, index)
+
+        months = max(loan_totals.shape[1], self._book_totals.shape[1])
+        totals = np.zeros((len(Schedule.columns) - 1, months))
+        totals[:, :self._book_totals.shape[1]] += self._book_totals
+        totals[:, :loan_totals.shape[1]] += loan_totals
+        self._store_totals(totals, batch)
+
+    @instrumentation.timed('schedule')
     def aggregate(self):
         """ Aggregate the loans within the portfolio by creating a schedule that includes all loans.
-            :return: None, the schedule is stored in an instance dictionary
+            The loan schedules are stacked into a zero-padded (loans x months) layout and summed along the loan axis.
+            Loans computed in the same LoanBatch are already stacked in its block, so they are summed there in one
+            weighted reduction; other loans are added one schedule block at a time. The schedule is rebuilt from
+            scratch, so repeated calls give the same result, and it also resets the running totals kept by add_loan
+            and remove_loan. The schedule of the ingested book, summed once at ingestion, is added as is.
+            :return: None, the schedule is stored in an instance columnar schedule
         """
+        months = max(max((len(loan.schedule) for loan in self.loans), default=0), self._book_totals.shape[1])
+        totals = np.zeros((len(Schedule.columns) - 1, months))
+        totals[:, :self._book_totals.shape[1]] += self._book_totals
+
+        # number of times each row of each batch block appears in the portfolio
+        batch_weights = {}
         for loan in self.loans:
-            for key, pay in loan.schedule.items():
-                if key not in self.schedule.keys():
-                    self.schedule[key] = (key, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
-                begin_principal = self.schedule[key][1] + pay[1]
-                payment = self.schedule[key][2] + pay[2]
-                extra_payment = self.schedule[key][3] + pay[3]
-                applied_principal = self.schedule[key][4] + pay[4]
-                applied_interest = self.schedule[key][5] + pay[5]
-                end_principal = self.schedule[key][6] + pay[6]
-                self.schedule[key] = (key, begin_principal, payment, extra_payment,
-                                      applied_principal, applied_interest, end_principal)
-
-    def return_portfolio_schedule(self):
+            schedule = loan.schedule
+            if schedule.source is not None:
+                batch_block, row = schedule.source
+                if id(batch_block) not in batch_weights:
+                    batch_weights[id(batch_block)] = (batch_block, np.zeros(batch_block.shape[1]))
+                batch_weights[id(batch_block)][1][row] += 1.0
+            else:
+                totals[:, :len(schedule)] += schedule.block
+
+        for batch_block, weights in batch_weights.values():
+            batch_months = min(batch_block.shape[2], months)
+            for total, matrix in zip(totals, batch_block):
+                total[:batch_months] += weights @ matrix[:, :batch_months]
+        self._store_totals(totals)
+
+    def _store_totals(self, totals, batch=None):
+        """ Store aggregated per month totals as the portfolio schedule and reset the running totals to them.
+            :param totals: (fields x months) totals of the loans and the ingested book
+            :param batch: LoanBatch the loans were computed in, row for row, whose schedules are then only looked up
+                          when a loan is removed
+        """
+        months = totals.shape[1]
+        if batch is None:
+            lengths = np.array([len(loan.schedule) for loan in self.loans], dtype=np.int64)
+            self._schedules = [loan.schedule for loan in self.loans]
+        else:
+            lengths = batch.time_to_loan_termination.astype(np.int64)
+            self._schedules = [(batch, index) for index in range(len(self.loans))]
+        self._totals = totals
+        self._loan_counts = np.cumsum(np.bincount(lengths, minlength=months + 1)[::-1])[::-1][1:]
+        self._loan_counts[:self._book_counts.shape[0]] += self._book_counts
+        self._snapshot(months)
+
+    def iter_schedule(self, chunk_months=120):
+        """ Generate the portfolio schedule lazily by merging the loans month by month, without storing the loan
+            or portfolio schedules. Only one chunk of months per loan is held in memory at a time. Loans whose
+            schedule is computed are streamed from it, in the numbers of their backend, see Loan.iter_blocks. The
+            ingested book is merged from its per month totals, which from_csv / from_parquet summed chunk by chunk
+            at ingestion.
+            :param chunk_months: number of months computed at a time
+            :return: generator of (month, begin principal, payment, extra payment, applied principal,
+                     applied interest, end principal) rows, in the layout of LoanPortfolio.schedule
+        """
+        generators = [loan.iter_blocks(chunk_months=chunk_months) for loan in self.loans]
+        book_months = self._book_totals.shape[1]
+        month = 0
+        while len(generators) > 0 or month < book_months:
+            totals = np.zeros((len(Schedule.columns) - 1, chunk_months))
+            book_block = self._book_totals[:, month:month + chunk_months]
+            totals[:, :book_block.shape[1]] += book_block
+            months = book_block.shape[1]
+            for generator in list(generators):
+                block = next(generator, None)
+                if block is None:
+                    generators.remove(generator)
+                    continue
+                totals[:, :block.shape[1]] += block
+                months = max(months, block.shape[1])
+            yield from zip(range(month + 1, month + months + 1), *totals[:, :months].tolist())
+            month += months
+
+    @instrumentation.timed('dataframe')
+    def return_portfolio_schedule(self, rounded=True):
         """ Return the schedule in a dataframe
+            :param rounded: True for a copy rounded to cents, False for a zero-copy view of the schedule columns
         """
-        import pandas as pd
-        portfolio_schedule =  pd.DataFrame.from_dict(self.schedule,
-                                                     orient='index',
-                                                     columns=['Month', 'Begin_Principal', 'Payment', 'Extra_Payment',
-                                                              'Applied_Principal','Applied_Interest','End_Principal ']).round(2)
-    
-        Accumulated_Interest = 0
-        portfolio_schedule['Accumulated_Interest'] = 0
-        
-        for i in range(portfolio_schedule.shape[0]):
-            Accumulated_Interest += portfolio_schedule['Applied_Interest'].values[i]
-            portfolio_schedule.iloc[i,7] = Accumulated_Interest
+        portfolio_schedule = self.schedule.to_dataframe(rounded=rounded)
             
         return portfolio_schedule
     
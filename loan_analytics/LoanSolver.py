@@ -0,0 +1,215 @@
+import numpy as np
+
+from loan_analytics.Amortization import Amortization
+
+
+class LoanSolver:
+    """ Loan Solver class
+    Solves the annuity equation B_0 = (P + E) (1 - (1 + r)^-n) / r of a loan for one of its unknowns in closed form:
+    the payment that pays a principal off in a given term, the term a payment takes, or the largest principal a
+    payment pays off in a given term. Every function is vectorized, taking scalars or arrays of loans, and accounts for
+    the extra payment E made on top of the payment P each month. Amounts are rounded to the cent in the direction
+    that keeps the loan paid off within the term.
+    The rates of return, the APR of loans with fees and the IRR of cash flows, have no closed form and are found by a
+    batched Newton iteration safeguarded by bisection, which runs over all elements at once for a bounded number of
+    iterations and flags the elements that converged.
+    """
+    @staticmethod
+    def annuity_factor(rate, months):
+        """ Present value of a payment of 1 made every month for a number of months, (1 - (1 + r)^-n) / r, which
+            reduces to n when r is 0.
+            :param rate: annualized interest rate as a percentage
+            :param months: number of monthly payments
+            :return: annuity factor
+        """
+        r = Amortization.monthly_rate(rate)
+        n = np.asarray(months, dtype=np.float64)
+        discount_minus_one = np.expm1(-n * np.log1p(r))
+        return np.where(r > 0.0, -discount_minus_one / np.where(r > 0.0, r, 1.0), n)
+
+    @staticmethod
+    def _check(rate, months):
+        if np.any(np.asarray(rate) < 0.0):
+            raise ValueError('Warning: Interest rate must be greater than or equal to 0.0')
+        if np.any(np.asarray(months) < 1):
+            raise ValueError('Warning: Term must be at least 1 month')
+
+    @staticmethod
+    def payment_for_term(principal, rate, months, extra_payment=0.0):
+        """ Smallest payment, to the cent, that pays a loan off within a term.
+            :param principal: principal amount left on the loan
+            :param rate: annualized interest rate as a percentage
+            :param months: term in months
+            :param extra_payment: additional payment applied to the principal each month
+            :return: payment excluding the extra payment, 0 when the extra payment alone pays the loan off in time
+        """
+        LoanSolver._check(rate, months)
+        total_payment = np.asarray(principal, dtype=np.float64) / LoanSolver.annuity_factor(rate, months)
+        # rounded to a millionth of a cent first, so that an exact cent amount is not pushed up by float noise
+        total_payment = np.ceil(np.round(total_payment * 100.0, 6)) / 100.0
+        return np.maximum(np.round(total_payment - np.asarray(extra_payment, dtype=np.float64), 2), 0.0)
+
+    @staticmethod
+    def term_for_payment(principal, rate, payment, extra_payment=0.0):
+        """ Number of months a payment takes to pay a loan off.
+            :param principal: principal amount left on the loan
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment
+            :param extra_payment: additional payment applied to the principal each month
+            :return: number of payments, as an integer array
+        """
+        return Amortization.term(principal, rate, payment, extra_payment)
+
+    @staticmethod
+    def max_principal(rate, payment, months, extra_payment=0.0):
+        """ Largest principal, to the cent, that a payment pays off within a term.
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment
+            :param months: term in months
+            :param extra_payment: additional payment applied to the principal each month
+            :return: affordable principal
+        """
+        LoanSolver._check(rate, months)
+        total_payment = np.asarray(payment, dtype=np.float64) + np.asarray(extra_payment, dtype=np.float64)
+        principal = np.floor(np.round(total_payment * LoanSolver.annuity_factor(rate, months) * 100.0, 6)) / 100.0
+        # a principal paid off exactly at the term can leave float residue that the schedule engine carries into one
+        # more month, in which case the cent below is affordable
+        overrun = Amortization.term(principal, rate, payment, extra_payment) > np.asarray(months)
+        return np.round(np.where(overrun, principal - 0.01, principal), 2)
+
+    @staticmethod
+    def lowest_rate(periods):
+        """ Lowest rate per period the solvers bracket, at which discounting over the periods stays finite.
+            :param periods: number of periods discounted
+            :return: negative rate per period, above -1
+        """
+        return max(float(np.expm1(-700.0 / max(periods, 1.0))), -0.99)
+
+    @staticmethod
+    def solve(function, guess, low, high, max_iterations=50, tolerance=1e-12):
+        """ Find a root of a batch of functions with Newton steps, falling back to bisection of a bracketing interval
+            whenever a step is not finite or leaves the bracket, so every element converges once it is bracketed.
+            :param function: function of (points, element indices) returning the values and derivatives of the
+                             functions of those elements at those points
+            :param guess: array of initial points, one per element
+            :param low: lower end of the bracket, scalar or array
+            :param high: upper end of the bracket, scalar or array
+            :param max_iterations: maximum number of iterations
+            :param tolerance: relative change of the point under which an element has converged
+            :return: tuple (roots, convergence flags); elements whose functions have the same sign at both ends of
+                     the bracket are NaN, and elements that did not converge keep their last point
+        """
+        x = np.array(guess, dtype=np.float64, ndmin=1)
+        low, high = (np.array(np.broadcast_to(end, x.shape), dtype=np.float64) for end in (low, high))
+        elements = np.arange(x.size)
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            f_low, _ = function(low, elements)
+            f_high, _ = function(high, elements)
+        bracketed = np.sign(f_low) * np.sign(f_high) < 0.0
+        x = np.clip(x, low, high)
+        converged = (f_low == 0.0) | (f_high == 0.0)
+        x = np.where(f_low == 0.0, low, np.where(f_high == 0.0, high, x))
+        x[~(bracketed | converged)] = np.nan
+
+        active = bracketed & ~converged
+        for _ in range(max_iterations):
+            elements = np.flatnonzero(active)
+            if elements.size == 0:
+                break
+            point = x[elements]
+            with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+                f, df = function(point, elements)
+                newton = point - f / df
+            # shrink the bracket to the side of the point where the sign changes
+            below = np.sign(f) == np.sign(f_low[elements])
+            low[elements] = np.where(below, point, low[elements])
+            f_low[elements] = np.where(below, f, f_low[elements])
+            high[elements] = np.where(below, high[elements], point)
+            bisection = 0.5 * (low[elements] + high[elements])
+            step = np.where(np.isfinite(newton) & (newton > low[elements]) & (newton < high[elements]),
+                            newton, bisection)
+            done = (f == 0.0) | (np.abs(step - point) <= tolerance * (1.0 + np.abs(step)))
+            x[elements] = np.where(f == 0.0, point, step)
+            converged[elements] = done
+            active[elements] = ~done
+        return x, converged
+
+    @staticmethod
+    def apr(principal, rate, payment, extra_payment=0.0, fees=0.0, effective=False, max_iterations=50):
+        """ Annual percentage rate of loans whose borrowers pay fees up front, the rate at which the payments of the
+            schedule are worth the principal net of the fees. The payments are discounted in closed form, as a level
+            annuity of the full payment followed by the smaller last payment, so no schedule is built.
+            :param principal: principal amount left on the loan, or an array of them
+            :param rate: annualized interest rate as a percentage, or an array of them
+            :param payment: minimum expected payment, or an array of them
+            :param extra_payment: additional payment applied to the principal, or an array of them
+            :param fees: fees paid up front out of the principal, or an array of them
+            :param effective: False for the nominal rate, 12 times the monthly rate, True for the effective annual rate
+                              with monthly compounding
+            :param max_iterations: maximum number of solver iterations
+            :return: tuple (array of rates as percentages, array of convergence flags)
+        """
+        principal, rate, payment, extra_payment, fees = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(value, dtype=np.float64)) for value in (principal, rate, payment, extra_payment,
+                                                                                fees)))
+        if np.any(fees < 0.0) or np.any(fees >= principal):
+            raise ValueError('Warning: Fees must be greater than or equal to 0.0 and less than the principal')
+        total_payment = payment + extra_payment
+        n = Amortization.term(principal, rate, payment, extra_payment).astype(np.float64)
+        last_payment = Amortization.balance(principal, rate, total_payment, n - 1.0) * (
+            1.0 + Amortization.monthly_rate(rate))
+        net_principal = principal - fees
+
+        def present_value(i, elements):
+            k = n[elements] - 1.0
+            growth = np.log1p(i)
+            discount = np.exp(-k * growth)
+            small = np.abs(i) < 1e-8
+            safe_i = np.where(small, 1.0, i)
+            annuity = np.where(small, k - 0.5 * k * (k + 1.0) * i, -np.expm1(-k * growth) / safe_i)
+            annuity_slope = np.where(small, -0.5 * k * (k + 1.0), (k * discount / (1.0 + i) - annuity) / safe_i)
+            last_discount = discount / (1.0 + i)
+            value = total_payment[elements] * annuity + last_payment[elements] * last_discount - \
+                net_principal[elements]
+            slope = total_payment[elements] * annuity_slope - \
+                last_payment[elements] * (k + 1.0) * last_discount / (1.0 + i)
+            return value, slope
+
+        monthly, converged = LoanSolver.solve(present_value, Amortization.monthly_rate(rate),
+                                              LoanSolver.lowest_rate(n.max() + 1.0 if n.size > 0 else 1.0), 10.0,
+                                              max_iterations=max_iterations)
+        if effective:
+            return np.expm1(12.0 * np.log1p(monthly)) * 100.0, converged
+        return monthly * 12.0 * 100.0, converged
+
+    @staticmethod
+    def cash_flows(schedule, fees=0.0):
+        """ Lender cash flows of a schedule, e.g. Loan.schedule or LoanPortfolio.schedule: the principal net of fees
+            lent at month 0, then the principal and interest collected each month.
+            :param schedule: columnar schedule
+            :param fees: fees collected up front
+            :return: array of monthly cash flows, starting at month 0
+        """
+        if len(schedule) == 0:
+            return np.zeros(1)
+        return np.concatenate([[fees - schedule.begin_principal[0]],
+                               schedule.applied_principal + schedule.applied_interest])
+
+    @staticmethod
+    def irr(cash_flows, guess=0.01, max_iterations=50):
+        """ Internal rate of return per period of cash flow vectors, the rate at which their net present value is 0.
+            :param cash_flows: array of cash flows starting at period 0, or a (vectors x periods) matrix of them
+            :param guess: initial rate per period
+            :param max_iterations: maximum number of solver iterations
+            :return: tuple (array of rates per period as fractions, array of convergence flags)
+        """
+        cash_flows = np.atleast_2d(np.asarray(cash_flows, dtype=np.float64))
+        periods = np.arange(cash_flows.shape[1], dtype=np.float64)
+
+        def net_present_value(i, elements):
+            discount = np.exp(-np.log1p(i)[:, None] * periods)
+            flows = cash_flows[elements] * discount
+            return flows.sum(axis=1), -(flows * periods).sum(axis=1) / (1.0 + i)
+
+        return LoanSolver.solve(net_present_value, np.full(cash_flows.shape[0], guess),
+                                LoanSolver.lowest_rate(cash_flows.shape[1]), 10.0, max_iterations=max_iterations)
@@ -0,0 +1,137 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from loan_analytics.Amortization import Amortization
+
+
+class ParallelCompute:
+    """ Parallel Compute class
+    Computes the schedules of many loans across a process pool. The loans are cut into shards of a fixed number of
+    loans, independent of the number of workers, and every worker writes the schedules, per loan totals and per month
+    totals of its shards straight into shared memory buffers instead of returning them through pickling. The parent
+    sums the per shard month totals in shard order, so the results are the same whatever the number of workers.
+    The schedule block is a memory-mapped file in shared memory that the result keeps on POSIX systems, so it is
+    never copied out there.
+    """
+    def __init__(self, principal, rate, payment, extra_payment=0.0):
+        """ Constructor to setup the parameters of the loans.
+            :param principal: array of principal amounts left on the loans
+            :param rate: array of annualized interest rates as percentages
+            :param payment: array of minimum expected payments
+            :param extra_payment: array of additional payments applied to the principal
+        """
+        self.parameters = np.array(np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(value, dtype=np.float64)) for value in (principal, rate, payment, extra_payment))))
+        self.time_to_loan_termination = None
+        self.block = None
+        self.total_principal_paid = None
+        self.total_interest_paid = None
+        self.totals = None
+
+    @staticmethod
+    def _views(buffers, loans, shards, months):
+        """ Return the arrays laid out over the shared memory buffers.
+            :return: tuple (parameters, per loan interest and principal totals, per shard totals)
+        """
+        return (np.ndarray((4, loans), dtype=np.float64, buffer=buffers[0].buf),
+                np.ndarray((2, loans), dtype=np.float64, buffer=buffers[1].buf),
+                np.ndarray((shards, 6, months), dtype=np.float64, buffer=buffers[2].buf))
+
+    @staticmethod
+    def _block_file():
+        """ Create the file the schedule block is mapped from, in shared memory where the platform has it.
+            :return: path of the new, empty file
+        """
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        handle, path = tempfile.mkstemp(prefix='loan_analytics_', suffix='.block', dir=directory)
+        os.close(handle)
+        return path
+
+    @staticmethod
+    def _compute_shard(names, path, loans, months, shards, shard, start, stop):
+        """ Compute one shard of loans into the shared memory buffers, run in a worker process.
+            :param names: names of the shared memory buffers
+            :param path: file the schedule block is mapped from
+            :param loans: total number of loans
+            :param months: number of months of the longest loan
+            :param shards: total number of shards
+            :param shard: index of the shard
+            :param start: first loan of the shard
+            :param stop: end of the shard, exclusive
+        """
+        buffers = [SharedMemory(name=name) for name in names]
+        try:
+            parameters, summary, partials = ParallelCompute._views(buffers, loans, shards, months)
+            _, shard_block = Amortization.schedule_matrix(*parameters[:, start:stop])
+            shard_months = shard_block.shape[2]
+            if shard_months > 0:
+                # the block file starts zeroed, so only the months the shard runs for are written
+                block = np.memmap(path, dtype=np.float64, mode='r+', shape=(6, loans, months))
+                block[:, start:stop, :shard_months] = shard_block
+                del block
+            summary[0, start:stop] = shard_block[4].sum(axis=1)
+            summary[1, start:stop] = shard_block[3].sum(axis=1)
+            partials[shard, :, :shard_months] = shard_block.sum(axis=1)
+            partials[shard, :, shard_months:] = 0.0
+            del parameters, summary, partials
+        finally:
+            for buffer in buffers:
+                buffer.close()
+
+    def compute(self, workers=None, shard_loans=1024):
+        """ Compute the schedules of the loans across a process pool.
+            :param workers: number of worker processes, None or 1 to compute the shards in this process, e.g.
+                            os.cpu_count() to use every CPU
+            :param shard_loans: number of loans per shard; the results only depend on it, not on the workers
+            :return: None, the termination index, (fields x loans x months) block, per loan totals and per month
+                     totals are stored in instance arrays; the block is the shared memory the workers wrote into
+        """
+        loans = self.parameters.shape[1]
+        self.time_to_loan_termination = Amortization.term(*self.parameters)
+        months = int(self.time_to_loan_termination.max()) if loans > 0 else 0
+        bounds = [(start, min(start + shard_loans, loans)) for start in range(0, loans, shard_loans)]
+        sizes = [4 * loans, 2 * loans, len(bounds) * 6 * months]
+        buffers = [SharedMemory(create=True, size=max(size, 1) * 8) for size in sizes]
+        path = ParallelCompute._block_file()
+        try:
+            names = [buffer.name for buffer in buffers]
+            parameters, summary, partials = ParallelCompute._views(buffers, loans, len(bounds), months)
+            parameters[:] = self.parameters
+            if loans * months > 0:
+                # sized up front, so every worker maps the same zeroed file and writes its shard in place
+                block = np.memmap(path, dtype=np.float64, mode='w+', shape=(6, loans, months))
+            else:
+                block = np.zeros((6, loans, months))
+            tasks = [(names, path, loans, months, len(bounds), shard, start, stop) for shard, (start, stop) in
+                     enumerate(bounds)]
+            if workers is None or workers == 1 or len(bounds) <= 1:
+                for task in tasks:
+                    ParallelCompute._compute_shard(*task)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    for future in [pool.submit(ParallelCompute._compute_shard, *task) for task in tasks]:
+                        future.result()
+
+            if os.name == 'posix':
+                # the mapping outlives the file name, so the block is kept as is and freed with its last view
+                self.block = block.view(np.ndarray)
+            else:
+                # other platforms cannot remove a mapped file, so the block is read out before its mapping is closed
+                self.block = np.array(block)
+            self.total_interest_paid, self.total_principal_paid = summary.copy()
+            # the per shard totals are reduced in shard order, which the number of workers does not change
+            self.totals = np.zeros((6, months))
+            for partial in partials:
+                self.totals += partial
+            del parameters, summary, partials
+        finally:
+            # the memmap is released before the file is removed; on POSIX self.block keeps the mapping itself alive
+            block = None
+            os.remove(path)
+            for buffer in buffers:
+                buffer.close()
+                buffer.unlink()
@@ -0,0 +1,136 @@
+import numpy as np
+
+
+class Schedule:
+    """ Columnar amortization schedule class
+    Holds one contiguous float64 array per field, stored as the rows of a (fields x months) block, with the month as
+    an implicit 1-based column index. Iterating with keys(), values() and items() yields the same (month, begin
+    principal, payment, extra payment, applied principal, applied interest, end principal) rows as the former
+    dictionary of tuples.
+    """
+    columns = ['Month', 'Begin_Principal', 'Payment', 'Extra_Payment',
+               'Applied_Principal', 'Applied_Interest', 'End_Principal ']
+
+    def __init__(self, begin_principal=(), payment=(), extra_payment=(),
+                 applied_principal=(), applied_interest=(), end_principal=()):
+        """ Constructor to setup a schedule from its columns.
+            :param begin_principal: principal at the start of each month
+            :param payment: payment of each month
+            :param extra_payment: extra payment of each month
+            :param applied_principal: part of the payments applied to the principal
+            :param applied_interest: part of the payments applied to the interest
+            :param end_principal: principal at the end of each month
+        """
+        self.block = np.array([begin_principal, payment, extra_payment,
+                               applied_principal, applied_interest, end_principal], dtype=np.float64)
+        self.source = None
+
+    @classmethod
+    def from_block(cls, block, source=None):
+        """ Setup a schedule around an existing (fields x months) block, without copying it.
+            :param block: float64 array whose rows are contiguous, e.g. a slice of a LoanBatch block
+            :param source: optional (fields x loans x months) batch block and loan row the block was sliced from,
+                           which lets portfolio aggregation sum loans of the same batch in one reduction
+            :return: schedule
+        """
+        schedule = cls.__new__(cls)
+        schedule.block = block
+        schedule.source = source
+        return schedule
+
+    @property
+    def begin_principal(self):
+        return self.block[0]
+
+    @property
+    def payment(self):
+        return self.block[1]
+
+    @property
+    def extra_payment(self):
+        return self.block[2]
+
+    @property
+    def applied_principal(self):
+        return self.block[3]
+
+    @property
+    def applied_interest(self):
+        return self.block[4]
+
+    @property
+    def end_principal(self):
+        return self.block[5]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """ Setup a schedule from rows in the layout of the former dictionary values.
+            :param rows: iterable of (month, begin principal, payment, extra payment, applied principal,
+                         applied interest, end principal) tuples, ordered by month
+            :return: schedule
+        """
+        rows = list(rows)
+        if len(rows) == 0:
+            return cls()
+        return cls(*np.array(rows, dtype=np.float64).T[1:])
+
+    def fields(self):
+        """ Return the value columns of the schedule, without the month.
+            :return: list of begin principal, payment, extra payment, applied principal, applied interest and
+                     end principal arrays
+        """
+        return list(self.block)
+
+    def months(self):
+        """ Return the month of each row.
+            :return: integer array of months, starting at 1
+        """
+        return np.arange(1, len(self) + 1, dtype=np.int64)
+
+    def column_arrays(self):
+        """ Return every column of the schedule, in the order of Schedule.columns.
+            :return: list of arrays, starting with the month
+        """
+        return [self.months()] + self.fields()
+
+    def to_dataframe(self, rounded=True):
+        """ Build a dataframe straight from the columns, with the running interest as a cumulative sum.
+            :param rounded: True to round every column to cents, False to wrap the schedule columns without copying
+                            them; the zero-copy frame shares memory with the schedule and must not be modified
+            :return: dataframe indexed by month, with the Schedule.columns and an Accumulated_Interest column
+        """
+        import pandas as pd
+        columns = self.column_arrays()
+        if rounded:
+            columns = columns[:1] + [np.round(column, 2) for column in columns[1:]]
+        schedule = pd.DataFrame(dict(zip(Schedule.columns, columns)), index=columns[0], copy=False)
+        schedule['Accumulated_Interest'] = np.cumsum(columns[5])
+        return schedule
+
+    @property
+    def nbytes(self):
+        return self.block.nbytes
+
+    def __len__(self):
+        return self.block.shape[1]
+
+    def __contains__(self, month):
+        return isinstance(month, (int, np.integer)) and 1 <= month <= len(self)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, month):
+        if month not in self:
+            raise KeyError(month)
+        index = month - 1
+        return (month,) + tuple(float(column[index]) for column in self.fields())
+
+    def keys(self):
+        return range(1, len(self) + 1)
+
+    def values(self):
+        return zip(self.keys(), *(column.tolist() for column in self.fields()))
+
+    def items(self):
+        return zip(self.keys(), self.values())
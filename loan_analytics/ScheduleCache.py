@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ScheduleCache:
+    """ Schedule Cache class
+    Process-wide memo of computed schedules and summaries keyed on the loan parameters, bounded both in number of
+    entries and in bytes, with least recently used eviction and hit / miss counters. Cached arrays are made read-only
+    because they are shared by every caller asking for the same loan.
+    """
+    def __init__(self, max_entries=4096, max_bytes=256 * 1024 * 1024):
+        """ Constructor to setup an empty cache.
+            :param max_entries: maximum number of cached results
+            :param max_bytes: maximum total size of the cached arrays in bytes
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(kind, principal, rate, payment, extra_payment, *args):
+        """ Return the cache key of a computation.
+            :param kind: name of the computation, e.g. 'schedule' or 'summary'
+            :param principal: principal amount left on the loan
+            :param rate: annualized interest rate as a percentage
+            :param payment: minimum expected payment
+            :param extra_payment: additional payment applied to the principal
+            :param args: any further hashable parameters of the computation
+            :return: hashable key
+        """
+        return (kind, float(principal), float(rate), float(payment), float(extra_payment)) + args
+
+    @staticmethod
+    def _freeze(value):
+        """ Make the arrays of a result read-only and return its size in bytes.
+        """
+        arrays = [value.block] if hasattr(value, 'block') else [item for item in value if isinstance(item, np.ndarray)]
+        for array in arrays:
+            array.flags.writeable = False
+        return sum(array.nbytes for array in arrays) + 64
+
+    def get(self, key, compute):
+        """ Return the cached result for a key, computing and storing it on a miss.
+            :param key: key returned by ScheduleCache.key
+            :param compute: function without arguments computing the result, either a Schedule or a tuple
+            :return: cached or freshly computed result
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        value = compute()
+        nbytes = self._freeze(value)
+
+        with self._lock:
+            if key not in self._entries and nbytes <= self.max_bytes:
+                self._entries[key] = (value, nbytes)
+                self.nbytes += nbytes
+                while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                    _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                    self.nbytes -= evicted_nbytes
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        """ Drop every cached result and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """ Return the cache counters.
+            :return: dictionary of hits, misses, evictions, entries and bytes
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self.nbytes}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+schedule_cache = ScheduleCache()
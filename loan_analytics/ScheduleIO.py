@@ -0,0 +1,178 @@
+import numpy as np
+
+from loan_analytics.Amortization import Amortization
+from loan_analytics.Schedule import Schedule
+
+
+class ScheduleIO:
+    """ Schedule IO class
+    Writes loan schedules in long form, one row per loan and month keyed by loan_id and month, to Arrow IPC or Parquet
+    files one chunk of loans at a time, and reads Arrow IPC files back memory-mapped so that single loans are sliced
+    out without loading the whole book.
+    """
+    fields = ['begin_principal', 'payment', 'extra_payment', 'applied_principal', 'applied_interest', 'end_principal']
+
+    def __init__(self, path):
+        """ Constructor to open a schedule file written by ScheduleIO.write_arrow, memory-mapped.
+            Only the loan_id column is scanned to index where each loan starts and stops.
+            :param path: path of the Arrow IPC file
+        """
+        import pyarrow as pa
+        self.path = path
+        self._source = pa.memory_map(str(path), 'r')
+        self._reader = pa.ipc.open_file(self._source)
+
+        ids, batches, starts, stops = [], [], [], []
+        for index in range(self._reader.num_record_batches):
+            loan_ids = self._reader.get_batch(index).column('loan_id').to_numpy()
+            if loan_ids.size == 0:
+                continue
+            first = np.flatnonzero(np.r_[True, loan_ids[1:] != loan_ids[:-1]])
+            ids.append(loan_ids[first])
+            batches.append(np.full(first.size, index))
+            starts.append(first)
+            stops.append(np.r_[first[1:], loan_ids.size])
+        order = np.argsort(np.concatenate(ids), kind='stable') if ids else np.zeros(0, dtype=np.int64)
+        self._ids, self._batches, self._starts, self._stops = (
+            np.concatenate(values)[order] if values else np.zeros(0, dtype=np.int64)
+            for values in (ids, batches, starts, stops))
+
+    def loan_ids(self):
+        """ Return the ids of the loans in the file.
+            :return: sorted array of loan ids
+        """
+        return self._ids
+
+    def __len__(self):
+        return self._ids.size
+
+    def __contains__(self, loan_id):
+        position = np.searchsorted(self._ids, loan_id)
+        return position < self._ids.size and self._ids[position] == loan_id
+
+    def loan_schedule(self, loan_id):
+        """ Slice the schedule of one loan out of the memory-mapped file.
+            :param loan_id: id of the loan
+            :return: columnar schedule of the loan, in the layout of Loan.schedule
+        """
+        if loan_id not in self:
+            raise KeyError(loan_id)
+        position = np.searchsorted(self._ids, loan_id)
+        start, stop = int(self._starts[position]), int(self._stops[position])
+        rows = self._reader.get_batch(int(self._batches[position])).slice(start, stop - start)
+        return Schedule.from_block(np.array([rows.column(field).to_numpy() for field in ScheduleIO.fields]))
+
+    def close(self):
+        self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    @staticmethod
+    def schema():
+        import pyarrow as pa
+        return pa.schema([('loan_id', pa.int64()), ('month', pa.int32())] +
+                         [(field, pa.float64()) for field in ScheduleIO.fields])
+
+    @staticmethod
+    def _blocks(source, chunk_loans):
+        """ Generate the schedules of a source one chunk of loans at a time.
+            Stored schedules are used as they are; the loans of an ingested book, which only keeps their parameters,
+            and of a LoanBatch without schedules are recomputed chunk by chunk.
+            :param source: Loan, Schedule, LoanBatch or LoanPortfolio
+            :param chunk_loans: number of loans per chunk
+            :return: generator of (loan ids, termination index, (fields x loans x months) block)
+        """
+        if hasattr(source, 'book'):
+            loan_ids = np.concatenate([np.asarray(source.loan_ids, dtype=np.int64),
+                                       np.asarray(source.book_ids if source.book is not None else [], dtype=np.int64)])
+            if np.unique(loan_ids).size != loan_ids.size:
+                raise ValueError('Warning: The loan ids of the portfolio are not unique, so its schedules cannot be '
+                                 'written by loan')
+            for start in range(0, len(source.loans), chunk_loans):
+                loans = source.loans[start:start + chunk_loans]
+                yield from ScheduleIO._stack(np.asarray(source.loan_ids[start:start + chunk_loans]),
+                                             [loan.schedule for loan in loans])
+            if source.book is not None:
+                book = source.book
+                for start in range(0, book.get_loan_count(), chunk_loans):
+                    chunk = slice(start, start + chunk_loans)
+                    n, block = Amortization.schedule_matrix(book.principal[chunk], book.rate[chunk],
+                                                            book.payment[chunk], book.extra_payment[chunk])
+                    yield np.asarray(source.book_ids[chunk]), n, block
+        elif hasattr(source, 'block') and hasattr(source, 'get_loan_count'):
+            for start in range(0, source.get_loan_count(), chunk_loans):
+                chunk = slice(start, start + chunk_loans)
+                if source.block is None:
+                    # the batch has no schedules, e.g. after compute_summary only, so they are computed per chunk
+                    n, block = Amortization.schedule_matrix(source.principal[chunk], source.rate[chunk],
+                                                            source.payment[chunk], source.extra_payment[chunk])
+                else:
+                    n, block = source.time_to_loan_termination[chunk], source.block[:, chunk]
+                yield np.arange(start, min(start + chunk_loans, source.get_loan_count())), n, block
+        else:
+            schedule = source.schedule if hasattr(source, 'schedule') else source
+            yield from ScheduleIO._stack(np.zeros(1, dtype=np.int64), [schedule])
+
+    @staticmethod
+    def _stack(loan_ids, schedules):
+        n = np.array([len(schedule) for schedule in schedules], dtype=np.int64)
+        block = np.zeros((len(ScheduleIO.fields), len(schedules), int(n.max()) if n.size > 0 else 0))
+        for row, schedule in enumerate(schedules):
+            block[:, row, :len(schedule)] = schedule.block
+        yield loan_ids, n, block
+
+    @staticmethod
+    def record_batches(source, chunk_loans=4096):
+        """ Generate the long form rows of a source's schedules as Arrow record batches, one per chunk of loans.
+            :param source: Loan, Schedule (e.g. a portfolio schedule, written as loan 0), LoanBatch (loans numbered
+                           from 0) or LoanPortfolio (its loans under their loan_ids and its book under its book_ids)
+            :param chunk_loans: number of loans per record batch
+            :return: generator of record batches in the ScheduleIO.schema(), ordered by loan and month
+        """
+        import pyarrow as pa
+        schema = ScheduleIO.schema()
+        for loan_ids, n, block in ScheduleIO._blocks(source, chunk_loans):
+            active = np.arange(block.shape[2])[None, :] < np.asarray(n)[:, None]
+            rows, months = np.nonzero(active)
+            columns = [pa.array(np.asarray(loan_ids, dtype=np.int64)[rows]), pa.array((months + 1).astype(np.int32))]
+            columns += [pa.array(field[active]) for field in block]
+            yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    @staticmethod
+    def write_arrow(path, source, chunk_loans=4096):
+        """ Write the schedules of a source to an Arrow IPC file, streaming one record batch per chunk of loans.
+            :param path: path of the Arrow IPC file
+            :param source: Loan, Schedule, LoanBatch or LoanPortfolio, see ScheduleIO.record_batches
+            :param chunk_loans: number of loans per record batch
+            :return: number of rows written
+        """
+        import pyarrow as pa
+        rows = 0
+        with pa.OSFile(str(path), 'wb') as sink, pa.ipc.new_file(sink, ScheduleIO.schema()) as writer:
+            for batch in ScheduleIO.record_batches(source, chunk_loans):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        return rows
+
+    @staticmethod
+    def write_parquet(path, source, chunk_loans=4096, compression='snappy'):
+        """ Write the schedules of a source to a Parquet file, streaming one row group per chunk of loans.
+            :param path: path of the Parquet file
+            :param source: Loan, Schedule, LoanBatch or LoanPortfolio, see ScheduleIO.record_batches
+            :param chunk_loans: number of loans per row group
+            :param compression: Parquet compression codec
+            :return: number of rows written
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        rows = 0
+        with pq.ParquetWriter(str(path), ScheduleIO.schema(), compression=compression) as writer:
+            for batch in ScheduleIO.record_batches(source, chunk_loans):
+                writer.write_table(pa.Table.from_batches([batch]))
+                rows += batch.num_rows
+        return rows
@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+
+from loan_analytics.Amortization import Amortization
+from loan_analytics.Schedule import Schedule
+
+
+class ScheduleStore:
+    """ Schedule Store class
+    On-disk store of loan schedules for books whose stacked schedule matrix does not fit in memory. The store is a
+    directory of chunk files written one LoanBatch at a time, each a (loans x fields x months) .npy array read back
+    memory-mapped, next to the loan ids and times to termination of the chunk. Aggregation, rollups and lookups stream
+    over the chunks, so the resident memory is bounded by one chunk rather than the whole book.
+    """
+    def __init__(self, path):
+        """ Constructor to open a store, creating its directory when it does not exist yet. A chunk is complete once
+            its schedules file exists, which append() writes last, so chunks interrupted while written are ignored.
+            :param path: directory of the store
+        """
+        self.path = str(path)
+        os.makedirs(self.path, exist_ok=True)
+        self._chunks = sorted(name[:-len('.schedules.npy')] for name in os.listdir(self.path)
+                              if name.endswith('.schedules.npy'))
+        self._loan_ids = [np.load(self._file(chunk, 'loan_ids')) for chunk in self._chunks]
+        self._terms = [np.load(self._file(chunk, 'terms')) for chunk in self._chunks]
+        self._index = None
+
+    def _file(self, chunk, name):
+        return os.path.join(self.path, f'{chunk}.{name}.npy')
+
+    def clear(self):
+        """ Delete every chunk of the store, including the files of chunks that were not completely written.
+        """
+        for name in os.listdir(self.path):
+            if name.startswith('chunk') and name.endswith('.npy'):
+                os.remove(os.path.join(self.path, name))
+        self._chunks, self._loan_ids, self._terms = [], [], []
+        self._index = None
+
+    def append(self, loan_ids, time_to_loan_termination, block):
+        """ Write the schedules of one batch of loans as a new chunk. The loan ids and terms are written first and
+            the schedules go to a temporary file renamed into place last, so a failed append leaves no chunk behind.
+            :param loan_ids: array of the integer ids of the loans
+            :param time_to_loan_termination: array of the number of months of each loan
+            :param block: (fields x loans x months) schedule block, in the layout of LoanBatch.block
+        """
+        loan_ids = np.asarray(loan_ids)
+        if not np.issubdtype(loan_ids.dtype, np.integer):
+            raise ValueError('Warning: The loan ids of a schedule store must be integers')
+        loan_ids = loan_ids.astype(np.int64)
+        terms = np.asarray(time_to_loan_termination).astype(np.int64)
+        if not loan_ids.shape == terms.shape == (block.shape[1],):
+            raise ValueError('Warning: The loan ids, terms and schedule block must hold the same number of loans')
+
+        chunk = f'chunk{len(self._chunks):06d}'
+        partial = self._file(chunk, 'schedules.partial')
+        try:
+            np.save(self._file(chunk, 'loan_ids'), loan_ids)
+            np.save(self._file(chunk, 'terms'), terms)
+            schedules = np.lib.format.open_memmap(partial, mode='w+', dtype=np.float64,
+                                                  shape=(block.shape[1], block.shape[0], block.shape[2]))
+            schedules[:] = block.transpose(1, 0, 2)
+            schedules.flush()
+            del schedules
+            os.replace(partial, self._file(chunk, 'schedules'))
+        except BaseException:
+            for name in ('schedules.partial', 'loan_ids', 'terms'):
+                if os.path.exists(self._file(chunk, name)):
+                    os.remove(self._file(chunk, name))
+            raise
+        self._chunks.append(chunk)
+        self._loan_ids.append(loan_ids)
+        self._terms.append(terms)
+        self._index = None
+
+    def get_loan_count(self):
+        """ Return the number of loans in the store
+            :return: number of loans in the store
+        """
+        return sum(loan_ids.size for loan_ids in self._loan_ids)
+
+    def __len__(self):
+        return self.get_loan_count()
+
+    def loan_ids(self):
+        """ Return the ids of the loans in the store, in the order they were written.
+            :return: array of loan ids
+        """
+        return np.concatenate(self._loan_ids) if self._loan_ids else np.zeros(0, dtype=np.int64)
+
+    def iter_chunks(self):
+        """ Generate the chunks of the store, memory-mapped.
+            :return: generator of (loan ids, times to termination, read-only (loans x fields x months) array)
+        """
+        for chunk, loan_ids, terms in zip(self._chunks, self._loan_ids, self._terms):
+            yield loan_ids, terms, np.load(self._file(chunk, 'schedules'), mmap_mode='r')
+
+    def loan_schedule(self, loan_id):
+        """ Look up the schedule of one loan.
+            :param loan_id: id of the loan
+            :return: columnar schedule of the loan, a read-only view of the memory-mapped chunk
+        """
+        if self._index is None:
+            loan_ids = self.loan_ids()
+            order = np.argsort(loan_ids, kind='stable')
+            chunks = np.repeat(np.arange(len(self._chunks)), [ids.size for ids in self._loan_ids])
+            rows = np.concatenate([np.arange(ids.size) for ids in self._loan_ids]) if self._loan_ids \
+                else np.zeros(0, dtype=np.int64)
+            self._index = loan_ids[order], chunks[order], rows[order]
+        loan_ids, chunks, rows = self._index
+        position = np.searchsorted(loan_ids, loan_id)
+        if position == loan_ids.size or loan_ids[position] != loan_id:
+            raise KeyError(loan_id)
+        chunk, row = int(chunks[position]), int(rows[position])
+        schedules = np.load(self._file(self._chunks[chunk], 'schedules'), mmap_mode='r')
+        return Schedule.from_block(schedules[row, :, :self._terms[chunk][row]])
+
+    def aggregate(self):
+        """ Aggregate the loans of the store into a portfolio schedule, one chunk at a time.
+            :return: tuple (portfolio schedule, number of loans still running in each month)
+        """
+        months = max((int(terms.max()) for terms in self._terms if terms.size > 0), default=0)
+        totals = np.zeros((len(Schedule.columns) - 1, months))
+        for _, terms, schedules in self.iter_chunks():
+            totals[:, :schedules.shape[2]] += schedules.sum(axis=0)
+        counts = np.cumsum(np.bincount(np.concatenate(self._terms) if self._terms else np.zeros(0, dtype=np.int64),
+                                       minlength=months + 1)[::-1])[::-1][1:]
+        return Schedule.from_block(totals), counts
+
+    def rollup(self, path, resolution='yearly'):
+        """ Roll the schedule of every loan up to a coarser resolution, one chunk at a time, into a new store.
+            Payments and applied amounts are summed over each bucket, the begin principal is the one of the first
+            month of the bucket and the end principal the one of its last month.
+            :param path: directory of the rolled up store
+            :param resolution: 'monthly', 'quarterly', 'yearly' or 'auto', see Amortization.bucket_months
+            :return: store with one column per bucket, in which the time to termination counts buckets
+        """
+        months = max((int(terms.max()) for terms in self._terms if terms.size > 0), default=0)
+        size = Amortization.bucket_months(resolution, months)
+        store = ScheduleStore(path)
+        for loan_ids, terms, schedules in self.iter_chunks():
+            buckets = -(-schedules.shape[2] // size)
+            padded = np.zeros((schedules.shape[0], schedules.shape[1], buckets * size))
+            padded[:, :, :schedules.shape[2]] = schedules
+            padded = padded.reshape(schedules.shape[0], schedules.shape[1], buckets, size)
+            block = padded.sum(axis=3)
+            block[:, 0] = padded[:, 0, :, 0]
+            block[:, 5] = padded[:, 5, :, -1]
+            store.append(loan_ids, -(-terms // size), block.transpose(1, 0, 2))
+        return store
@@ -0,0 +1,99 @@
+import math
+import re
+
+import numpy as np
+
+from loan_analytics.Instrumentation import instrumentation
+
+
+class TableQuery:
+    """ Table Query class
+    Pages, sorts and filters a schedule dataframe on the server for Dash DataTables set up with page_action,
+    sort_action and filter_action 'custom', so that only the rows of the visible page are serialized.
+    """
+    operators = {'=': np.equal, 'eq': np.equal, '!=': np.not_equal, 'ne': np.not_equal,
+                 '<': np.less, 'lt': np.less, '<=': np.less_equal, 'le': np.less_equal,
+                 '>': np.greater, 'gt': np.greater, '>=': np.greater_equal, 'ge': np.greater_equal}
+    filter_pattern = re.compile(r'^\s*\{(?P<column>[^}]+)\}\s+s?(?P<operator>>=|<=|!=|<|>|=|eq|ne|lt|le|gt|ge|'
+                                r'contains|datestartswith)\s+(?P<value>.*?)\s*$')
+
+    def __init__(self, page_current=0, page_size=25, sort_by=None, filter_query=''):
+        """ Constructor to setup a query from the DataTable properties.
+            :param page_current: index of the visible page, starting at 0
+            :param page_size: number of rows per page
+            :param sort_by: list of {'column_id': column, 'direction': 'asc' or 'desc'} sort keys
+            :param filter_query: filter expression of the table, e.g. '{Month} > 12 && {Payment} <= 500'
+        """
+        self.page_current = page_current or 0
+        self.page_size = page_size
+        self.sort_by = sort_by or []
+        self.filters = TableQuery.parse_filter(filter_query)
+
+    @staticmethod
+    def parse_filter(filter_query):
+        """ Split a DataTable filter expression into its terms.
+            :param filter_query: filter expression, with terms joined by ' && '
+            :return: list of (column, operator, value) tuples, where value is a float when it reads as a number
+        """
+        filters = []
+        for term in (filter_query or '').split(' && '):
+            match = TableQuery.filter_pattern.match(term)
+            if match is None:
+                continue
+            value = match.group('value')
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+                value = value[1:-1]
+            else:
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+            filters.append((match.group('column'), match.group('operator'), value))
+        return filters
+
+    def filter(self, frame):
+        """ Keep the rows of a dataframe matching every filter term, with one vectorized comparison per term.
+            Terms on unknown columns are ignored.
+            :param frame: schedule dataframe
+            :return: filtered dataframe
+        """
+        mask = np.ones(frame.shape[0], dtype=bool)
+        for column, operator, value in self.filters:
+            if column not in frame.columns:
+                continue
+            values = frame[column].to_numpy()
+            if operator in ('contains', 'datestartswith'):
+                strings = frame[column].astype(str)
+                matched = strings.str.contains(str(value), regex=False) if operator == 'contains' \
+                    else strings.str.startswith(str(value))
+                mask &= matched.to_numpy()
+            elif isinstance(value, float) and values.dtype.kind in 'biuf':
+                mask &= TableQuery.operators[operator](values, value)
+            else:
+                mask &= TableQuery.operators[operator](values.astype(str), str(value))
+        return frame[mask]
+
+    def sort(self, frame):
+        """ Sort a dataframe on the sort keys of the table, in order of priority.
+            :param frame: schedule dataframe
+            :return: sorted dataframe, unchanged without sort keys
+        """
+        sort_by = [key for key in self.sort_by if key['column_id'] in frame.columns]
+        if len(sort_by) == 0:
+            return frame
+        return frame.sort_values([key['column_id'] for key in sort_by],
+                                 ascending=[key['direction'] == 'asc' for key in sort_by],
+                                 kind='stable')
+
+    @instrumentation.timed('serialization')
+    def apply(self, frame):
+        """ Filter and sort a dataframe, then serialize the visible page only.
+            :param frame: schedule dataframe
+            :return: tuple (records of the visible page, number of pages)
+        """
+        frame = self.sort(self.filter(frame))
+        page_count = max(math.ceil(frame.shape[0] / self.page_size), 1)
+        start = self.page_current * self.page_size
+        records = frame.iloc[start:start + self.page_size].to_dict('records')
+        instrumentation.count('serialization.rows', len(records))
+        return records, page_count
@@ -1,9 +1,22 @@
+import itertools
+
+import numpy as np
 import pytest
 
+from loan_analytics.CentsAmortization import CentsAmortization
+from loan_analytics.Figures import Figures
 from loan_analytics.Helper import *
+from loan_analytics.Instrumentation import Instrumentation, instrumentation
 from loan_analytics.Loan import *
+from loan_analytics.LoanBatch import LoanBatch
 from loan_analytics.LoanImpacts import LoanImpacts
 from loan_analytics.LoanPortfolio import *
+from loan_analytics.LoanSolver import LoanSolver
+from loan_analytics.Schedule import Schedule
+from loan_analytics.ScheduleCache import ScheduleCache, schedule_cache
+from loan_analytics.ScheduleIO import ScheduleIO
+from loan_analytics.ScheduleStore import ScheduleStore
+from loan_analytics.TableQuery import TableQuery
 
 loans = LoanPortfolio()
 
@@ -74,3 +87,827 @@ def test_loan_contribution_1(principal, rate, payment, extra_payment, contributi
     loan_impacts.compute_impacts()
 
     assert True
+
+
+@pytest.mark.parametrize('principal, rate, payment, extra_payment',
+                         [
+                             (5000.0, 6.0, 96.66, 0.0),
+                             (27000.0, 4.0, 150.0, 25.0),
+                             (250000.0, 3.5, 1122.61, 100.0),
+                             (1200.0, 0.0, 100.0, 0.0),
+                         ])
+def test_numpy_schedule_matches_python_schedule(principal, rate, payment, extra_payment):
+    tolerance_for_cash = 0.01
+
+    loan_numpy = Loan(principal=principal, rate=rate, payment=payment, extra_payment=extra_payment)
+    loan_numpy.compute_schedule(backend='numpy')
+    loan_python = Loan(principal=principal, rate=rate, payment=payment, extra_payment=extra_payment)
+    loan_python.compute_schedule(backend='python')
+
+    assert loan_numpy.time_to_loan_termination == loan_python.time_to_loan_termination
+    for key, pay in loan_python.schedule.items():
+        for value_numpy, value_python in zip(loan_numpy.schedule[key], pay):
+            assert abs(value_numpy - value_python) <= tolerance_for_cash
+    assert abs(loan_numpy.total_interest_paid - loan_python.total_interest_paid) <= tolerance_for_cash
+    assert abs(loan_numpy.total_principal_paid - loan_python.total_principal_paid) <= tolerance_for_cash
+
+
+def test_loan_batch_matches_individual_loans():
+    tolerance_for_cash = 0.01
+    principals = [5000.0, 27000.0, 250000.0, 1200.0]
+    rates = [6.0, 4.0, 3.5, 0.0]
+    payments = [96.66, 150.0, 1122.61, 100.0]
+    extra_payments = [0.0, 25.0, 100.0, 0.0]
+
+    batch = LoanBatch(principal=principals, rate=rates, payment=payments, extra_payment=extra_payments)
+    batch.check_loan_parameters()
+    batch.compute_schedule()
+
+    assert batch.begin_principal.shape == (4, max(batch.time_to_loan_termination))
+    for index in range(batch.get_loan_count()):
+        loan = Loan(principal=principals[index], rate=rates[index],
+                    payment=payments[index], extra_payment=extra_payments[index])
+        loan.compute_schedule()
+        assert batch.time_to_loan_termination[index] == loan.time_to_loan_termination
+        assert abs(batch.total_interest_paid[index] - loan.total_interest_paid) <= tolerance_for_cash
+        assert abs(batch.total_principal_paid[index] - loan.total_principal_paid) <= tolerance_for_cash
+        assert batch.loan_schedule(index).keys() == loan.schedule.keys()
+        assert batch.applied_principal[index, loan.time_to_loan_termination:].sum() == 0.0
+
+
+def test_loan_batch_rejects_invalid_loan():
+    batch = LoanBatch(principal=[1000.0, 1000.0], rate=[12.0, 12.0], payment=[100.0, 5.0], extra_payment=0.0)
+    with pytest.raises(ValueError, match='Loan 1'):
+        batch.check_loan_parameters()
+
+
+@pytest.mark.parametrize('principal, rate, payment, extra_payment',
+                         [
+                             (27000.0, 4.0, 150.0, 0.0),
+                             (27000.0, 4.0, 150.0, 25.0),
+                             (1200.0, 0.0, 100.0, 0.0),
+                         ])
+def test_summary_matches_schedule(principal, rate, payment, extra_payment):
+    tolerance_for_cash = 0.01
+
+    loan_schedule = Loan(principal=principal, rate=rate, payment=payment, extra_payment=extra_payment)
+    loan_schedule.compute_schedule()
+    loan_summary = Loan(principal=principal, rate=rate, payment=payment, extra_payment=extra_payment)
+    loan_summary.compute_summary()
+
+    assert len(loan_summary.schedule) == 0
+    assert loan_summary.time_to_loan_termination == loan_schedule.time_to_loan_termination
+    assert abs(loan_summary.total_interest_paid - loan_schedule.total_interest_paid) <= tolerance_for_cash
+    assert abs(loan_summary.total_principal_paid - loan_schedule.total_principal_paid) <= tolerance_for_cash
+
+    batch = LoanBatch(principal=[principal] * 2, rate=rate, payment=payment, extra_payment=[extra_payment, 0.0])
+    batch.compute_summary()
+    assert batch.begin_principal is None
+    assert batch.time_to_loan_termination[0] == loan_schedule.time_to_loan_termination
+    assert abs(batch.total_interest_paid[0] - loan_schedule.total_interest_paid) <= tolerance_for_cash
+
+
+def test_schedule_keeps_dictionary_iteration():
+    loan = Loan(principal=5000.0, rate=6.0, payment=96.66, extra_payment=0.0)
+    loan.compute_schedule()
+    schedule = loan.schedule
+
+    assert isinstance(schedule, Schedule)
+    assert list(schedule.keys()) == list(range(1, loan.time_to_loan_termination + 1))
+    assert schedule.nbytes == 6 * 8 * len(schedule)
+    for key, pay in schedule.items():
+        assert pay == schedule[key]
+        assert pay[0] == key
+        assert pay[4] == schedule.applied_principal[key - 1]
+    assert Schedule.from_rows(schedule.values()).fields()[5].tolist() == schedule.end_principal.tolist()
+    assert 0 not in schedule and len(schedule) + 1 not in schedule
+
+
+def test_portfolio_aggregate_reads_columns():
+    portfolio = LoanPortfolio()
+    for principal, rate, payment in [(1000.0, 12.0, 100.0), (2000.0, 6.0, 150.0)]:
+        loan = Loan(principal=principal, rate=rate, payment=payment)
+        loan.compute_schedule()
+        portfolio.add_loan(loan)
+    portfolio.aggregate()
+
+    assert len(portfolio.schedule) == max(len(loan.schedule) for loan in portfolio.loans)
+    assert abs(portfolio.schedule.applied_principal.sum() - 3000.0) <= 0.01
+    assert portfolio.schedule[1][1] == 3000.0
+
+
+def test_return_loan_schedule_accumulates_rounded_interest():
+    loan = Loan(principal=27000.0, rate=4.0, payment=150.0, extra_payment=25.0)
+    loan.compute_schedule()
+
+    loan_schedule = loan.return_loan_schedule()
+    accumulated_interest = 0.0
+    for month, interest in zip(loan_schedule['Month'], loan_schedule['Applied_Interest']):
+        accumulated_interest += interest
+        assert loan_schedule.loc[month, 'Accumulated_Interest'] == round(accumulated_interest, 2)
+
+    loan_schedule_view = loan.return_loan_schedule(rounded=False)
+    assert list(loan_schedule_view.columns) == list(loan_schedule.columns)
+    assert np.shares_memory(loan_schedule_view['Applied_Interest'].to_numpy(), loan.schedule.applied_interest)
+
+
+def test_portfolio_aggregate_is_idempotent():
+    batch = LoanBatch(principal=[1000.0, 2000.0, 3000.0], rate=[12.0, 6.0, 4.0], payment=[100.0, 150.0, 80.0])
+    batch.compute_schedule()
+
+    portfolio = LoanPortfolio()
+    portfolio.add_loan(batch.loan(0))
+    portfolio.add_loan(batch.loan(2))
+    portfolio.add_loan(batch.loan(2))
+    loan = Loan(principal=2000.0, rate=6.0, payment=150.0)
+    loan.compute_schedule()
+    portfolio.add_loan(loan)
+
+    portfolio.aggregate()
+    first = portfolio.schedule.block.copy()
+    portfolio.aggregate()
+
+    assert np.array_equal(portfolio.schedule.block, first)
+    assert len(portfolio.schedule) == batch.time_to_loan_termination[2]
+    assert abs(portfolio.schedule.applied_principal.sum() - 9000.0) <= 0.01
+    assert portfolio.schedule[1][1] == 9000.0
+
+
+def test_portfolio_running_totals_follow_add_and_remove():
+    loans_by_id = {}
+    portfolio = LoanPortfolio()
+    for principal, rate, payment in [(1000.0, 12.0, 100.0), (9000.0, 6.0, 150.0), (2000.0, 4.0, 80.0)]:
+        loan = Loan(principal=principal, rate=rate, payment=payment)
+        loan.compute_schedule()
+        loans_by_id[portfolio.add_loan(loan)] = loan
+
+    snapshot = portfolio.schedule
+    expected_snapshot = snapshot.block.copy()
+    portfolio.remove_loan(1)
+    running = portfolio.return_portfolio_schedule()
+    # a schedule read earlier is a read-only snapshot that the running totals do not change
+    assert np.array_equal(snapshot.block, expected_snapshot)
+    assert not snapshot.block.flags.writeable
+
+    expected = LoanPortfolio()
+    expected.add_loan(loans_by_id[0])
+    expected.add_loan(loans_by_id[2])
+    expected.aggregate()
+
+    assert portfolio.loan_ids == [0, 2]
+    assert np.allclose(running.to_numpy(), expected.return_portfolio_schedule().to_numpy())
+
+    portfolio.remove_last_loan()
+    assert len(portfolio.schedule) == loans_by_id[0].time_to_loan_termination
+    assert np.allclose(portfolio.schedule.block, loans_by_id[0].schedule.block)
+    portfolio.remove_last_loan()
+    assert len(portfolio.schedule) == 0
+    with pytest.raises(ValueError):
+        portfolio.remove_loan(1)
+
+
+def test_iter_schedule_matches_schedule():
+    tolerance_for_cash = 1e-6
+    loan = Loan(principal=27000.0, rate=4.0, payment=150.0, extra_payment=25.0)
+    loan.compute_schedule()
+
+    rows = list(loan.iter_schedule(chunk_months=50))
+    assert len(rows) == loan.time_to_loan_termination
+    for row, pay in zip(rows, loan.schedule.values()):
+        assert row[0] == pay[0]
+        assert max(abs(value - expected) for value, expected in zip(row, pay)) <= tolerance_for_cash
+
+    first_below = next(row for row in Loan(27000.0, 4.0, 150.0, 25.0).iter_schedule() if row[6] < 20000.0)
+    assert first_below == next(pay for pay in loan.schedule.values() if pay[6] < 20000.0)
+
+
+def test_portfolio_iter_schedule_matches_aggregate(tmp_path):
+    portfolio = LoanPortfolio()
+    for principal, rate, payment in [(1000.0, 12.0, 100.0), (9000.0, 6.0, 150.0)]:
+        loan = Loan(principal=principal, rate=rate, payment=payment)
+        loan.compute_schedule()
+        portfolio.add_loan(loan)
+    portfolio.aggregate()
+
+    rows = np.array(list(portfolio.iter_schedule(chunk_months=7)))
+    assert np.allclose(rows[:, 1:].T, portfolio.schedule.block)
+
+    Helper.write_csv(portfolio, tmp_path / 'portfolio.csv')
+    lines = (tmp_path / 'portfolio.csv').read_text().splitlines()
+    assert lines[0] == 'Month,Begin_Principal,Payment,Extra_Payment,Applied_Principal,Applied_Interest,End_Principal'
+    assert len(lines) == len(portfolio.schedule) + 1
+
+
+def test_loan_impacts_batch_matches_individual_loans(capsys):
+    tolerance_for_cash = 0.01
+    contributions = [float(amount) for amount in range(1, 51)]
+    loan_impacts = LoanImpacts(principal=68000.0, rate=4.0, payment=899.0,
+                               extra_payment=10.0, contributions=contributions)
+    impact_df = loan_impacts.compute_impacts()
+
+    assert capsys.readouterr().out == ''
+    assert impact_df.shape == (2 + len(contributions), 4)
+
+    loan_all = Loan(principal=68000.0, rate=4.0, payment=899.0, extra_payment=10.0 + sum(contributions))
+    loan_all.compute_schedule()
+    for index, contribution in enumerate(contributions):
+        loan_index = Loan(principal=68000.0, rate=4.0, payment=899.0,
+                          extra_payment=10.0 + sum(contributions) - contribution)
+        loan_index.compute_schedule()
+        impact = impact_df.iloc[index + 2]
+        assert abs(impact['Interest_Paid'] - loan_index.total_interest_paid) <= tolerance_for_cash
+        assert impact['Duration'] == loan_index.time_to_loan_termination
+        assert impact['MIDuration'] == round((loan_index.time_to_loan_termination -
+                                              loan_all.time_to_loan_termination) /
+                                             loan_all.time_to_loan_termination, 4)
+
+
+def test_loan_impacts_shapley_converges_to_exact_values():
+    principal, rate, payment, extra_payment, contributions = 68000.0, 4.0, 899.0, 0.0, [10.0, 100.0, 1000.0]
+
+    def interest_paid(contributors):
+        loan = Loan(principal=principal, rate=rate, payment=payment,
+                    extra_payment=extra_payment + sum(contributions[k] for k in contributors))
+        loan.compute_summary()
+        return loan.total_interest_paid
+
+    exact = np.zeros(len(contributions))
+    orders = list(itertools.permutations(range(len(contributions))))
+    for order in orders:
+        for position, contributor in enumerate(order):
+            exact[contributor] += interest_paid(order[:position]) - interest_paid(order[:position + 1])
+    exact /= len(orders)
+
+    loan_impacts = LoanImpacts(principal=principal, rate=rate, payment=payment,
+                               extra_payment=extra_payment, contributions=contributions)
+    shapley_df = loan_impacts.compute_shapley(n_permutations=4000, seed=7)
+
+    assert shapley_df.attrs['permutations'] == 4000
+    assert np.all(np.abs(shapley_df['Shapley_Interest'] - exact) <= 4 * shapley_df['Shapley_Interest_Error'] + 1e-6)
+    assert abs(shapley_df['Shapley_Interest'].sum() - (interest_paid([]) - interest_paid([0, 1, 2]))) <= 0.01
+
+
+def test_loan_impacts_shapley_is_reproducible_across_processes():
+    loan_impacts = LoanImpacts(principal=250000.0, rate=5.0, payment=1400.0,
+                               extra_payment=0.0, contributions=list(np.linspace(1.0, 50.0, 40)))
+    serial = loan_impacts.compute_shapley(n_permutations=2000, tolerance=150.0, seed=3, chunk_permutations=50)
+    pooled = loan_impacts.compute_shapley(n_permutations=2000, tolerance=150.0, seed=3, chunk_permutations=50,
+                                          processes=2)
+
+    assert serial.equals(pooled)
+    assert serial.attrs['permutations'] == pooled.attrs['permutations'] < 2000
+    assert serial['Shapley_Interest_Error'].max() <= 150.0
+
+
+def test_loan_impacts_shapley_rejects_no_permutations_or_contributors():
+    loan_impacts = LoanImpacts(principal=50000.0, rate=5.0, payment=600.0, extra_payment=0.0,
+                               contributions=[25.0, 50.0])
+    with pytest.raises(ValueError, match='permutations'):
+        loan_impacts.compute_shapley(n_permutations=0)
+
+    no_contributors = LoanImpacts(principal=50000.0, rate=5.0, payment=600.0, extra_payment=0.0, contributions=[])
+    with pytest.raises(ValueError, match='contributor'):
+        no_contributors.compute_shapley(n_permutations=100, tolerance=1.0)
+
+
+def test_schedule_cache_shares_read_only_schedules():
+    schedule_cache.clear()
+    first = Loan(principal=5000.0, rate=6.0, payment=96.66)
+    first.compute_schedule()
+    second = Loan(principal=5000.0, rate=6.0, payment=96.66)
+    second.compute_schedule()
+    uncached = Loan(principal=5000.0, rate=6.0, payment=96.66)
+    uncached.compute_schedule(use_cache=False)
+
+    assert second.schedule is first.schedule
+    assert schedule_cache.stats()['hits'] == 1 and schedule_cache.stats()['misses'] == 1
+    assert not first.schedule.block.flags.writeable
+    assert np.array_equal(uncached.schedule.block, first.schedule.block)
+    assert second.total_interest_paid == uncached.total_interest_paid
+
+    loan_impacts = LoanImpacts(principal=5000.0, rate=6.0, payment=96.66, extra_payment=0.0, contributions=[5.0, 10.0])
+    impact_df = loan_impacts.compute_impacts()
+    impact_df.loc[0, 'Interest_Paid'] = 0.0
+    assert loan_impacts.compute_impacts().equals(loan_impacts.compute_impacts(use_cache=False))
+
+
+def test_schedule_cache_evicts_least_recently_used():
+    cache = ScheduleCache(max_entries=2)
+    keys = [ScheduleCache.key('summary', principal, 6.0, 500.0, 0.0) for principal in (1000.0, 2000.0, 3000.0)]
+    compute = lambda: (np.zeros(1), np.zeros(1))
+
+    cache.get(keys[0], compute)
+    cache.get(keys[1], compute)
+    cache.get(keys[0], compute)
+    cache.get(keys[2], compute)
+    cache.get(keys[0], compute)
+    cache.get(keys[1], compute)
+
+    assert cache.stats() == {'hits': 2, 'misses': 4, 'evictions': 2, 'entries': 2, 'bytes': 2 * (16 + 64)}
+
+
+def test_table_query_pages_sorts_and_filters_schedule():
+    loan = Loan(principal=200000.0, rate=5.0, payment=1200.0)
+    loan.compute_schedule()
+    loan_schedule = loan.return_loan_schedule()
+
+    query = TableQuery(page_current=1, page_size=10, sort_by=[{'column_id': 'Applied_Interest', 'direction': 'asc'}],
+                       filter_query='{Month} s>= 12 && {End_Principal } < 50000 && {Payment} = 1200')
+    records, page_count = query.apply(loan_schedule)
+
+    expected = loan_schedule[(loan_schedule['Month'] >= 12) & (loan_schedule['End_Principal '] < 50000) &
+                             (loan_schedule['Payment'] == 1200)].sort_values('Applied_Interest')
+    assert page_count == -(-expected.shape[0] // 10)
+    assert records == expected.iloc[10:20].to_dict('records')
+    assert TableQuery.parse_filter('{Case} contains "Quit" && bad term') == [('Case', 'contains', 'Quit')]
+
+
+def test_graph_objects_figures_match_express_figures():
+    import json
+    import pandas as pd
+    import plotly.io as pio
+
+    portfolio = LoanPortfolio()
+    schedule_by_loan = []
+    for loan_id, principal, rate, payment in zip('ABC', (100000.0, 50000.0, 20000.0), (12.0, 6.0, 3.0),
+                                                 (1400.0, 600.0, 900.0)):
+        loan = Loan(principal=principal, rate=rate, payment=payment)
+        loan.compute_schedule()
+        loan_schedule = loan.return_loan_schedule()
+        loan_schedule['Loan_ID'] = loan_id
+        schedule_by_loan.append(loan_schedule)
+        portfolio.add_loan(loan)
+    loan_schedule = schedule_by_loan[0]
+    schedule_by_loan = pd.concat(schedule_by_loan).reset_index().drop('index', axis=1)
+    portfolio_schedule = portfolio.return_portfolio_schedule()
+
+    figures = [('bar_plot_loan_cashflow', (loan_schedule,)),
+               ('bar_plot_loan_balance_and_interest', (loan_schedule,)),
+               ('pie_loan', (loan_schedule, 5)),
+               ('bar_plot_portfolio_cashflow', (schedule_by_loan,)),
+               ('bar_plot_portfolio_balance_and_interest', (schedule_by_loan, portfolio_schedule)),
+               ('pie_portfolio', (schedule_by_loan, 30))]
+    for name, args in figures:
+        figure = getattr(Helper, name)
+        assert json.loads(pio.to_json(figure(*args, engine='graph_objects'))) == \
+            json.loads(pio.to_json(figure(*args))), name
+
+    with pytest.raises(ValueError):
+        Helper.pie_loan(loan_schedule, 5, engine='matplotlib')
+
+
+def test_figures_rollup_buckets_schedule_by_loan():
+    import pandas as pd
+
+    schedule_by_loan = []
+    for loan_id, payment in zip('AB', (700.0, 2000.0)):
+        loan = Loan(principal=100000.0, rate=6.0, payment=payment)
+        loan.compute_schedule()
+        loan_schedule = loan.return_loan_schedule()
+        loan_schedule['Loan_ID'] = loan_id
+        schedule_by_loan.append(loan_schedule)
+    schedule_by_loan = pd.concat(schedule_by_loan).reset_index().drop('index', axis=1)
+
+    yearly = Figures.rollup(schedule_by_loan, 'yearly')
+    for loan_id, loan_schedule in schedule_by_loan.groupby('Loan_ID'):
+        loan_yearly = yearly[yearly['Loan_ID'] == loan_id]
+        assert loan_yearly.shape[0] == -(-loan_schedule.shape[0] // 12)
+        assert list(loan_yearly['Month']) == list(range(1, loan_schedule.shape[0] + 1, 12))
+        assert abs(loan_yearly['Applied_Interest'].sum() - loan_schedule['Applied_Interest'].sum()) < 0.01
+        assert loan_yearly['Begin_Principal'].iloc[1] == loan_schedule['Begin_Principal'].iloc[12]
+        assert loan_yearly['End_Principal '].iloc[0] == loan_schedule['End_Principal '].iloc[11]
+        assert loan_yearly['Accumulated_Interest'].iloc[-1] == loan_schedule['Accumulated_Interest'].iloc[-1]
+
+    assert Figures.rollup(schedule_by_loan, 'monthly') is schedule_by_loan
+    assert Figures.bucket_months('auto', 240) == 1
+    assert Figures.bucket_months('auto', 480) == 3
+    assert Figures.bucket_months('auto', 1200) == 12
+    with pytest.raises(ValueError):
+        Figures.bucket_months('weekly', 12)
+
+
+def test_figures_switch_long_lines_to_webgl():
+    loan = Loan(principal=250000.0, rate=1.0, payment=300.0)
+    loan.compute_schedule()
+    loan_schedule = loan.return_loan_schedule()
+    assert loan_schedule.shape[0] > Figures.webgl_points
+
+    monthly = Helper.bar_plot_loan_balance_and_interest(loan_schedule, engine='graph_objects')
+    auto = Helper.bar_plot_loan_balance_and_interest(loan_schedule, engine='graph_objects', resolution='auto')
+    assert monthly.data[1].type == 'scattergl'
+    assert auto.data[1].type == 'scatter' and len(auto.data[0].x) <= Figures.auto_buckets
+
+
+def test_core_import_does_not_load_plotting_or_table_libraries():
+    import subprocess
+    import sys
+
+    probe = ('import sys, loan_analytics.main, loan_analytics.Helper; '
+             'print(" ".join(name for name in ("pandas", "plotly", "prettytable", "matplotlib") if name in sys.modules))')
+    loaded = subprocess.run([sys.executable, '-c', probe], check=True, capture_output=True, text=True).stdout.split()
+    assert loaded == []
+
+
+def test_instrumentation_records_spans_only_when_enabled():
+    instrumentation.reset()
+    loan = Loan(principal=5000.0, rate=6.0, payment=96.66)
+    loan.compute_schedule()
+    assert instrumentation.spans() == {}
+
+    instrumentation.enable()
+    try:
+        loan.check_loan_parameters()
+        loan.compute_schedule()
+        loan.compute_schedule()
+        loan.return_loan_schedule()
+        TableQuery(page_size=10).apply(loan.return_loan_schedule())
+    finally:
+        instrumentation.disable()
+
+    spans = instrumentation.spans()
+    assert spans['schedule.Loan.compute_schedule']['calls'] == 2
+    assert spans['dataframe.Loan.return_loan_schedule']['calls'] == 2
+    assert list(instrumentation.spans('validation')) == ['validation.Loan.check_loan_parameters']
+    assert instrumentation.counters() == {'serialization.rows': 10}
+    text = instrumentation.export_text(gauges={'schedule_cache_hits': 3})
+    assert 'loan_analytics_span_calls_total{stage="schedule",name="Loan.compute_schedule"} 2' in text
+    assert 'loan_analytics_schedule_cache_hits 3' in text
+    instrumentation.reset()
+
+
+def test_instrumentation_span_context():
+    local = Instrumentation()
+    with local.span('stage.disabled'):
+        pass
+    local.enable()
+    with local.span('stage.enabled'):
+        pass
+    assert list(local.spans()) == ['stage.enabled']
+
+
+def loan_tape(loans=500, seed=5):
+    import pandas as pd
+
+    generator = np.random.default_rng(seed)
+    principal = np.round(generator.uniform(5000.0, 300000.0, loans), 2)
+    rate = np.round(generator.uniform(1.0, 9.0, loans), 2)
+    months = generator.integers(24, 361, loans)
+    payment = np.round(principal * rate / 1200.0 / (1.0 - (1.0 + rate / 1200.0) ** -months), 2) + 0.02
+    return pd.DataFrame({'id': np.arange(loans) + 100, 'principal': principal, 'rate': rate, 'payment': payment,
+                         'extra_payment': np.where(generator.random(loans) < 0.3, 25.0, 0.0)})
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet'])
+def test_portfolio_from_loan_tape_matches_batch(tmp_path, file_format):
+    tape = loan_tape()
+    path = tmp_path / f'tape.{file_format}'
+    if file_format == 'csv':
+        tape.to_csv(path, index=False)
+        portfolio = LoanPortfolio.from_csv(path, chunk_loans=128, columns={'loan_id': 'id'})
+    else:
+        pytest.importorskip('pyarrow')
+        tape.to_parquet(path, row_group_size=100)
+        portfolio = LoanPortfolio.from_parquet(path, chunk_loans=128, columns={'loan_id': 'id'})
+
+    batch = LoanBatch(principal=tape['principal'], rate=tape['rate'], payment=tape['payment'],
+                      extra_payment=tape['extra_payment'])
+    batch.compute_schedule()
+
+    assert portfolio.get_loan_count() == 500 and portfolio.loans == []
+    assert np.array_equal(portfolio.book_ids, tape['id'].to_numpy())
+    assert np.array_equal(portfolio.book.time_to_loan_termination, batch.time_to_loan_termination)
+    assert np.allclose(portfolio.book.total_interest_paid, batch.total_interest_paid)
+    assert np.allclose(portfolio.schedule.block, batch.block.sum(axis=1))
+
+    loan = Loan(principal=1000.0, rate=12.0, payment=100.0)
+    loan.compute_schedule()
+    portfolio.add_loan(loan)
+    running = portfolio.schedule.block.copy()
+    portfolio.aggregate()
+    assert np.allclose(running, portfolio.schedule.block)
+
+
+def test_portfolio_from_loan_tape_streams_book_to_csv(tmp_path):
+    import pandas as pd
+
+    tape = loan_tape(loans=200)
+    tape.to_csv(tmp_path / 'tape.csv', index=False)
+    portfolio = LoanPortfolio.from_csv(tmp_path / 'tape.csv', chunk_loans=64)
+    Helper.write_csv(portfolio, tmp_path / 'schedule.csv')
+    written = pd.read_csv(tmp_path / 'schedule.csv')
+    assert written.shape[0] == len(portfolio.schedule) > 0
+    assert np.allclose(written['Payment'], portfolio.schedule.payment.round(2))
+
+    loan = Loan(principal=100000.0, rate=3.0, payment=400.0)
+    loan.compute_schedule()
+    portfolio.add_loan(loan)
+    rows = list(portfolio.iter_schedule(chunk_months=50))
+    assert len(rows) == len(portfolio.schedule) == len(loan.schedule)
+    assert np.allclose(np.array(rows)[:, 1:].T, portfolio.schedule.block)
+
+
+def test_portfolio_from_loan_tape_reports_invalid_rows(tmp_path):
+    tape = loan_tape(loans=300)
+    tape.loc[260, 'payment'] = 1.0
+    tape.to_csv(tmp_path / 'tape.csv', index=False)
+    with pytest.raises(ValueError, match='Loan 260: Payment'):
+        LoanPortfolio.from_csv(tmp_path / 'tape.csv', chunk_loans=100)
+
+    tape.drop(columns='rate').to_csv(tmp_path / 'no_rate.csv', index=False)
+    with pytest.raises(ValueError, match='no rate column'):
+        LoanPortfolio.from_csv(tmp_path / 'no_rate.csv')
+
+    tape = loan_tape(loans=300)
+    tape['id'] = [f'L-{index}' for index in range(300)]
+    tape.to_csv(tmp_path / 'string_ids.csv', index=False)
+    with pytest.raises(ValueError, match='id column must hold integer loan ids'):
+        LoanPortfolio.from_csv(tmp_path / 'string_ids.csv', columns={'loan_id': 'id'}, store=tmp_path / 'store')
+    assert len(ScheduleStore(tmp_path / 'store')) == 0
+
+
+def test_schedule_io_round_trips_portfolio_by_loan(tmp_path):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+
+    tape = loan_tape(loans=300)
+    tape.to_csv(tmp_path / 'tape.csv', index=False)
+    portfolio = LoanPortfolio.from_csv(tmp_path / 'tape.csv', chunk_loans=128, columns={'loan_id': 'id'})
+    loan = Loan(principal=1000.0, rate=12.0, payment=100.0)
+    loan.compute_schedule()
+    loan_id = portfolio.add_loan(loan)
+
+    rows = ScheduleIO.write_arrow(tmp_path / 'schedules.arrow', portfolio, chunk_loans=64)
+    assert rows == portfolio.book.time_to_loan_termination.sum() + len(loan.schedule)
+    assert ScheduleIO.write_parquet(tmp_path / 'schedules.parquet', portfolio, chunk_loans=64) == rows
+    table = pq.read_table(tmp_path / 'schedules.parquet')
+    assert table.num_rows == rows and pq.ParquetFile(tmp_path / 'schedules.parquet').num_row_groups == 6
+
+    batch = LoanBatch(principal=tape['principal'], rate=tape['rate'], payment=tape['payment'],
+                      extra_payment=tape['extra_payment'])
+    batch.compute_schedule()
+    with ScheduleIO(tmp_path / 'schedules.arrow') as reader:
+        assert len(reader) == 301 and 105 in reader and 99 not in reader
+        assert np.array_equal(reader.loan_schedule(loan_id).block, loan.schedule.block)
+        for index in (0, 63, 64, 299):
+            assert np.allclose(reader.loan_schedule(100 + index).block, batch.loan_schedule(index).block)
+        with pytest.raises(KeyError):
+            reader.loan_schedule(99)
+
+    ScheduleIO.write_arrow(tmp_path / 'portfolio.arrow', portfolio.schedule)
+    with ScheduleIO(tmp_path / 'portfolio.arrow') as reader:
+        assert np.allclose(reader.loan_schedule(0).block, portfolio.schedule.block)
+
+
+def test_schedule_io_writes_batches_without_schedules(tmp_path):
+    pytest.importorskip('pyarrow')
+
+    tape = loan_tape(loans=100)
+    computed = LoanBatch(principal=tape['principal'], rate=tape['rate'], payment=tape['payment'],
+                         extra_payment=tape['extra_payment'])
+    computed.compute_schedule()
+    summarized = LoanBatch(principal=tape['principal'], rate=tape['rate'], payment=tape['payment'],
+                           extra_payment=tape['extra_payment'])
+    summarized.compute_summary()
+
+    rows = ScheduleIO.write_arrow(tmp_path / 'summarized.arrow', summarized, chunk_loans=32)
+    assert rows == ScheduleIO.write_arrow(tmp_path / 'computed.arrow', computed) == \
+        computed.time_to_loan_termination.sum()
+    with ScheduleIO(tmp_path / 'summarized.arrow') as reader:
+        for index in (0, 31, 32, 99):
+            assert np.allclose(reader.loan_schedule(index).block, computed.loan_schedule(index).block)
+
+
+def test_schedule_io_keeps_added_loans_apart_from_an_id_less_book(tmp_path):
+    pytest.importorskip('pyarrow')
+
+    tape = loan_tape(loans=2)
+    tape.drop(columns='id').to_csv(tmp_path / 'tape.csv', index=False)
+    portfolio = LoanPortfolio.from_csv(tmp_path / 'tape.csv')
+    loan = Loan(principal=1000.0, rate=12.0, payment=100.0)
+    loan.compute_schedule()
+    loan_id = portfolio.add_loan(loan)
+    assert loan_id not in portfolio.book_ids
+
+    ScheduleIO.write_arrow(tmp_path / 'schedules.arrow', portfolio)
+    with ScheduleIO(tmp_path / 'schedules.arrow') as reader:
+        assert np.array_equal(reader.loan_ids(), np.sort(np.r_[portfolio.book_ids, loan_id]))
+        assert np.array_equal(reader.loan_schedule(loan_id).block, loan.schedule.block)
+        first = Loan(*tape.loc[0, ['principal', 'rate', 'payment', 'extra_payment']])
+        first.compute_schedule(use_cache=False)
+        assert np.allclose(reader.loan_schedule(portfolio.book_ids[0]).block, first.schedule.block)
+
+    portfolio.book_ids[1] = loan_id
+    with pytest.raises(ValueError, match='not unique'):
+        ScheduleIO.write_arrow(tmp_path / 'duplicates.arrow', portfolio)
+
+
+def test_schedule_store_streams_aggregate_rollup_and_lookup(tmp_path):
+    tape = loan_tape(loans=300)
+    tape.to_csv(tmp_path / 'tape.csv', index=False)
+    portfolio = LoanPortfolio.from_csv(tmp_path / 'tape.csv', chunk_loans=128, columns={'loan_id': 'id'},
+                                       store=tmp_path / 'store')
+    batch = LoanBatch(principal=tape['principal'], rate=tape['rate'], payment=tape['payment'],
+                      extra_payment=tape['extra_payment'])
+    batch.compute_schedule()
+
+    store = ScheduleStore(tmp_path / 'store')
+    assert len(store) == 300 and np.array_equal(store.loan_ids(), tape['id'].to_numpy())
+    schedule, counts = store.aggregate()
+    assert np.allclose(schedule.block, portfolio.schedule.block)
+    assert np.array_equal(counts, (np.arange(1, schedule.block.shape[1] + 1)[:, None]
+                                   <= batch.time_to_loan_termination).sum(axis=1))
+    for index in (0, 127, 128, 299):
+        assert np.allclose(store.loan_schedule(100 + index).block, batch.loan_schedule(index).block)
+    with pytest.raises(KeyError):
+        store.loan_schedule(99)
+
+    yearly = store.rollup(tmp_path / 'yearly', resolution='yearly')
+    loan = batch.loan_schedule(5)
+    rolled = yearly.loan_schedule(105)
+    assert len(rolled) == -(-len(loan) // 12)
+    assert np.allclose(rolled.applied_interest, np.add.reduceat(loan.applied_interest, np.arange(0, len(loan), 12)))
+    assert np.allclose(rolled.begin_principal, loan.begin_principal[::12])
+    assert np.isclose(rolled.end_principal[0], loan.end_principal[11]) and rolled.end_principal[-1] == 0.0
+    assert np.allclose(yearly.aggregate()[0].payment.sum(), schedule.payment.sum())
+
+    with pytest.raises(ValueError, match='already holds loans'):
+        LoanPortfolio.from_csv(tmp_path / 'tape.csv', store=tmp_path / 'store')
+    assert len(ScheduleStore(tmp_path / 'store')) == 300
+    store.clear()
+    portfolio = LoanPortfolio.from_csv(tmp_path / 'tape.csv', store=tmp_path / 'store')
+    assert len(store) == 0 and len(ScheduleStore(tmp_path / 'store')) == 300
+    assert np.allclose(ScheduleStore(tmp_path / 'store').aggregate()[0].block, portfolio.schedule.block)
+
+    # a failed append leaves no file behind, and chunks interrupted while written are ignored and cleared
+    store = ScheduleStore(tmp_path / 'store')
+    with pytest.raises(ValueError, match='must be integers'):
+        store.append(np.array(['L-1', 'L-2']), batch.time_to_loan_termination[:2], batch.block[:, :2])
+    assert len(list((tmp_path / 'store').iterdir())) == 3
+    np.save(tmp_path / 'store' / 'chunk000001.loan_ids.npy', np.arange(2))
+    reopened = ScheduleStore(tmp_path / 'store')
+    assert len(reopened) == 300
+    reopened.clear()
+    assert list((tmp_path / 'store').iterdir()) == [] and len(ScheduleStore(tmp_path / 'store')) == 0
+
+
+def test_parallel_portfolio_is_deterministic_across_workers():
+    tape = loan_tape(loans=300)
+    results = []
+    for workers in (None, 1, 3):
+        portfolio = LoanPortfolio()
+        for principal, rate, payment, extra_payment in tape[['principal', 'rate', 'payment',
+                                                             'extra_payment']].itertuples(index=False):
+            portfolio.add_loan(Loan(principal=principal, rate=rate, payment=payment, extra_payment=extra_payment))
+        portfolio.compute_schedule(workers=workers, shard_loans=64)
+        results.append(portfolio)
+    serial, single, pooled = results
+
+    assert np.array_equal(single.schedule.block, pooled.schedule.block)
+    assert np.allclose(serial.schedule.block, pooled.schedule.block)
+    for index in (0, 63, 64, 299):
+        assert np.array_equal(single.loans[index].schedule.block, pooled.loans[index].schedule.block)
+        assert np.allclose(serial.loans[index].schedule.block, pooled.loans[index].schedule.block)
+        assert serial.loans[index].time_to_loan_termination == pooled.loans[index].time_to_loan_termination
+        assert np.isclose(serial.loans[index].total_interest_paid, pooled.loans[index].total_interest_paid)
+
+    running = pooled.schedule.block.copy()
+    pooled.aggregate()
+    assert np.allclose(running, pooled.schedule.block)
+
+    # loans are bound to their batch row and only built on first access, also when they are removed
+    assert 'schedule' not in vars(single.loans[10])
+    single.remove_loan(single.loan_ids[10])
+    serial.remove_loan(serial.loan_ids[10])
+    assert np.allclose(single.schedule.block, serial.schedule.block)
+    running = single.schedule.block.copy()
+    single.aggregate()
+    assert np.allclose(running, single.schedule.block)
+
+    # a bound loan recomputed on its own no longer reads any field from its batch row
+    loan = serial.loans[20]
+    assert 'schedule' not in vars(loan)
+    loan.payment += 100.0
+    loan.compute_summary(use_cache=False)
+    expected = Loan(principal=loan.principal, rate=loan.rate, payment=loan.payment, extra_payment=loan.extra_payment)
+    expected.compute_summary(use_cache=False)
+    assert len(loan.schedule) == 0 and loan.time_to_loan_termination == expected.time_to_loan_termination
+    loan.compute_schedule(use_cache=False)
+    assert loan.time_to_loan_termination == len(loan.schedule) == expected.time_to_loan_termination
+
+
+@pytest.mark.parametrize('rounding', ['half_up', 'half_even', 'half_down', 'up', 'down'])
+def test_cents_backend_matches_decimal_servicer_schedule(rounding):
+    import decimal
+
+    modes = {'half_up': decimal.ROUND_HALF_UP, 'half_even': decimal.ROUND_HALF_EVEN,
+             'half_down': decimal.ROUND_HALF_DOWN, 'up': decimal.ROUND_UP, 'down': decimal.ROUND_DOWN}
+    for principal, rate, payment, extra_payment in [(68000.0, 4.37, 899.0, 10.0), (27000.0, 4.0, 150.0, 25.0),
+                                                    (10000.0, 0.0, 333.33, 0.0)]:
+        balance, expected = decimal.Decimal(str(principal)), []
+        while balance > 0:
+            interest = (balance * decimal.Decimal(str(rate)) / 1200).quantize(decimal.Decimal('0.01'),
+                                                                               rounding=modes[rounding])
+            applied_principal = min(decimal.Decimal(str(payment + extra_payment)) - interest, balance)
+            expected.append((int(balance * 100), int(interest * 100), int(applied_principal * 100)))
+            balance -= applied_principal
+
+        loan = Loan(principal=principal, rate=rate, payment=payment, extra_payment=extra_payment)
+        loan.compute_schedule(backend='cents', rounding=rounding)
+        cents = CentsAmortization.schedule(principal, rate, payment, extra_payment, rounding)
+        assert [tuple(row) for row in cents[[0, 4, 3]].T.tolist()] == expected
+        assert loan.time_to_loan_termination == len(expected)
+        assert loan.total_interest_paid == sum(interest for _, interest, _ in expected) / 100
+        assert loan.total_principal_paid == principal
+
+    tape = loan_tape(loans=200)
+    batch = LoanBatch(principal=tape['principal'], rate=tape['rate'], payment=tape['payment'],
+                      extra_payment=tape['extra_payment'])
+    batch.compute_schedule(backend='cents', rounding=rounding)
+    for index in (0, 57, 199):
+        loan = batch.loan(index)
+        single = CentsAmortization.schedule(loan.principal, loan.rate, loan.payment, loan.extra_payment, rounding)
+        assert np.array_equal(batch.loan_schedule(index).block, single / 100.0)
+        assert batch.total_interest_paid[index] == single[4].sum() / 100.0
+    assert np.array_equal(batch.total_principal_paid, tape['principal'].to_numpy())
+
+    with pytest.raises(ValueError, match='Unknown rounding mode'):
+        CentsAmortization.schedule(1000.0, 5.0, 100.0, rounding='bankers')
+
+
+def test_cents_loans_stream_and_export_their_own_schedule(tmp_path):
+    import pandas as pd
+
+    loan = Loan(principal=68000.0, rate=4.37, payment=899.0, extra_payment=10.0)
+    loan.compute_schedule(backend='cents', rounding='down')
+    rows = np.array(list(loan.iter_schedule(chunk_months=25)))
+    assert np.array_equal(rows[:, 1:].T, loan.schedule.block)
+
+    Helper.write_csv(loan, tmp_path / 'cents.csv')
+    assert np.array_equal(pd.read_csv(tmp_path / 'cents.csv')['Applied_Interest'], loan.schedule.applied_interest)
+
+    portfolio = LoanPortfolio()
+    portfolio.add_loan(loan)
+    rows = np.array(list(portfolio.iter_schedule(chunk_months=25)))
+    assert np.array_equal(rows[:, 1:].T, loan.schedule.block)
+
+
+def test_loan_solver_inverts_the_schedule_engine():
+    generator = np.random.default_rng(11)
+    principal = np.round(generator.uniform(1000.0, 500000.0, 2000), 2)
+    rate = np.round(generator.uniform(0.0, 12.0, 2000), 2)
+    rate[:50] = 0.0
+    months = generator.integers(1, 481, 2000)
+    extra_payment = np.where(generator.random(2000) < 0.3, 25.0, 0.0)
+
+    payment = LoanSolver.payment_for_term(principal, rate, months, extra_payment)
+    paying = payment > 0.0
+    assert np.all(LoanSolver.term_for_payment(principal, rate, payment, extra_payment)[paying] <= months[paying])
+    assert np.all(LoanSolver.term_for_payment(principal[paying], rate[paying], payment[paying] - 0.01,
+                                              extra_payment[paying]) > months[paying])
+
+    affordable = LoanSolver.max_principal(rate, payment, months, extra_payment)
+    assert np.all(affordable >= principal)
+    assert np.all(Amortization.term(affordable, rate, payment, extra_payment) <= months)
+
+    assert float(LoanSolver.payment_for_term(250000.0, 6.0, 360)) == 1498.88
+    loan = Loan(principal=250000.0, rate=6.0, payment=1498.88)
+    loan.compute_schedule()
+    assert loan.time_to_loan_termination == 360
+    assert float(LoanSolver.max_principal(0.0, 100.0, 12, extra_payment=50.0)) == 1800.0
+    with pytest.raises(ValueError, match='Term must be at least 1 month'):
+        LoanSolver.payment_for_term(1000.0, 5.0, 0)
+
+
+def test_loan_solver_apr_and_portfolio_irr():
+    tape = loan_tape(loans=300)
+    fees = np.round(tape['principal'].to_numpy() * 0.02, 2)
+    apr, converged = LoanSolver.apr(tape['principal'], tape['rate'], tape['payment'], tape['extra_payment'])
+    assert converged.all() and np.allclose(apr, tape['rate'], atol=1e-8)
+    apr, converged = LoanSolver.apr(tape['principal'], tape['rate'], tape['payment'], tape['extra_payment'], fees)
+    assert converged.all() and np.all(apr > tape['rate'])
+
+    batch = LoanBatch(principal=tape['principal'], rate=tape['rate'], payment=tape['payment'],
+                      extra_payment=tape['extra_payment'])
+    batch.compute_schedule()
+    cash_flows = np.concatenate([(fees - batch.principal)[:, None], batch.applied_principal + batch.applied_interest],
+                                axis=1)
+    monthly, converged = LoanSolver.irr(cash_flows)
+    assert converged.all() and np.allclose(monthly * 1200.0, apr, atol=1e-7)
+    effective, _ = LoanSolver.apr(tape['principal'], tape['rate'], tape['payment'], tape['extra_payment'], fees,
+                                  effective=True)
+    assert np.allclose(effective, ((1.0 + monthly) ** 12 - 1.0) * 100.0)
+
+    portfolio = LoanPortfolio()
+    for principal, payment in ((250000.0, 1498.88), (150000.0, 1265.79), (50000.0, 555.11)):
+        loan = Loan(principal=principal, rate=6.0, payment=payment)
+        loan.compute_schedule()
+        portfolio.add_loan(loan)
+    monthly, converged = LoanSolver.irr(LoanSolver.cash_flows(portfolio.schedule))
+    assert converged[0] and np.isclose(monthly[0] * 1200.0, 6.0)
+
+    _, converged = LoanSolver.irr(cash_flows, max_iterations=2)
+    assert not converged.all()
+    monthly, converged = LoanSolver.irr([100.0, 50.0, 25.0])
+    assert np.isnan(monthly[0]) and not converged[0]
+    with pytest.raises(ValueError, match='Fees must be'):
+        LoanSolver.apr(1000.0, 5.0, 100.0, fees=1000.0)
@@ -1,30 +1,29 @@
-from loan_analytics.Helper import *
 from loan_analytics.Loan import *
 from loan_analytics.LoanPortfolio import *
 from loan_analytics.LoanImpacts import *
-
-import pandas as pd
-import numpy as np
+from loan_analytics.LoanBatch import LoanBatch
 
 loans = LoanPortfolio()
 
 
 def add_and_compute_schedule(principal, rate, payment, extra_payment):
+    
+    return add_and_compute_schedules([principal], [rate], [payment], [extra_payment])
+
+def add_and_compute_schedules(principals, rates, payments, extra_payments):
 
-    loan = None
+    batch = LoanBatch(principal=principals, rate=rates, payment=payments, extra_payment=extra_payments)
     try:
-        loan = Loan(principal=principal, rate=rate, payment=payment, extra_payment=extra_payment)
-        loan.check_loan_parameters()
-        loan.compute_schedule()
+        batch.check_loan_parameters()
+        batch.compute_schedule()
     except ValueError as ex:
         print(ex)
-    loans.add_loan(loan)
-    # Helper.plot(loan)
-    # Helper.print(loan)
-    loans.return_portfolio_schedule
+        return loans
+    for index in range(batch.get_loan_count()):
+        loans.add_loan(batch.loan(index))
 
-    print(round(loan.total_principal_paid, 2), round(loan.total_interest_paid, 2),
-          round(loan.time_to_loan_termination, 0))
+        print(round(batch.total_principal_paid[index], 2), round(batch.total_interest_paid[index], 2),
+              round(batch.time_to_loan_termination[index], 0))
     
     return loans
 